@@ -50,9 +50,77 @@
 >>> print(config.init_capital)  # 获取初始资金
 """
 import json
+import mmap
+import os
 from typing import Dict, List, Optional, Any
 import time
 
+# orjson 为可选依赖，解析速度明显快于标准库 json；未安装时回退到 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 配置字段映射表：{配置块: ((键名, 属性名, 默认值), ...)}
+# run_mode、session_id、stock_pool 的取值规则特殊，在 KhConfig.__init__ 中单独处理
+_CONFIG_FIELDS = {
+    # ========== 系统配置 ==========
+    "system": (
+        ("userdata_path", "userdata_path", ""),
+        ("check_interval", "check_interval", 3),
+    ),
+    # ========== 账户配置 ==========
+    "account": (
+        ("account_id", "account_id", "test_account"),
+        ("account_type", "account_type", "SECURITY_ACCOUNT"),
+    ),
+    # ========== 回测配置 ==========
+    "backtest": (
+        ("start_time", "backtest_start", "20240101"),
+        ("end_time", "backtest_end", "20241231"),
+        ("init_capital", "init_capital", 1000000),      # 默认100万
+    ),
+    # ========== 数据配置 ==========
+    "data": (
+        ("kline_period", "kline_period", "1d"),
+    ),
+    # ========== 风控配置 ==========
+    "risk": (
+        ("position_limit", "position_limit", 0.95),     # 默认95%仓位上限
+        ("order_limit", "order_limit", 100),            # 默认单日100次
+        ("loss_limit", "loss_limit", 0.1),              # 默认10%止损
+    ),
+}
+
+# 缺失配置块时共用的空字典（只读使用，不会被修改）
+_EMPTY_BLOCK: Dict = {}
+
+
+def _read_json_file(path: str) -> Any:
+    """读取并解析 JSON 文件
+    
+    以只读内存映射方式打开文件，直接解析原始字节，省去文本解码的中间拷贝。
+    
+    Args:
+        path: JSON 文件路径
+    
+    Returns:
+        Any: 解析后的对象
+    
+    Raises:
+        FileNotFoundError: 文件不存在
+        json.JSONDecodeError: 文件格式错误（orjson 的异常类型也是其子类）
+    """
+    with open(path, 'rb') as f:
+        # 空文件无法建立内存映射，直接交给解析器报错
+        if os.fstat(f.fileno()).st_size == 0:
+            return json.loads(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if orjson is not None:
+                with memoryview(mm) as view:
+                    return orjson.loads(view)
+            return json.loads(mm[:])
+
 
 class KhConfig:
     """配置管理类
@@ -85,6 +153,14 @@ class KhConfig:
         >>> print(f"股票池: {config.stock_pool}")
     """
     
+    # 字段固定，使用 __slots__ 省去实例 __dict__，属性读取走描述符
+    __slots__ = (
+        'config_path', 'config_dict', 'run_mode', 'userdata_path', 'session_id',
+        'check_interval', 'account_id', 'account_type', 'backtest_start',
+        'backtest_end', 'init_capital', 'kline_period', 'stock_pool',
+        'position_limit', 'order_limit', 'loss_limit',
+    )
+    
     def __init__(self, config_path: str):
         """初始化配置管理器
         
@@ -100,40 +176,26 @@ class KhConfig:
         self.config_path = config_path  # 保存配置文件路径
         
         # 加载配置文件
-        with open(config_path, 'r', encoding='utf-8') as f:
-            self.config_dict = json.load(f)
+        self.config_dict = _read_json_file(config_path)
+        
+        config_dict = self.config_dict
         
-        # ========== 系统配置 ==========
+        # 按映射表逐块绑定常规字段，每个配置块只查找一次
+        for block_name, fields in _CONFIG_FIELDS.items():
+            block = config_dict.get(block_name) or _EMPTY_BLOCK
+            for key, attr, default in fields:
+                setattr(self, attr, block.get(key, default))
+        
+        system_config = config_dict.get("system") or _EMPTY_BLOCK
         # run_mode 可能在根级别或 system 块中
-        self.run_mode = self.config_dict.get("run_mode") or \
-                       self.config_dict.get("system", {}).get("run_mode", "backtest")
-        self.userdata_path = self.config_dict.get("system", {}).get("userdata_path", "")
-        self.session_id = self.config_dict.get("system", {}).get("session_id", int(time.time()))
-        self.check_interval = self.config_dict.get("system", {}).get("check_interval", 3)
-        
-        # ========== 账户配置 ==========
-        account_config = self.config_dict.get("account", {})
-        self.account_id = account_config.get("account_id", "test_account")
-        self.account_type = account_config.get("account_type", "SECURITY_ACCOUNT")
-        
-        # ========== 回测配置 ==========
-        backtest_config = self.config_dict.get("backtest", {})
-        self.backtest_start = backtest_config.get("start_time", "20240101")
-        self.backtest_end = backtest_config.get("end_time", "20241231")
-        self.init_capital = backtest_config.get("init_capital", 1000000)  # 默认100万
-        
-        # ========== 数据配置 ==========
-        data_config = self.config_dict.get("data", {})
-        self.kline_period = data_config.get("kline_period", "1d")
+        self.run_mode = config_dict.get("run_mode") or system_config.get("run_mode", "backtest")
+        # 未配置 session_id 时才取当前时间戳
+        self.session_id = system_config["session_id"] if "session_id" in system_config else int(time.time())
+        
+        data_config = config_dict.get("data") or _EMPTY_BLOCK
         # 兼容性处理：优先使用 stock_list，其次使用 stock_pool
         self.stock_pool = data_config.get("stock_list", data_config.get("stock_pool", []))
         
-        # ========== 风控配置 ==========
-        risk_config = self.config_dict.get("risk", {})
-        self.position_limit = risk_config.get("position_limit", 0.95)  # 默认95%仓位上限
-        self.order_limit = risk_config.get("order_limit", 100)         # 默认单日100次
-        self.loss_limit = risk_config.get("loss_limit", 0.1)           # 默认10%止损
-        
     @property
     def initial_cash(self) -> float:
         """获取初始资金
@@ -192,8 +254,7 @@ class KhConfig:
             Exception: 加载失败时抛出异常
         """
         try:
-            with open(self.config_path, "r", encoding="utf-8") as f:
-                return json.load(f)
+            return _read_json_file(self.config_path)
         except Exception as e:
             raise Exception(f"加载配置文件失败: {str(e)}")
             
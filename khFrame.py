@@ -80,7 +80,7 @@ from xtquant import xtconstant
 
 from khTrade import KhTradeManager
 from khRisk import KhRiskManager
-from khQTTools import KhQuTools, determine_pool_type, format_price, round_price, get_price_decimals, check_t0_support, get_t0_details
+from khQTTools import KhQuTools, determine_pool_type, format_price, round_price, get_price_decimals, check_t0_support, get_t0_details, clear_ma_cache
 from khConfig import KhConfig
 
 import numpy as np
@@ -991,9 +991,10 @@ class KhQuantFramework:
             if self.trader_callback:
                 self.trader_callback.gui.log_message(f"交易接口初始化耗时: {init_time:.2f}秒", "INFO")
             
-            # 初始化缓存
+            # 初始化缓存（khMA 的滑动窗口缓存为模块级，同样在每次运行开始时清空）
             self.daily_price_cache = {}
             self._cached_benchmark_close = {}
+            clear_ma_cache()
             
             # 直接从设置界面读取是否初始化数据的配置
             from PyQt5.QtCore import QSettings
@@ -11,9 +11,11 @@
     - `is_trade_time()`: 判断当前是否在交易时间内
     - `is_trade_day()`: 判断指定日期是否为交易日
     - `get_trade_days_count()`: 计算日期范围内的交易日数量
+    - `iter_trade_days()`: 按顺序逐个产出日期范围内的交易日
 
 **股票类型判断**：
     - `is_etf()`: 判断是否为 ETF 产品
+    - `is_etf_batch()`: 批量判断一组代码是否为 ETF 产品
     - `determine_pool_type()`: 判断股票池类型（股票/ETF/混合）
 
 **T+0 支持**：
@@ -33,6 +35,8 @@
 **数据获取**：
     - `khHistory()`: 获取历史行情数据
     - `khMA()`: 计算移动平均线
+    - `khMA_batch()`: 批量计算多个标的的移动平均序列
+    - `clear_ma_cache()`: 清空 khMA 的滑动窗口缓存（框架在每次运行开始时调用）
 
 使用方式
 --------
@@ -54,8 +58,12 @@
 - 本模块在子进程中会自动禁用 Qt 相关功能
 - T+0 ETF 列表从 data/T0型ETF.csv 加载
 - 交易日判断依赖 holidays 库的中国节假日数据
+- pandas 与 xtquant.xtdata 延迟到首次使用时才真正导入
 """
 
+# 注解不在定义时求值，避免 pd.DataFrame 等类型注解提前触发延迟导入
+from __future__ import annotations
+
 # 多进程保护 - 防止在子进程中意外启动Qt应用
 import sys
 import os
@@ -70,30 +78,116 @@ def is_subprocess():
     except:
         return False
 
+# 导入期的进程判断只做一次，供下方各处模块级分支复用
+_IMPORTED_IN_SUBPROCESS = is_subprocess()
+
 # 只在子进程中设置环境变量
-if is_subprocess():
+if _IMPORTED_IN_SUBPROCESS:
     os.environ['QT_QPA_PLATFORM'] = 'offscreen'
     os.environ['QT_LOGGING_RULES'] = 'qt.*=false'
 
 import csv
+import io
 import time
+import types
+import importlib
 from datetime import datetime, timedelta
-import pandas as pd
-from xtquant import xtdata
+
+
+class _LazyModule(types.ModuleType):
+    """延迟导入的模块代理：首次访问属性时才用 importlib.import_module 真正导入模块
+
+    不使用 importlib.util.LazyLoader：Python 3.11 中 LazyLoader 的首次属性访问不是线程安全的，
+    多个线程同时触发加载时，其它线程会看到尚未初始化完成的模块。import_module 受导入锁保护，
+    并发调用时后到的线程会等待导入完成，始终取到完整的模块。
+    导入完成后把本模块中对应的全局名改为指向真实模块，之后的访问不再经过代理。
+    """
+
+    def __init__(self, name: str, global_name: str):
+        super().__init__(name)
+        self.__dict__['_lazy_global_name'] = global_name
+        self.__dict__['_lazy_module'] = None
+
+    def _lazy_load(self):
+        module = self.__dict__['_lazy_module']
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__['_lazy_module'] = module
+            globals()[self.__dict__['_lazy_global_name']] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._lazy_load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._lazy_load(), attr, value)
+
+
+def _lazy_import(name: str, global_name: str):
+    """延迟导入模块：立即返回模块代理，首次访问其属性时才导入真实模块
+    
+    只用到交易日、ETF判断等轻量工具时，可省去 pandas/xtquant 的导入开销。
+    模块已导入时直接返回模块本身；模块不存在时在首次访问属性时抛出 ImportError。
+    
+    Args:
+        name: 模块全名，如 'pandas'、'xtquant.xtdata'
+        global_name: 本模块中引用该模块的全局变量名，导入完成后改为指向真实模块
+        
+    Returns:
+        module: 模块对象或模块代理
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return _LazyModule(name, global_name)
+
+
+def _ensure_loaded(*modules) -> None:
+    """在启动线程池之前，于调用线程上完成延迟模块的导入
+
+    代理本身是线程安全的；提前导入可避免各工作线程在导入期间排队等待，
+    也让导入错误直接在调用方抛出，而不是出现在某个工作线程中。
+
+    Args:
+        *modules: 模块或 _lazy_import 返回的模块代理，如 pd、xtdata
+    """
+    for module in modules:
+        if isinstance(module, _LazyModule):
+            module._lazy_load()
+
+
+pd = _lazy_import('pandas', 'pd')
+xtdata = _lazy_import('xtquant.xtdata', 'xtdata')
 # from xtquant.xtdata import get_client
 import glob
+import shutil
 import numpy as np
 import logging
 import ast
+import json
+import re
+try:
+    import orjson  # 可选依赖：Rust 实现的 JSON 解析，安装后优先使用
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
 import holidays  # 添加这个导入，用于处理holidays.China()
 from typing import Dict, List, Union, Optional
 import math
-from khTrade import KhTradeManager
+import pickle
+from bisect import bisect_left, bisect_right
+import threading
+import weakref
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import lru_cache, partial
+from itertools import repeat
+from operator import itemgetter
+from pathlib import Path
 from types import SimpleNamespace
 
 # 延迟导入Qt相关模块，避免在子进程中意外启动Qt应用
 try:
-    if not is_subprocess():
+    if not _IMPORTED_IN_SUBPROCESS:
         # 在主进程中正常导入Qt模块
         from PyQt5.QtCore import QThread, pyqtSignal
     else:
@@ -131,11 +225,85 @@ _trading_periods = [
     ("093000", "113000"),  # 上午
     ("130000", "150000")   # 下午
 ]
-_cn_holidays = holidays.China()
+# 日内频率（均线等计算需结合交易时间判断）
+_INTRADAY_FREQS = frozenset(('1m', '5m', 'tick'))
+
+# 交易时段的当日秒数表示，供is_trade_time做整数比较
+_AM_START, _AM_END = 9 * 3600 + 30 * 60, 11 * 3600 + 30 * 60
+_PM_START, _PM_END = 13 * 3600, 15 * 3600
+# holidays.China() 在首次使用时才构建，见 _get_cn_holidays()
+_cn_holidays = None
+
+# 预计算法定节假日的日期序数（date.toordinal()），覆盖范围外的日期回退到holidays库查询
+_HOLIDAY_YEARS = range(2000, 2040)
+_HOLIDAY_ORDINAL_MIN = datetime(_HOLIDAY_YEARS[0], 1, 1).toordinal()
+_HOLIDAY_ORDINAL_MAX = datetime(_HOLIDAY_YEARS[-1], 12, 31).toordinal()
+_holiday_ordinals = None
+_holiday_datetime64 = None
+_trade_day_bitmap = None
 
 # 默认价格精度（股票为2位，ETF为3位）
 _default_price_decimals = 2
+# round_price(half_up=True) 按小数位数使用的缩放系数
+_PRICE_SCALES = (1.0, 10.0, 100.0, 1000.0, 10000.0)
+
+# ETF代码前缀：上海为2位前缀，深圳统一为159
+_SH_ETF_PREFIXES = ('51', '52', '53', '55', '56', '58')
+_SZ_ETF_PREFIX = '159'
+# 前缀的ASCII整数编码，供批量分类时做数组比较
+_SH_ETF_PREFIX_CODES = np.array([(ord(p[0]) << 8) | ord(p[1]) for p in _SH_ETF_PREFIXES], dtype=np.uint32)
+_SH_ETF_PREFIX_SET = frozenset(int(c) for c in _SH_ETF_PREFIX_CODES)
+_SZ_ETF_PREFIX_CODE = (ord(_SZ_ETF_PREFIX[0]) << 16) | (ord(_SZ_ETF_PREFIX[1]) << 8) | ord(_SZ_ETF_PREFIX[2])
+
+# ==================== 本地缓存相关函数 ====================
+
+def _get_cache_dir() -> str:
+    """获取本地缓存目录（位于用户数据目录下的 cache 子目录）"""
+    if os.name == 'nt':  # Windows
+        user_data_dir = os.path.join(os.path.expanduser('~'), 'AppData', 'Local', 'KhQuant')
+    else:  # Linux/Mac
+        user_data_dir = os.path.join(os.path.expanduser('~'), '.khquant')
+    return os.path.join(user_data_dir, 'cache')
+
+def _load_pickle_cache(name: str, key: tuple):
+    """读取本地pickle缓存
+    
+    Args:
+        name: 缓存文件名
+        key: 缓存键，与写入时的键不一致（如数据源已变化）则视为失效
+        
+    Returns:
+        缓存的对象，缓存不存在、失效或损坏时返回None
+    """
+    cache_file = os.path.join(_get_cache_dir(), name)
+    try:
+        with open(cache_file, 'rb') as f:
+            cached_key, value = pickle.load(f)
+    except Exception:
+        return None
+    return value if cached_key == key else None
+
+def _save_pickle_cache(name: str, key: tuple, value) -> None:
+    """写入本地pickle缓存，失败时仅记录日志，不影响调用方
+    
+    Args:
+        name: 缓存文件名
+        key: 缓存键
+        value: 要缓存的对象
+    """
+    cache_dir = _get_cache_dir()
+    cache_file = os.path.join(cache_dir, name)
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(tmp_file, 'wb') as f:
+            pickle.dump((key, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        # 先写临时文件再替换，避免多进程同时读到半截文件
+        os.replace(tmp_file, cache_file)
+    except Exception as e:
+        logging.debug(f"写入缓存 {cache_file} 失败: {e}")
 
+@lru_cache(maxsize=4096)
 def is_etf(stock_code: str) -> bool:
     """判断是否为ETF（不包括LOF）
     
@@ -150,15 +318,48 @@ def is_etf(stock_code: str) -> bool:
         深圳ETF: 159开头（深交所ETF统一为159开头）
         注意：50/16开头是LOF，不是ETF
     """
-    # 去除后缀，取前6位数字
-    code = stock_code.split('.')[0]
+    # 将前2/3个字符按ASCII打包为整数比较；后缀分隔符'.'不是数字，无需先去除后缀
+    if len(stock_code) < 2:
+        return False
+    
+    prefix2 = (ord(stock_code[0]) << 8) | ord(stock_code[1])
+    if prefix2 in _SH_ETF_PREFIX_SET:
+        return True
+    return len(stock_code) >= 3 and ((prefix2 << 8) | ord(stock_code[2])) == _SZ_ETF_PREFIX_CODE
+
+def _classify_etf_codes(stock_list: List[str]) -> np.ndarray:
+    """批量判断股票代码是否为ETF，规则与 is_etf 一致
+    
+    将每个代码的前3个字符编码为 (N, 3) 的uint8数组，一次性完成前缀比较。
+    
+    Args:
+        stock_list: 股票代码列表
+        
+    Returns:
+        np.ndarray: 布尔掩码，True 表示对应代码为ETF
+    """
+    # 后缀分隔符'.'不是数字，截取前3个字符不会误匹配前缀；不足3位的以\0补齐
+    buf = b''.join(code[:3].encode('ascii', 'replace').ljust(3, b'\0') for code in stock_list)
+    heads = np.frombuffer(buf, dtype=np.uint8).reshape(-1, 3).astype(np.uint32)
     
-    # 上海ETF前缀
-    sh_etf_prefixes = ('51', '52', '53', '55', '56', '58')
-    # 深圳ETF前缀
-    sz_etf_prefix = '159'
+    prefix2 = (heads[:, 0] << 8) | heads[:, 1]
+    prefix3 = (prefix2 << 8) | heads[:, 2]
+    return np.isin(prefix2, _SH_ETF_PREFIX_CODES) | (prefix3 == _SZ_ETF_PREFIX_CODE)
+
+def is_etf_batch(stock_list: List[str]) -> np.ndarray:
+    """批量判断是否为ETF（不包括LOF），规则与 is_etf 一致
+    
+    适用于大规模股票池，一次数组比较完成全部分类，避免逐个调用 is_etf。
     
-    return code.startswith(sh_etf_prefixes) or code.startswith(sz_etf_prefix)
+    Args:
+        stock_list: 股票代码列表，如 ["510300.SH", "600519.SH"]
+        
+    Returns:
+        np.ndarray: 与 stock_list 等长的布尔数组，True 表示对应代码为ETF
+    """
+    if not stock_list:
+        return np.zeros(0, dtype=bool)
+    return _classify_etf_codes(stock_list)
 
 def determine_pool_type(stock_list: List[str]) -> tuple:
     """判断股票池类型，返回类型和对应的价格精度
@@ -174,8 +375,9 @@ def determine_pool_type(stock_list: List[str]) -> tuple:
     if not stock_list:
         return ('stock_only', 2)
     
-    has_stock = any(not is_etf(code) for code in stock_list)
-    has_etf = any(is_etf(code) for code in stock_list)
+    etf_mask = is_etf_batch(stock_list)
+    has_etf = bool(etf_mask.any())
+    has_stock = not etf_mask.all()
     
     if has_stock and not has_etf:
         # 纯股票池，使用2位小数
@@ -192,36 +394,41 @@ def determine_pool_type(stock_list: List[str]) -> tuple:
 # 全局缓存T0 ETF列表，避免重复读取文件
 _t0_etf_cache = None
 
-def load_t0_etf_list() -> set:
+def load_t0_etf_list() -> frozenset:
     """加载T0型ETF列表
     
     Returns:
-        set: T0型ETF的股票代码集合
+        frozenset: T0型ETF的股票代码集合（只读）
     """
     global _t0_etf_cache
     
     if _t0_etf_cache is not None:
         return _t0_etf_cache
     
-    _t0_etf_cache = set()
+    _t0_etf_cache = frozenset()
     
     # 获取T0型ETF.csv文件路径
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    t0_file = os.path.join(current_dir, 'data', 'T0型ETF.csv')
+    t0_file = Path(__file__).resolve().parent / 'data' / 'T0型ETF.csv'
     
-    if not os.path.exists(t0_file):
+    if not t0_file.exists():
         logging.warning(f"T0型ETF列表文件不存在: {t0_file}")
         return _t0_etf_cache
     
     try:
-        with open(t0_file, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            for row in reader:
-                if row and len(row) >= 1:
-                    stock_code = row[0].strip()
-                    if stock_code:
-                        _t0_etf_cache.add(stock_code)
+        # 以源文件的路径、修改时间和大小作为缓存键，文件更新后自动重新解析
+        stat = t0_file.stat()
+        cache_key = (str(t0_file), stat.st_mtime_ns, stat.st_size)
+        cached = _load_pickle_cache('t0_etf.pkl', cache_key)
+        if cached is not None:
+            _t0_etf_cache = cached
+            return _t0_etf_cache
+        
+        # 文件仅首列有效，直接按行切分，无需csv逐行解析
+        lines = t0_file.read_text(encoding='utf-8').splitlines()
+        codes = (line.split(',', 1)[0].strip() for line in lines)
+        _t0_etf_cache = frozenset(code for code in codes if code)
         logging.info(f"已加载 {len(_t0_etf_cache)} 只T0型ETF")
+        _save_pickle_cache('t0_etf.pkl', cache_key, _t0_etf_cache)
     except Exception as e:
         logging.error(f"加载T0型ETF列表失败: {e}")
     
@@ -236,7 +443,8 @@ def is_t0_etf(stock_code: str) -> bool:
     Returns:
         bool: 是否支持T+0
     """
-    t0_list = load_t0_etf_list()
+    # 缓存已加载时直接查询，省去函数调用
+    t0_list = _t0_etf_cache if _t0_etf_cache is not None else load_t0_etf_list()
     return stock_code in t0_list
 
 def check_t0_support(stock_list: List[str]) -> tuple:
@@ -253,14 +461,13 @@ def check_t0_support(stock_list: List[str]) -> tuple:
     if not stock_list:
         return ('no_t0', False)
     
-    t0_list = load_t0_etf_list()
-    t0_count = sum(1 for code in stock_list if code in t0_list)
-    total_count = len(stock_list)
+    # 只需判断包含关系，使用可提前终止的集合运算，无需构建交集
+    t0_set = load_t0_etf_list()
     
-    if t0_count == total_count:
+    if t0_set.issuperset(stock_list):
         # 全部是T+0 ETF
         return ('all_t0', True)
-    elif t0_count > 0:
+    elif not t0_set.isdisjoint(stock_list):
         # 混合：部分支持T+0，部分不支持
         return ('mixed', False)
     else:
@@ -275,15 +482,17 @@ def get_t0_details(stock_list: List[str]) -> dict:
         
     Returns:
         dict: {
-            't0_stocks': List[str],  # 支持T+0的股票
-            'non_t0_stocks': List[str],  # 不支持T+0的股票
+            't0_stocks': List[str],  # 支持T+0的股票，保持输入顺序
+            'non_t0_stocks': List[str],  # 不支持T+0的股票，保持输入顺序
             't0_count': int,
-            'total_count': int
+            'total_count': int  # 输入列表的长度
         }
     """
     t0_list = load_t0_etf_list()
-    t0_stocks = [code for code in stock_list if code in t0_list]
-    non_t0_stocks = [code for code in stock_list if code not in t0_list]
+    # 单次遍历完成分组，按输入顺序保留（含重复代码）
+    t0_stocks, non_t0_stocks = [], []
+    for code in stock_list:
+        (t0_stocks if code in t0_list else non_t0_stocks).append(code)
     
     return {
         't0_stocks': t0_stocks,
@@ -312,21 +521,33 @@ def get_price_decimals(data: Dict = None) -> int:
     
     return _default_price_decimals
 
-def round_price(price: float, decimals: int = None, data: Dict = None) -> float:
+def round_price(price: float, decimals: int = None, data: Dict = None,
+                half_up: bool = False) -> float:
     """根据精度设置对价格进行四舍五入
     
     Args:
         price: 原始价格
         decimals: 精度（小数位数），如果为None则从data中获取
         data: 策略接收的数据对象
+        half_up: 为True时按缩放后的值半数向上舍入（如 2.675 -> 2.68），
+            默认为False，与内置 round 的结果一致（2.675 -> 2.67）
         
     Returns:
         float: 四舍五入后的价格
     """
     if decimals is None:
         decimals = get_price_decimals(data)
+    if half_up and price >= 0 and math.isfinite(price) and 0 <= decimals < len(_PRICE_SCALES):
+        # 整数缩放后半数向上舍入；inf/nan 不能取整，交给 round 原样返回
+        scale = _PRICE_SCALES[decimals]
+        return math.floor(price * scale + 0.5) / scale
     return round(price, decimals)
 
+@lru_cache(maxsize=8)
+def _get_price_formatter(decimals: int):
+    """按精度生成并缓存价格格式化函数，避免每次调用重新解析动态格式说明符"""
+    return ('{:.' + str(decimals) + 'f}').format
+
 def format_price(price: float, decimals: int = None, data: Dict = None) -> str:
     """根据精度设置格式化价格为字符串
     
@@ -340,16 +561,124 @@ def format_price(price: float, decimals: int = None, data: Dict = None) -> str:
     """
     if decimals is None:
         decimals = get_price_decimals(data)
-    return f"{price:.{decimals}f}"
+    return _get_price_formatter(decimals)(price)
+
+# 最近一次交易时间判断结果：(整秒时间戳, 是否交易时间)，同一秒内重复调用直接复用
+_trade_time_last = (None, False)
 
 def is_trade_time() -> bool:
     """判断是否为交易时间"""
-    current = time.strftime("%H%M%S")
-    
-    for start, end in _trading_periods:
-        if start <= current <= end:
-            return True
-    return False
+    global _trade_time_last
+
+    now = int(time.time())
+    last_second, last_result = _trade_time_last
+    if now == last_second:
+        return last_result
+
+    t = time.localtime(now)
+    seconds = t.tm_hour * 3600 + t.tm_min * 60 + t.tm_sec
+    result = _AM_START <= seconds <= _AM_END or _PM_START <= seconds <= _PM_END
+    _trade_time_last = (now, result)
+    return result
+
+def _get_cn_holidays() -> holidays.HolidayBase:
+    """获取中国法定节假日对象（首次调用时构建并缓存）"""
+    global _cn_holidays
+
+    if _cn_holidays is None:
+        _cn_holidays = holidays.China()
+    return _cn_holidays
+
+def _get_holiday_ordinals() -> frozenset:
+    """获取法定节假日日期序数集合（首次调用时构建并缓存）
+
+    构建结果同时持久化到本地缓存，以holidays库版本和年份范围为键，
+    后续进程启动时直接读取，省去逐年展开节假日规则的开销。
+
+    Returns:
+        frozenset: 覆盖 _HOLIDAY_YEARS 范围内所有法定节假日的 date.toordinal() 值
+    """
+    global _holiday_ordinals
+
+    if _holiday_ordinals is None:
+        cache_key = (holidays.__version__, _HOLIDAY_YEARS.start, _HOLIDAY_YEARS.stop)
+        _holiday_ordinals = _load_pickle_cache('holiday_ordinals.pkl', cache_key)
+        if _holiday_ordinals is None:
+            _holiday_ordinals = frozenset(
+                d.toordinal() for d in holidays.China(years=_HOLIDAY_YEARS).keys()
+            )
+            _save_pickle_cache('holiday_ordinals.pkl', cache_key, _holiday_ordinals)
+    return _holiday_ordinals
+
+def _get_holiday_datetime64() -> np.ndarray:
+    """获取法定节假日的datetime64[D]数组（首次调用时构建并缓存），供np.busday_count使用
+
+    Returns:
+        np.ndarray: 升序排列的法定节假日日期数组
+    """
+    global _holiday_datetime64
+
+    if _holiday_datetime64 is None:
+        _holiday_datetime64 = np.array(
+            sorted(datetime.fromordinal(o).date() for o in _get_holiday_ordinals()),
+            dtype='datetime64[D]'
+        )
+    return _holiday_datetime64
+
+def _get_trade_day_bitmap() -> np.ndarray:
+    """获取预计算范围内的交易日位图（首次调用时构建并缓存）
+
+    Returns:
+        np.ndarray: 布尔数组，下标为 ordinal - _HOLIDAY_ORDINAL_MIN，True 表示交易日
+    """
+    global _trade_day_bitmap
+
+    if _trade_day_bitmap is None:
+        first_day = np.datetime64(datetime.fromordinal(_HOLIDAY_ORDINAL_MIN).date(), 'D')
+        days = first_day + np.arange(_HOLIDAY_ORDINAL_MAX - _HOLIDAY_ORDINAL_MIN + 1)
+        _trade_day_bitmap = np.is_busday(days, holidays=_get_holiday_datetime64())
+    return _trade_day_bitmap
+
+def _iter_trade_ordinals(start_ordinal: int, end_ordinal: int):
+    """按顺序产出 [start_ordinal, end_ordinal] 内交易日的日期序数
+
+    预计算范围内的部分直接从交易日位图中取出，范围外的部分逐日判断。
+    """
+    # 预计算范围之前的部分
+    for ordinal in range(start_ordinal, min(end_ordinal, _HOLIDAY_ORDINAL_MIN - 1) + 1):
+        if _is_trade_ordinal(ordinal):
+            yield ordinal
+
+    low = max(start_ordinal, _HOLIDAY_ORDINAL_MIN)
+    high = min(end_ordinal, _HOLIDAY_ORDINAL_MAX)
+    if low <= high:
+        window = _get_trade_day_bitmap()[low - _HOLIDAY_ORDINAL_MIN:high - _HOLIDAY_ORDINAL_MIN + 1]
+        yield from (np.flatnonzero(window) + low).tolist()
+
+    # 预计算范围之后的部分
+    for ordinal in range(max(start_ordinal, _HOLIDAY_ORDINAL_MAX + 1), end_ordinal + 1):
+        if _is_trade_ordinal(ordinal):
+            yield ordinal
+
+@lru_cache(maxsize=8192)
+def _is_trade_ordinal(ordinal: int) -> bool:
+    """按日期序数判断是否为交易日（工作日且非法定节假日），结果按序数缓存
+
+    Args:
+        ordinal: 日期序数，即 date.toordinal() 的返回值
+
+    Returns:
+        bool: 是否为交易日
+    """
+    # date.weekday() == (ordinal + 6) % 7，5代表周六, 6代表周日
+    if (ordinal + 6) % 7 >= 5:
+        return False
+
+    if _HOLIDAY_ORDINAL_MIN <= ordinal <= _HOLIDAY_ORDINAL_MAX:
+        return ordinal not in _get_holiday_ordinals()
+
+    # 超出预计算范围，回退到holidays库查询
+    return datetime.fromordinal(ordinal).date() not in _get_cn_holidays()
 
 def is_trade_day(date_str: str = None) -> bool:
     """判断是否为交易日（工作日且非法定节假日）
@@ -364,19 +693,21 @@ def is_trade_day(date_str: str = None) -> bool:
         bool: 是否为交易日
     """
     if date_str is None:
-        date_str = datetime.now().strftime("%Y-%m-%d")
+        return _is_trade_ordinal(datetime.now().toordinal())
     
     # 标准化日期格式
     try:
+        # 快速路径: YYYYMMDD，直接按位截取年月日整数，跳过strptime
+        if len(date_str) == 8 and date_str.isdigit():
+            ordinal = datetime(int(date_str[:4]), int(date_str[4:6]), int(date_str[6:])).toordinal()
+            return _is_trade_ordinal(ordinal)
+        
         # 尝试解析不同的日期格式
         date_obj = None
         
         # 格式1: YYYY-MM-DD
         if '-' in date_str and len(date_str) == 10:
             date_obj = datetime.strptime(date_str, "%Y-%m-%d")
-        # 格式2: YYYYMMDD
-        elif date_str.isdigit() and len(date_str) == 8:
-            date_obj = datetime.strptime(date_str, "%Y%m%d")
         else:
             # 尝试其他可能的格式
             for fmt in ["%Y-%m-%d", "%Y%m%d", "%Y/%m/%d"]:
@@ -389,48 +720,13 @@ def is_trade_day(date_str: str = None) -> bool:
         if date_obj is None:
             raise ValueError(f"无法解析日期格式: {date_str}")
         
-        # 首先排除周末 (5代表周六, 6代表周日)
-        if date_obj.weekday() >= 5:
-            return False
-        
-        # 使用holidays库判断是否为法定节假日
-        date_only = date_obj.date()
-        if date_only in _cn_holidays:
-            return False
-        
-        # 非周末且非法定节假日，则视为交易日
-        return True
+        # 排除周末和法定节假日，其余视为交易日
+        return _is_trade_ordinal(date_obj.toordinal())
         
     except Exception as e:
-        print(f"判断交易日异常: {str(e)}")
-        # 如果出现异常，尝试基本的日期解析
-        try:
-            # 再次尝试解析常见格式
-            date_obj = None
-            for fmt in ["%Y-%m-%d", "%Y%m%d"]:
-                try:
-                    date_obj = datetime.strptime(date_str, fmt)
-                    break
-                except ValueError:
-                    continue
-            
-            if date_obj is None:
-                print(f"无法解析日期格式: {date_str}，默认按交易日处理")
-                return True
-                
-            date_only = date_obj.date()
-            if date_only in _cn_holidays:
-                print(f"日期 {date_str} 是法定节假日（{_cn_holidays.get(date_only)}），非交易日")
-                return False
-            # 如果是周末，非交易日
-            if date_obj.weekday() >= 5:
-                print(f"日期 {date_str} 是周末，非交易日")
-                return False
-            return True
-        except:
-            # 实在判断不出来，默认为交易日
-            print(f"无法确定 {date_str} 是否为交易日，默认按普通工作日处理")
-            return True
+        # 主路径已覆盖全部支持的格式，解析失败时无需再重试，默认按交易日处理
+        logging.warning(f"判断交易日异常: {str(e)}，默认按交易日处理")
+        return True
 
 def get_trade_days_count(start_date: str, end_date: str) -> int:
     """计算指定日期范围内的交易日天数
@@ -452,20 +748,23 @@ def get_trade_days_count(start_date: str, end_date: str) -> int:
             logging.error(f"起始日期 {start_date} 晚于结束日期 {end_date}")
             return 0
             
-        # 初始化计数器
-        trade_days = 0
-        
-        # 遍历日期范围内的每一天
-        current_dt = start_dt
-        while current_dt <= end_dt:
-            current_date_str = current_dt.strftime("%Y-%m-%d")
-            # 使用is_trade_day函数判断是否为交易日
-            if is_trade_day(current_date_str):
-                trade_days += 1
-            
-            # 前进到下一天
-            current_dt += timedelta(days=1)
-            
+        start_ordinal = start_dt.toordinal()
+        end_ordinal = end_dt.toordinal()
+        
+        if _HOLIDAY_ORDINAL_MIN <= start_ordinal and end_ordinal <= _HOLIDAY_ORDINAL_MAX:
+            # 范围在预计算节假日覆盖内，使用numpy一次性排除周末和节假日
+            trade_days = int(np.busday_count(
+                np.datetime64(start_dt.date(), 'D'),
+                np.datetime64(end_dt.date(), 'D') + 1,
+                holidays=_get_holiday_datetime64()
+            ))
+        else:
+            # 超出覆盖范围，按日期序数逐日判断
+            trade_days = sum(
+                1 for ordinal in range(start_ordinal, end_ordinal + 1)
+                if _is_trade_ordinal(ordinal)
+            )
+        
         logging.info(f"从 {start_date} 到 {end_date} 共有 {trade_days} 个交易日")
         return trade_days
         
@@ -473,6 +772,72 @@ def get_trade_days_count(start_date: str, end_date: str) -> int:
         logging.error(f"计算交易日天数时出错: {str(e)}")
         return 0
 
+def iter_trade_days(start_date: str, end_date: str):
+    """按日期顺序逐个产出指定范围内的交易日（含首尾）
+    
+    适用于需要对每个交易日单独处理的场景（如按日过滤、逐日回调）。
+    
+    Args:
+        start_date: 起始日期，格式为"YYYY-MM-DD"
+        end_date: 结束日期，格式为"YYYY-MM-DD"
+        
+    Yields:
+        datetime: 交易日（时间部分为 00:00:00）
+        
+    Raises:
+        ValueError: 日期格式错误
+    """
+    start_dt = datetime.strptime(start_date, "%Y-%m-%d")
+    end_dt = datetime.strptime(end_date, "%Y-%m-%d")
+    
+    for ordinal in _iter_trade_ordinals(start_dt.toordinal(), end_dt.toordinal()):
+        yield datetime.fromordinal(ordinal)
+
+def _default_end_time(fre_step: str) -> str:
+    """生成均线计算的默认结束时间：日内频率精确到秒，其余精确到日"""
+    if fre_step in _INTRADAY_FREQS:
+        return datetime.now().strftime('%Y%m%d %H%M%S')
+    return datetime.now().strftime('%Y%m%d')
+
+def _mean_skipna(values: pd.Series) -> float:
+    """在底层ndarray上求均值，跳过NaN（与 Series.mean() 结果一致）
+    
+    Args:
+        values: 数值序列
+        
+    Returns:
+        float: 均值，序列为空或全为NaN时返回NaN
+    """
+    arr = values.to_numpy(dtype=np.float64, copy=False)
+    if arr.size == 0:
+        return float('nan')
+    
+    mean = arr.mean()
+    if mean != mean:
+        # 含NaN时仅对有效值求均值
+        valid = arr[~np.isnan(arr)]
+        return float(valid.mean()) if valid.size else float('nan')
+    return float(mean)
+
+def _rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """沿最后一个轴计算滚动均值（与 rolling(window).mean() 结果一致）
+    
+    Args:
+        values: 一维或二维数组，二维时每行为一个标的的序列
+        window: 窗口长度
+        
+    Returns:
+        np.ndarray: 与输入同形状的float64数组，窗口未满或窗口内含NaN时为NaN
+    """
+    arr = np.asarray(values, dtype=np.float64)
+    result = np.full(arr.shape, np.nan)
+    if window <= 0 or arr.shape[-1] < window:
+        return result
+    
+    windows = np.lib.stride_tricks.sliding_window_view(arr, window, axis=-1)
+    result[..., window - 1:] = windows.mean(axis=-1)
+    return result
+
 # ============================================================================
 # 兼容性：保留原有的KhQuTools类，但让类方法调用上面的独立函数
 # ============================================================================
@@ -483,7 +848,11 @@ class KhQuTools:
     def __init__(self):
         # 为了兼容性保留这些属性，但实际会使用模块级函数
         self.trading_periods = _trading_periods
-        self.cn_holidays = _cn_holidays
+    
+    @property
+    def cn_holidays(self) -> holidays.HolidayBase:
+        """中国法定节假日对象（兼容性保留，按需构建）"""
+        return _get_cn_holidays()
         
     def is_trade_time(self) -> bool:
         """判断是否为交易时间（调用模块级函数）"""
@@ -514,16 +883,11 @@ class KhQuTools:
         Raises:
             ValueError: 如果不在交易时间（日内频率）或数据不足
         """
-        from datetime import datetime
         if end_time is None:
-            now = datetime.now()
-            if fre_step in ['1m', '5m', 'tick']:
-                end_time = now.strftime('%Y%m%d %H%M%S')
-            else:
-                end_time = now.strftime('%Y%m%d')
+            end_time = _default_end_time(fre_step)
 
         # 结合 is_trade_time 判断（仅对日内频率）
-        if fre_step in ['1m', '5m', 'tick'] and not self.is_trade_time():
+        if fre_step in _INTRADAY_FREQS and not self.is_trade_time():
             raise ValueError("不在交易时间内，无法计算日内移动平均线")
 
         # 获取历史数据（不包含当前时间点）
@@ -543,8 +907,88 @@ class KhQuTools:
         prices = data[stock_code][field]
         # 使用动态精度（根据是否为ETF判断）
         decimals = 3 if is_etf(stock_code) else 2
-        return round(prices.mean(), decimals)
+        return round(_mean_skipna(prices), decimals)
+
+
+# khMA 滑动窗口缓存：{(stock_code, field, fre_step, fq, period): 窗口状态字典}
+# 窗口状态包含 window(最近period个值)、total(窗口总和)、last_time(最新K线时间)、updates(增量更新次数)
+_ma_window_cache: Dict[tuple, dict] = {}
+
+def clear_ma_cache() -> None:
+    """清空 khMA 滑动窗口缓存
+
+    缓存按 (股票, 字段, 周期, 复权方式, 均线周期) 保存窗口，进程内一直保留；
+    框架在每次回测开始时调用，避免上一次回测的窗口状态和内存延续到下一次。
+    """
+    _ma_window_cache.clear()
+
+def _reset_ma_window(cache_key: tuple, times: pd.Series, prices: pd.Series) -> None:
+    """用完整窗口数据重建 khMA 滑动窗口缓存，含NaN时不缓存"""
+    values = prices.to_numpy(dtype=np.float64)
+    if np.isnan(values).any():
+        _ma_window_cache.pop(cache_key, None)
+        return
+    
+    window = deque(values.tolist(), maxlen=len(values))
+    _ma_window_cache[cache_key] = {
+        'window': window,
+        'total': math.fsum(window),
+        'last_time': times.iloc[-1],
+        'updates': 0,
+    }
 
+def _update_ma_window(cache_key: tuple, end_time: str) -> Optional[float]:
+    """尝试以O(1)方式推进 khMA 滑动窗口
+    
+    只获取截至 end_time 的最近2根K线：若倒数第二根与缓存的最新K线时间和数值一致，
+    说明恰好前进了一根K线，滑出最旧值、加入最新值即可；若最新K线即为缓存的最新K线，
+    直接返回缓存均值。其余情况（时间回退、跳过多根K线、复权数据变化等）返回None，
+    由调用方回退到完整窗口计算。
+    
+    Args:
+        cache_key: (stock_code, field, fre_step, fq, period)
+        end_time: 结束时间（不包含）
+        
+    Returns:
+        Optional[float]: 均值，无法增量更新时返回None
+    """
+    entry = _ma_window_cache.get(cache_key)
+    if entry is None:
+        return None
+    
+    stock_code, field, fre_step, fq, period = cache_key
+    recent = khHistory(
+        symbol_list=stock_code,
+        fields=[field],
+        bar_count=2,
+        fre_step=fre_step,
+        current_time=end_time,
+        fq=fq,
+        force_download=False
+    ).get(stock_code)
+    if recent is None or len(recent) < 2:
+        return None
+    
+    times = recent['time']
+    values = recent[field].to_numpy(dtype=np.float64)
+    window = entry['window']
+    
+    if times.iloc[-1] == entry['last_time'] and values[-1] == window[-1]:
+        # 没有新K线
+        return entry['total'] / period
+    if times.iloc[-2] != entry['last_time'] or values[-2] != window[-1] or np.isnan(values[-1]):
+        return None
+    
+    new_value = float(values[-1])
+    entry['total'] += new_value - window[0]
+    window.append(new_value)
+    entry['last_time'] = times.iloc[-1]
+    entry['updates'] += 1
+    if entry['updates'] >= period:
+        # 每滑过一整个窗口重算一次总和，消除浮点累积误差
+        entry['total'] = math.fsum(window)
+        entry['updates'] = 0
+    return entry['total'] / period
 
 def khMA(stock_code: str, period: int, field: str = 'close', fre_step: str = '1d', end_time: Optional[str] = None, fq: str = 'pre', data: Dict = None) -> float:
     """计算移动平均线（独立函数版本）
@@ -564,39 +1008,90 @@ def khMA(stock_code: str, period: int, field: str = 'close', fre_step: str = '1d
     Raises:
         ValueError: 如果不在交易时间（日内频率）或数据不足
     """
-    from datetime import datetime
-    
     if end_time is None:
-        now = datetime.now()
-        if fre_step in ['1m', '5m', 'tick']:
-            end_time = now.strftime('%Y%m%d %H%M%S')
-        else:
-            end_time = now.strftime('%Y%m%d')
+        end_time = _default_end_time(fre_step)
 
     # 结合 is_trade_time 判断（仅对日内频率）
-    tools = KhQuTools()
-    if fre_step in ['1m', '5m', 'tick'] and not tools.is_trade_time():
+    if fre_step in _INTRADAY_FREQS and not is_trade_time():
         raise ValueError("不在交易时间内，无法计算日内移动平均线")
 
-    # 获取历史数据（不包含当前时间点）
-    history_data = khHistory(
-        symbol_list=stock_code,
-        fields=[field],
-        bar_count=period,
-        fre_step=fre_step,
-        current_time=end_time,
-        fq=fq,
-        force_download=False  # 不强制下载数据，提高回测速度
-    )
+    # 时间单调推进时只取最新K线增量更新，否则回退到完整窗口计算
+    cache_key = (stock_code, field, fre_step, fq, period)
+    mean = _update_ma_window(cache_key, end_time)
+    
+    if mean is None:
+        # 获取历史数据（不包含当前时间点）
+        history_data = khHistory(
+            symbol_list=stock_code,
+            fields=[field],
+            bar_count=period,
+            fre_step=fre_step,
+            current_time=end_time,
+            fq=fq,
+            force_download=False  # 不强制下载数据，提高回测速度
+        )
+
+        if stock_code not in history_data or len(history_data[stock_code]) < period:
+            _ma_window_cache.pop(cache_key, None)
+            raise ValueError(f"股票 {stock_code} 数据量不足 {period} 条，无法计算均线{period}")
 
-    if stock_code not in history_data or len(history_data[stock_code]) < period:
-        raise ValueError(f"股票 {stock_code} 数据量不足 {period} 条，无法计算均线{period}")
+        prices = history_data[stock_code][field]
+        _reset_ma_window(cache_key, history_data[stock_code]['time'], prices)
+        mean = _mean_skipna(prices)
 
-    prices = history_data[stock_code][field]
     # 优先从传入的data中获取精度设置，否则根据股票代码判断
     decimals = get_price_decimals(data) if data else (3 if is_etf(stock_code) else 2)
-    return round(prices.mean(), decimals)
+    return round(mean, decimals)
+
+def khMA_batch(arrays, period: int) -> np.ndarray:
+    """批量计算多个标的的移动平均序列
+
+    Args:
+        arrays: 二维数组（每行为一个标的按时间排列的价格序列），或一维单个序列
+        period: 周期长度
+
+    Returns:
+        np.ndarray: 与输入同形状的均线数组，前 period-1 个位置为NaN
+    """
+    return _rolling_mean(arrays, period)
+
 
+# 计算买入量用的交易管理器缓存：{框架对象: (配置对象, KhTradeManager)}
+# 以框架对象为弱引用键（交易管理器强引用的是配置对象而非框架），框架释放后自动移除
+_cost_trade_managers = weakref.WeakKeyDictionary()
+_default_cost_trade_manager = None
+
+def _get_cost_trade_manager(framework=None):
+    """获取用于估算交易成本的交易管理器，按框架对象缓存
+    
+    Args:
+        framework: 框架对象，为None或不含配置时使用默认交易成本设置
+        
+    Returns:
+        KhTradeManager: 交易管理器实例（仅用于成本计算，不参与下单）
+    """
+    global _default_cost_trade_manager
+    from khTrade import KhTradeManager
+    
+    config = getattr(framework, 'config', None) if framework else None
+    if config is None:
+        if _default_cost_trade_manager is None:
+            _default_cost_trade_manager = KhTradeManager(
+                SimpleNamespace(config_dict={"backtest": {"trade_cost": {}}})
+            )
+        return _default_cost_trade_manager
+    
+    try:
+        cached = _cost_trade_managers.get(framework)
+    except TypeError:
+        # 框架对象不支持弱引用时不缓存
+        return KhTradeManager(config)
+    
+    # 框架更换了配置对象时重新构建
+    if cached is None or cached[0] is not config:
+        cached = (config, KhTradeManager(config))
+        _cost_trade_managers[framework] = cached
+    return cached[1]
 
 def calculate_max_buy_volume(data: Dict, stock_code: str, price: float, cash_ratio: float = 1.0) -> int:
     """
@@ -612,9 +1107,6 @@ def calculate_max_buy_volume(data: Dict, stock_code: str, price: float, cash_rat
         int: 最大可买入股数(按手取整)
     """
     try:
-        # 导入交易管理类
-        from khTrade import KhTradeManager
-
         # 获取账户信息
         account_info = data.get("__account__", {})
         if not account_info:
@@ -635,20 +1127,16 @@ def calculate_max_buy_volume(data: Dict, stock_code: str, price: float, cash_rat
         # 获取价格精度设置
         decimals = get_price_decimals(data)
         # 对价格进行四舍五入处理
-        price = round(price, decimals)
+        price = round_price(price, decimals)
 
         # 获取框架对象
         framework = data.get("__framework__", None)
         
-        # 获取配置对象
-        if framework and hasattr(framework, 'config'):
-            config = framework.config
-        else:
+        # 获取交易管理器（按框架对象缓存，避免每次调用重新构建）
+        if not (framework and hasattr(framework, 'config')):
             logging.warning("未从数据字典中获取到框架对象或框架配置不可用，将使用默认交易成本设置")
-            config = SimpleNamespace(config_dict={"backtest": {"trade_cost": {}}})
-            
-        # 创建交易管理器实例（使用实际配置）
-        trade_manager = KhTradeManager(config)
+            framework = None
+        trade_manager = _get_cost_trade_manager(framework)
         
         # 获取交易成本参数
         commission_rate = trade_manager.commission_rate
@@ -663,9 +1151,26 @@ def calculate_max_buy_volume(data: Dict, stock_code: str, price: float, cash_rat
         if shares < 100:
             return 0
 
-        # 逐步减少股数，使用calculate_trade_cost精确计算成本
+        # 滑点后价格与数量无关，先取一手计算实际成交价
+        actual_price, _ = trade_manager.calculate_trade_cost(
+            price=price,
+            volume=100,
+            direction="buy",
+            stock_code=stock_code
+        )
+        if actual_price <= 0:
+            return 0
+
+        # 总花费 = 实际价格*数量*(1+过户费率) + max(佣金, 最低佣金) + 流量费，随数量单调递增，
+        # 分别按比例佣金和最低佣金两种情形求解，取较小者即为满足资金约束的最大手数
+        min_commission = trade_manager.min_commission
+        fixed_cost = trade_manager.flow_fee
+        lots_by_rate = (usable_cash - fixed_cost) / (actual_price * (1 + commission_rate + transfer_fee_rate)) // 100
+        lots_by_min = (usable_cash - fixed_cost - min_commission) / (actual_price * (1 + transfer_fee_rate)) // 100
+        shares = min(shares, int(min(lots_by_rate, lots_by_min)) * 100)
+
+        # 使用calculate_trade_cost精确校验，浮点误差导致超出时再减少一手
         while shares >= 100:
-            # 使用calculate_trade_cost计算实际交易成本（包括滑点）
             actual_price, trade_cost = trade_manager.calculate_trade_cost(
                 price=price,
                 volume=shares,
@@ -690,6 +1195,19 @@ def calculate_max_buy_volume(data: Dict, stock_code: str, price: float, cash_rat
         logging.error(f"计算最大可买入数量时出错: {str(e)}", exc_info=True)
         return 0
 
+def _make_signal(stock_code: str, action: str, price: float, volume: int, reason: str, timestamp=None) -> Dict:
+    """构造单个交易信号字典（价格需已按精度处理）"""
+    signal = {
+        "code": stock_code,
+        "action": action,
+        "price": price,
+        "volume": int(volume),  # 确保是整数
+        "reason": reason
+    }
+    if timestamp:
+        signal["timestamp"] = timestamp
+    return signal
+
 def generate_signal(data: Dict, stock_code: str, price: float, ratio: float, action: str, reason: str = "") -> List[Dict]:
     """
     生成标准交易信号
@@ -706,14 +1224,14 @@ def generate_signal(data: Dict, stock_code: str, price: float, ratio: float, act
     Returns:
         List[Dict]: 包含单个信号的列表，或空列表
     """
-    signals = []
-    current_time = data.get("__current_time__", {})
-    timestamp = current_time.get("timestamp")
+    timestamp = (data.get("__current_time__") or {}).get("timestamp")
+    # 日志格式化（尤其是信号字典的repr）开销较大，INFO未启用时直接跳过
+    log_info = logging.getLogger().isEnabledFor(logging.INFO)
     
     # 获取价格精度设置
     decimals = get_price_decimals(data)
     # 对价格进行四舍五入处理
-    price = round(price, decimals)
+    price = round_price(price, decimals)
 
     if action == "buy":
         # 判断ratio是否大于1，若大于1则表示买入股数
@@ -736,32 +1254,22 @@ def generate_signal(data: Dict, stock_code: str, price: float, ratio: float, act
             else:
                 actual_volume = target_volume
                 
-            signal = {
-                "code": stock_code,
-                "action": "buy",
-                "price": price,  # 价格已在函数开始时四舍五入
-                "volume": actual_volume,
-                "reason": reason or f"按价格 {price:.{decimals}f} 买入 {actual_volume}股({actual_volume//100}手)"
-            }
-            if timestamp:
-                signal["timestamp"] = timestamp
-            signals.append(signal)
-            logging.info(f"生成买入信号: {signal}")
+            signal = _make_signal(stock_code, "buy", price, actual_volume,
+                                  reason or f"按价格 {price:.{decimals}f} 买入 {actual_volume}股({actual_volume//100}手)",
+                                  timestamp)
+            if log_info:
+                logging.info(f"生成买入信号: {signal}")
+            return [signal]
         else:
             # ratio <= 1时按照资金比例计算可买入股数
             max_volume = calculate_max_buy_volume(data, stock_code, price, cash_ratio=ratio)
             if max_volume > 0:
-                signal = {
-                    "code": stock_code,
-                    "action": "buy",
-                    "price": price,  # 价格已在函数开始时四舍五入
-                    "volume": max_volume,
-                    "reason": reason or f"按价格 {price:.{decimals}f} 以 {ratio*100:.0f}% 资金比例买入"
-                }
-                if timestamp:
-                    signal["timestamp"] = timestamp
-                signals.append(signal)
-                logging.info(f"生成买入信号: {signal}")
+                signal = _make_signal(stock_code, "buy", price, max_volume,
+                                      reason or f"按价格 {price:.{decimals}f} 以 {ratio*100:.0f}% 资金比例买入",
+                                      timestamp)
+                if log_info:
+                    logging.info(f"生成买入信号: {signal}")
+                return [signal]
             else:
                 logging.warning(f"无法生成买入信号: 股票={stock_code}, 价格={price:.{decimals}f}, 资金比例={ratio:.2f}, 计算可买量为0")
 
@@ -774,19 +1282,14 @@ def generate_signal(data: Dict, stock_code: str, price: float, ratio: float, act
 
             if available_volume > 0:
                 # 计算要卖出的股数 (向下取整到100的倍数)
-                sell_volume = math.floor((available_volume * ratio) / 100) * 100
+                sell_volume = (int(available_volume * ratio) // 100) * 100
                 if sell_volume > 0:
-                    signal = {
-                        "code": stock_code,
-                        "action": "sell",
-                        "price": price,  # 价格已在函数开始时四舍五入
-                        "volume": int(sell_volume), # 确保是整数
-                        "reason": reason or f"按价格 {price:.{decimals}f} 卖出 {ratio*100:.0f}% 可用持仓"
-                    }
-                    if timestamp:
-                        signal["timestamp"] = timestamp
-                    signals.append(signal)
-                    logging.info(f"生成卖出信号: {signal}")
+                    signal = _make_signal(stock_code, "sell", price, sell_volume,
+                                          reason or f"按价格 {price:.{decimals}f} 卖出 {ratio*100:.0f}% 可用持仓",
+                                          timestamp)
+                    if log_info:
+                        logging.info(f"生成卖出信号: {signal}")
+                    return [signal]
                 else:
                     logging.warning(f"无法生成卖出信号: 股票={stock_code}, 价格={price:.{decimals}f}, 持仓比例={ratio:.2f}, 计算可卖量为0 (可用持仓={available_volume})")
             else:
@@ -794,7 +1297,35 @@ def generate_signal(data: Dict, stock_code: str, price: float, ratio: float, act
         else:
             logging.warning(f"无法生成卖出信号: 股票={stock_code} 不在持仓中")
 
-    return signals
+    return []
+
+# 股票列表文件尝试的编码列表（按顺序）
+_STOCK_CSV_ENCODINGS = ('utf-8', 'gb18030', 'gbk', 'gb2312', 'utf-16', 'ascii')
+
+def _decode_stock_csv(raw: bytes, file_path: str) -> str:
+    """解码股票列表文件内容：优先按BOM判断编码，否则依次尝试候选编码
+    
+    Args:
+        raw: 文件的原始字节
+        file_path: 文件路径（用于错误信息）
+        
+    Returns:
+        str: 解码后的文本
+        
+    Raises:
+        Exception: 所有候选编码均无法解码
+    """
+    if raw.startswith(b'\xef\xbb\xbf'):
+        return raw.decode('utf-8-sig')
+    if raw.startswith((b'\xff\xfe', b'\xfe\xff')):
+        return raw.decode('utf-16')
+    
+    for encoding in _STOCK_CSV_ENCODINGS:
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    raise Exception(f"无法读取文件 {file_path}，已尝试以下编码：{', '.join(_STOCK_CSV_ENCODINGS)}")
 
 def read_stock_csv(file_path):
     """
@@ -809,83 +1340,172 @@ def read_stock_csv(file_path):
     if not os.path.isfile(file_path):
         raise FileNotFoundError(f"文件不存在: {file_path}")
 
-    # 尝试的编码列表
-    encodings = ['utf-8', 'gb18030', 'gbk', 'gb2312', 'utf-16', 'ascii']
-    
-    # 存储结果
-    stock_codes = []
-    stock_names = []
+    # 只读取一次文件，在内存中判断编码
+    text = _decode_stock_csv(Path(file_path).read_bytes(), file_path)
     
-    # 尝试不同的编码
-    for encoding in encodings:
-        try:
-            with open(file_path, 'r', encoding=encoding) as file:
-                # 先读取少量内容来验证编码是否正确
-                file.read(1024)
-                file.seek(0)  # 重置文件指针到开始
-                
-                csv_reader = csv.reader(file)
-                
-                # 检查是否有BOM
-                first_row = next(csv_reader)
-                if first_row and first_row[0].startswith('\ufeff'):
-                    first_row[0] = first_row[0][1:]  # 删除BOM
-                
-                # 处理第一行
-                process_row(first_row, stock_codes, stock_names)
-                
-                # 处理剩余行
-                for row in csv_reader:
-                    process_row(row, stock_codes, stock_names)
-                
-                # 如果成功读取，跳出循环
-                break
-                
-        except UnicodeDecodeError:
-            # 如果是最后一个编码仍然失败，则抛出异常
-            if encoding == encodings[-1]:
-                raise Exception(f"无法读取文件 {file_path}，已尝试以下编码：{', '.join(encodings)}")
-            continue
-            
-        except Exception as e:
-            # 处理其他可能的异常
-            raise Exception(f"读取文件 {file_path} 时发生错误: {str(e)}")
+    try:
+        csv_reader = csv.reader(text.splitlines())
+        
+        # 检查是否有BOM
+        first_row = next(csv_reader)
+        if first_row and first_row[0].startswith('\ufeff'):
+            first_row[0] = first_row[0][1:]  # 删除BOM
+        
+        # 整体筛选：至少两列，且代码带有支持的交易所后缀（上海、深圳、北交所）
+        rows = [(row[0].strip(), row[1].strip()) for row in (first_row, *csv_reader) if len(row) >= 2]
+        selected = [(code, name) for code, name in rows if code.endswith(('.SH', '.SZ', '.BJ'))]
+        
+    except Exception as e:
+        # 处理其他可能的异常
+        raise Exception(f"读取文件 {file_path} 时发生错误: {str(e)}")
+
+    # 汇总记录一次日志，不再逐行记录
+    logging.info(f"读取股票文件 {file_path}: 添加证券 {len(selected)} 只，跳过 {len(rows) - len(selected)} 只")
 
+    stock_codes = [code for code, _ in selected]
+    stock_names = [name for _, name in selected]
     return stock_codes, stock_names
 
-def process_row(row, stock_codes, stock_names):
-    """
-    处理CSV的单行数据，处理带有交易所后缀的股票代码
-    
-    参数:
-    - row: CSV行数据
-    - stock_codes: 股票代码列表（会被修改）
-    - stock_names: 股票名称列表（会被修改）
-    """
-    if len(row) >= 2:
-        stock_code = row[0].strip()
-        stock_name = row[1].strip()
-        
-        logging.info(f"处理股票: {stock_code} - {stock_name}")
-
-        # 检查股票代码格式 - 简化筛选，只要有交易所后缀就接受
-        if '.' in stock_code:  # 已经包含后缀
-            # 接受所有标准格式的证券代码（包括股票、ETF、指数、可转债等）
-            if stock_code.endswith(('.SH', '.SZ', '.BJ')):  # 支持上海、深圳、北交所
-                stock_codes.append(stock_code)
-                stock_names.append(stock_name)
-                logging.info(f"添加证券: {stock_code} - {stock_name}")
-            else:
-                logging.info(f"跳过证券（交易所代码不支持）: {stock_code}")
-        else:
-            logging.info(f"跳过证券（无交易所后缀）: {stock_code}")
+# 同时向 xtdata 发起的下载请求上限（线程池并发时用于限流）
+_XTDATA_DOWNLOAD_CONCURRENCY = 4
+_xtdata_download_slots = threading.Semaphore(_XTDATA_DOWNLOAD_CONCURRENCY)
 
-def download_and_store_data(local_data_path, stock_files, field_list, period_type, start_date, end_date, dividend_type='none', time_range='all', progress_callback=None, log_callback=None, check_interrupt=None):
-    """
-    下载并存储指定股票、字段、周期类型和时间段的数据到文件。
+# 需要通过 get_market_data_ex 读取的指数代码
+_DOWNLOAD_INDEX_CODES = frozenset(("000001.SH", "399001.SZ", "399006.SZ", "000688.SH",
+                                   "000300.SH", "000905.SH", "000852.SH"))
 
-    函数功能:
-        1. 从指定的股票代码列表文件中读取股票代码。
+# 每批合并下载/读取的股票数量
+_DOWNLOAD_BATCH_SIZE = 32
+
+# 行情time列（UTC毫秒时间戳）的起点
+_EPOCH = datetime(1970, 1, 1)
+
+# 行情数据文件支持的存储格式及对应扩展名
+_STORAGE_EXTENSIONS = {'csv': '.csv', 'csv.gz': '.csv.gz', 'parquet': '.parquet'}
+
+# 写出CSV时每批格式化的行数，限制大表写出时的峰值内存
+_CSV_CHUNK_SIZE = 100_000
+
+# 计算日内特征时日数据需要读取的列
+_INTRADAY_DAILY_COLUMNS = frozenset({'date', 'close', 'volume'})
+
+# 特征结果累积到该行数后合并为一次写出，减少逐只股票打开/追加文件的次数
+_FEATURE_WRITE_BUFFER_ROWS = 1_000_000
+
+def _read_data_file(file_path: str, columns=None) -> pd.DataFrame:
+    """按扩展名读取行情数据文件（.parquet 使用 read_parquet，其余按CSV读取，.gz 自动解压）
+
+    Args:
+        file_path: 数据文件路径
+        columns: 需要的列名集合，为 None 时读取全部列；文件中不存在的列会被忽略，
+            其余列不做解析，列顺序与文件一致
+    """
+    if file_path.endswith('.parquet'):
+        if columns is not None:
+            import pyarrow.parquet as pq
+            columns = [name for name in pq.read_schema(file_path).names if name in columns]
+        return pd.read_parquet(file_path, columns=columns)
+    if columns is not None:
+        return pd.read_csv(file_path, usecols=lambda name: name in columns)
+    return pd.read_csv(file_path)
+
+_NS_PER_DAY = 86400 * 10**9
+
+def _time_range_to_ns(time_range: str):
+    """将 "HH:MM-HH:MM" 格式的时间段转换为当日纳秒偏移 (起始, 结束)"""
+    start_time, end_time = time_range.split('-')
+    start_time = datetime.strptime(start_time, "%H:%M")
+    end_time = datetime.strptime(end_time, "%H:%M")
+    return ((start_time.hour * 60 + start_time.minute) * 60 * 10**9,
+            (end_time.hour * 60 + end_time.minute) * 60 * 10**9)
+
+def _prefetch(func, items, depth: int = 4):
+    """在后台线程中按顺序预先执行 func(item)，依次产出结果
+    
+    最多同时预读 depth 个任务，既让文件读取（解析在C层释放GIL）与调用方的处理重叠，
+    又避免一次性把全部文件读入内存。
+    
+    Args:
+        func: 对每个元素执行的函数
+        items: 待处理元素序列
+        depth: 预读深度
+        
+    Yields:
+        func(item) 的结果，顺序与 items 一致
+    """
+    # 读取函数都依赖 pandas，先在调用线程上完成导入再启动后台线程
+    _ensure_loaded(pd)
+    with ThreadPoolExecutor(max_workers=depth) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= depth:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def _to_datetime_unique(values: pd.Series) -> pd.Series:
+    """只解析去重后的取值再映射回原序列，适用于大量重复的日期列
+    
+    Args:
+        values: 日期字符串序列（已是 datetime64 类型时直接返回）
+        
+    Returns:
+        pd.Series: datetime64 序列，缺失值为 NaT
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    
+    codes, uniques = pd.factorize(values)
+    parsed = pd.to_datetime(uniques).to_numpy()
+    result = parsed[codes]
+    result[codes < 0] = np.datetime64('NaT')
+    return pd.Series(result, index=values.index, name=values.name)
+
+def _split_datetime_strings(times: pd.Series):
+    """将datetime序列格式化为日期字符串与时间字符串（"%Y-%m-%d" / "%H:%M:%S"）
+    
+    借助 numpy.datetime_as_string 在C层完成格式化，避免 Series.dt.strftime 的逐元素开销；
+    含缺失值时回退到 strftime 以保持原有的 NaN 结果。
+    
+    Args:
+        times: datetime64 类型的序列
+        
+    Returns:
+        tuple: (日期字符串数组, 时间字符串数组)
+    """
+    if times.empty or times.isna().any():
+        return times.dt.strftime("%Y-%m-%d").to_numpy(), times.dt.strftime("%H:%M:%S").to_numpy()
+    
+    # 形如 "YYYY-MM-DDTHH:MM:SS"，按字符位置切分出日期和时间
+    text = np.datetime_as_string(times.to_numpy(dtype='datetime64[s]'), unit='s')
+    chars = text.view(np.uint32).reshape(len(text), -1)
+    dates = np.ascontiguousarray(chars[:, :10]).view('U10').ravel()
+    clock = np.ascontiguousarray(chars[:, 11:19]).view('U8').ravel()
+    return dates.astype(object), clock.astype(object)
+
+def _should_report(index: int, total: int) -> bool:
+    """判断第 index 项（从1开始）完成后是否需要汇报进度
+
+    说明:
+        只在整体进度的百分比发生变化或处理到最后一项时返回 True，
+        处理数量很多时进度回调和日志最多触发约100次。
+    """
+    return index == total or index * 100 // total != (index - 1) * 100 // total
+
+def _raise_if_interrupted(check_interrupt, log_message: str = "下载过程被中断",
+                          error_message: str = "下载过程被用户中断") -> None:
+    """调用中断检查函数，需要中断时记录日志并抛出 InterruptedError"""
+    if check_interrupt and check_interrupt():
+        logging.info(log_message)
+        raise InterruptedError(error_message)
+
+def download_and_store_data(local_data_path, stock_files, field_list, period_type, start_date, end_date, dividend_type='none', time_range='all', progress_callback=None, log_callback=None, check_interrupt=None, storage_format='csv', max_workers=8):
+    """
+    下载并存储指定股票、字段、周期类型和时间段的数据到文件。
+
+    函数功能:
+        1. 从指定的股票代码列表文件中读取股票代码。
         2. 创建本地数据存储目录(如果不存在)。
         3. 对于每只股票:
            - 下载指定周期类型的数据到本地。
@@ -910,6 +1530,7 @@ def download_and_store_data(local_data_path, stock_files, field_list, period_typ
         - 如果指定了具体的时间段,时间段部分将替换为 "HH_MM-HH_MM" 的格式
           - 示例: "000001.SZ_1m_20240101_20240430_09_30-11_30_none.csv"
           - 时间段: 09_30-11_30 (表示 09:30 到 11:30 的时间段)
+        - storage_format 为 'csv.gz' / 'parquet' 时扩展名分别为 ".csv.gz" / ".parquet"
 
     参数:
     - local_data_path (str): 本地数据存储路径。
@@ -982,6 +1603,18 @@ def download_and_store_data(local_data_path, stock_files, field_list, period_typ
       - 该函数用于检查是否需要中断下载过程。
       - 返回True表示需要中断，返回False表示继续执行。
 
+    - storage_format (str, optional): 存储格式。
+      - 'csv'（默认）: 兼容原有的CSV文件。
+      - 'csv.gz': gzip压缩的CSV文件，适合归档，读取时按扩展名自动解压。
+      - 'parquet': 使用 pyarrow 写入 Snappy 压缩的 Parquet 文件，保留数值类型，
+        date 列保存为原生日期时间类型；需要安装 pyarrow。
+
+    - max_workers (int, optional): 并发处理的线程数，默认为8。
+      - 股票按每批 _DOWNLOAD_BATCH_SIZE 只合并下载和读取，各批在线程池中并发执行，
+        同时向 xtdata 发起的下载请求数由 _XTDATA_DOWNLOAD_CONCURRENCY 限制。
+      - progress_callback / log_callback 可能在工作线程中被调用，函数内部会串行调用它们，
+        进度按已处理完成的股票数逐只更新。
+
     返回值:
     - 无返回值，数据直接保存到指定目录。
 
@@ -991,14 +1624,16 @@ def download_and_store_data(local_data_path, stock_files, field_list, period_typ
     - 如果保存文件失败，会记录错误信息。
     - 如果中断检查函数返回True，会抛出InterruptedError异常。
     """
+    if storage_format not in _STORAGE_EXTENSIONS:
+        raise ValueError(f"不支持的存储格式: {storage_format}，可选值: {list(_STORAGE_EXTENSIONS)}")
+    use_parquet = storage_format == 'parquet'
+
     try:
         # 获取所有股票代码
         stocks = []
         for stock_file in stock_files:
             # 检查是否需要中断
-            if check_interrupt and check_interrupt():
-                logging.info("下载过程被中断")
-                raise InterruptedError("下载过程被用户中断")
+            _raise_if_interrupted(check_interrupt)
                 
             if os.path.exists(stock_file):
                 logging.info(f"读取股票文件: {stock_file}")
@@ -1011,189 +1646,244 @@ def download_and_store_data(local_data_path, stock_files, field_list, period_typ
             os.makedirs(local_data_path)
 
         total_stocks = len(stocks)
-        for index, stock in enumerate(stocks, 1):
-            try:
-                # 检查是否需要中断
-                if check_interrupt and check_interrupt():
-                    logging.info("下载过程被中断")
-                    raise InterruptedError("下载过程被用户中断")
-                    
-                if log_callback:
-                    log_callback(f"正在处理 {stock} ({index}/{total_stocks})")
 
-                # 判断是否为指数
-                is_index = stock in ["000001.SH", "399001.SZ", "399006.SZ", "000688.SH", 
-                                   "000300.SH", "000905.SH", "000852.SH"]
+        def _fetch_batch(codes, is_index):
+            """批量下载并读取一组股票的数据（组内同为指数或同为股票）
+            
+            Returns:
+                dict: {股票代码: DataFrame}
+            """
+            # 检查是否需要中断
+            _raise_if_interrupted(check_interrupt)
+                
+            logging.info(f"获取{'指数' if is_index else '股票'}数据: {codes}")
+            with _xtdata_download_slots:
+                # 优先使用批量下载接口，不可用时逐只下载
+                download_batch = getattr(xtdata, 'download_history_data2', None)
+                if download_batch is not None and len(codes) > 1:
+                    download_batch(codes, period=period_type, start_time=start_date, end_time=end_date)
+                else:
+                    for stock in codes:
+                        xtdata.download_history_data(stock, period=period_type, 
+                                                   start_time=start_date, end_time=end_date)
+            
+            # 网络下载耗时最长，下载完成后再检查一次中断
+            _raise_if_interrupted(check_interrupt)
+                
+            if is_index:
+                # 指数数据处理
+                data = xtdata.get_market_data_ex(
+                    field_list=['time'] + field_list,
+                    stock_list=codes,
+                    period=period_type,
+                    start_time=start_date,
+                    end_time=end_date,
+                    count=-1,
+                    dividend_type=dividend_type,  # 添加复权参数
+                    fill_data=True
+                )
+            else:
+                # 普通股票数据处理
+                data = xtdata.get_local_data(  
+                    field_list=['time'] + field_list,
+                    stock_list=codes,
+                    period=period_type,
+                    start_time=start_date,
+                    end_time=end_date,
+                    dividend_type=dividend_type,  # 添加复权参数
+                    fill_data=True
+                )
+            return data or {}
+
+        # 回调可能在工作线程中触发，用同一把锁串行调用，进度按完成的股票数逐只上报
+        callback_lock = threading.Lock()
+        completed = 0
+
+        def _log(message):
+            if log_callback:
+                with callback_lock:
+                    log_callback(message)
+
+        def _stock_done():
+            nonlocal completed
+            with callback_lock:
+                completed += 1
+                if progress_callback:
+                    progress_callback(int(completed / total_stocks * 100))
 
+        def _fetch_batch_isolated(codes, is_index):
+            """批量获取失败时改为逐只获取，单只股票失败不影响同组其他股票"""
+            try:
+                return _fetch_batch(codes, is_index)
+            except InterruptedError:
+                raise
+            except Exception as e:
+                if len(codes) == 1:
+                    logging.error(f"获取 {codes[0]} 数据时出错: {str(e)}", exc_info=True)
+                    return {}
+                logging.warning(f"批量获取 {codes} 数据失败，改为逐只获取: {str(e)}")
+            data = {}
+            for stock in codes:
+                data.update(_fetch_batch_isolated([stock], is_index))
+            return data
+
+        def _process_batch(batch, is_index):
+            """下载一组股票的数据并逐只处理保存（在线程池中执行）
+            
+            单只股票获取或处理失败时记录错误并继续处理下一只股票。
+            """
+            data = _fetch_batch_isolated([stock for _, stock in batch], is_index)
+            for index, stock in batch:
+                _log(f"正在处理 {stock} ({index}/{total_stocks})")
                 try:
-                    # 每次主要操作前检查中断
-                    if check_interrupt and check_interrupt():
-                        logging.info("下载过程被中断")
-                        raise InterruptedError("下载过程被用户中断")
-                        
+                    if stock not in data:
+                        raise Exception(f"未能获取{'指数' if is_index else '股票'}数据: {stock}")
                     if is_index:
-                        # 指数数据处理
-                        logging.info(f"获取指数数据: {stock}")
-                        xtdata.download_history_data(stock, period=period_type, 
-                                                   start_time=start_date, end_time=end_date)
-                        
-                        # 再次检查中断
-                        if check_interrupt and check_interrupt():
-                            logging.info("下载过程被中断")
-                            raise InterruptedError("下载过程被用户中断")
-                            
-                        data = xtdata.get_market_data_ex(
-                            field_list=['time'] + field_list,
-                            stock_list=[stock],
-                            period=period_type,
-                            start_time=start_date,
-                            end_time=end_date,
-                            count=-1,
-                            dividend_type=dividend_type,  # 添加复权参数
-                            fill_data=True
-                        )
-                        if data and stock in data:
-                            df = data[stock]
-                            logging.info(f"成功获取指数数据: {stock}")
-                        else:
-                            raise Exception(f"未能获取指数数据: {stock}")
-                    else:
-                        # 普通股票数据处理
-                        logging.info(f"获取股票数据: {stock}")
-                        xtdata.download_history_data(stock, period=period_type, 
-                                                   start_time=start_date, end_time=end_date)
-                        
-                        # 再次检查中断
-                        if check_interrupt and check_interrupt():
-                            logging.info("下载过程被中断")
-                            raise InterruptedError("下载过程被用户中断")
-                            
-                        data = xtdata.get_local_data(  
-                            field_list=['time'] + field_list,
-                            stock_list=[stock],
-                            period=period_type,
-                            start_time=start_date,
-                            end_time=end_date,
-                            dividend_type=dividend_type,  # 添加复权参数
-                            fill_data=True
-                        )
-                        df = data[stock]
+                        logging.info(f"成功获取指数数据: {stock}")
+                    _process_stock(stock, data[stock])
+                except InterruptedError:
+                    raise
+                except Exception as e:
+                    logging.error(f"处理股票 {stock} 时出错: {str(e)}")
+                    _log(f"处理股票 {stock} 时出错: {str(e)}")
+                _stock_done()
 
-                    # 检查中断
-                    if check_interrupt and check_interrupt():
-                        logging.info("下载过程被中断")
-                        raise InterruptedError("下载过程被用户中断")
-                        
-                    # 开始数据处理和保存
-                    logging.debug(f"准备处理数据 - 股票代码: {stock}")
+                # 检查中断
+                _raise_if_interrupted(check_interrupt)
+
+        def _process_stock(stock, df):
+            """处理并保存单只股票的数据"""
+            try:
+                # 开始数据处理和保存
+                logging.debug(f"准备处理数据 - 股票代码: {stock}")
+                
+                # 检查df是否为DataFrame类型
+                if not isinstance(df, pd.DataFrame):
+                    error_msg = f"处理 {stock} 数据失败: 返回的数据不是DataFrame格式"
+                    logging.error(error_msg)
+                    _log(error_msg)
+                    return
                     
-                    # 检查df是否为DataFrame类型
-                    if not isinstance(df, pd.DataFrame):
-                        error_msg = f"处理 {stock} 数据失败: 返回的数据不是DataFrame格式"
-                        logging.error(error_msg)
-                        if log_callback:
-                            log_callback(error_msg)
-                        continue
-                        
-                    logging.debug(f"原始数据形状: {df.shape}")
-                    logging.debug(f"原始数据列: {df.columns.tolist()}")
+                logging.debug(f"原始数据形状: {df.shape}")
+                logging.debug(f"原始数据列: {df.columns.tolist()}")
+                
+                # 统一的数据处理逻辑
+                df["time"] = pd.to_datetime(df["time"].astype(float), unit='ms') + pd.Timedelta(hours=8)
+                logging.debug(f"时间列转换后的前5行:\n{df['time'].head()}")
+
+                if period_type == '1d':
+                    if use_parquet:
+                        df["date"] = df["time"].dt.normalize()
+                    else:
+                        df["date"] = _split_datetime_strings(df["time"])[0]
+                    df = df[["date"] + field_list]
+                else:
+                    if time_range != 'all':
+                        start_ns, end_ns = _time_range_to_ns(time_range)
+                        # 按当日纳秒偏移做整数比较，避免 .dt.time 生成 object 列
+                        time_of_day = df["time"].to_numpy(dtype='datetime64[ns]').view('int64') % _NS_PER_DAY
+                        mask = (time_of_day >= start_ns) & (time_of_day <= end_ns)
+                        df = df.loc[mask].copy()
                     
-                    # 统一的数据处理逻辑
-                    df["time"] = pd.to_datetime(df["time"].astype(float), unit='ms') + pd.Timedelta(hours=8)
-                    logging.debug(f"时间列转换后的前5行:\n{df['time'].head()}")
+                    if use_parquet:
+                        df["date"] = df["time"].dt.normalize()
+                        df["time"] = _split_datetime_strings(df["time"])[1]
+                    else:
+                        df["date"], df["time"] = _split_datetime_strings(df["time"])
+                    df = df[["date", "time"] + field_list]
 
-                    if period_type == '1d':
-                        df["date"] = df["time"].dt.strftime("%Y-%m-%d")
-                        df = df[["date"] + field_list]
+                # 保存前检查中断
+                _raise_if_interrupted(check_interrupt)
+                    
+                # 保存数据
+                logging.debug(f"准备保存数据 - 股票代码: {stock}")
+                logging.debug(f"处理后数据形状: {df.shape}")
+                logging.debug(f"处理后数据列: {df.columns.tolist()}")
+                logging.debug(f"处理后前5行数据:\n{df.head()}")
+                
+                if not df.empty:
+                    time_range_filename = time_range.replace(":", "_")
+                    # 在文件名中添加复权信息
+                    file_name = f"{stock}_{period_type}_{start_date}_{end_date}_{time_range_filename}_{dividend_type}{_STORAGE_EXTENSIONS[storage_format]}"
+                    file_path = os.path.join(local_data_path, file_name)
+                    
+                    logging.info(f"保存文件 - 路径: {file_path}")
+                    if use_parquet:
+                        df.to_parquet(file_path, engine='pyarrow', compression='snappy', index=False)
                     else:
-                        if time_range != 'all':
-                            start_time, end_time = time_range.split('-')
-                            start_time = datetime.strptime(start_time, "%H:%M").time()
-                            end_time = datetime.strptime(end_time, "%H:%M").time()
-                            df["time_obj"] = df["time"].dt.time
-                            mask = (df["time_obj"] >= start_time) & (df["time_obj"] <= end_time)
-                            df = df.loc[mask].copy()
-                            df.drop(columns=["time_obj"], inplace=True)
-                        
-                        df["date"] = df["time"].dt.strftime("%Y-%m-%d")
-                        df["time"] = df["time"].dt.strftime("%H:%M:%S")
-                        df = df[["date", "time"] + field_list]
-
-                    # 检查中断
-                    if check_interrupt and check_interrupt():
-                        logging.info("下载过程被中断")
-                        raise InterruptedError("下载过程被用户中断")
-                        
-                    # 保存数据
-                    logging.debug(f"准备保存数据 - 股票代码: {stock}")
-                    logging.debug(f"处理后数据形状: {df.shape}")
-                    logging.debug(f"处理后数据列: {df.columns.tolist()}")
-                    logging.debug(f"处理后前5行数据:\n{df.head()}")
+                        # 分块写出；.csv.gz 按扩展名自动使用gzip压缩
+                        df.to_csv(file_path, index=False, chunksize=_CSV_CHUNK_SIZE, lineterminator='\n')
+                    logging.info(f"文件保存成功: {file_path}")
                     
-                    if not df.empty:
-                        time_range_filename = time_range.replace(":", "_")
-                        # 在文件名中添加复权信息
-                        file_name = f"{stock}_{period_type}_{start_date}_{end_date}_{time_range_filename}_{dividend_type}.csv"
-                        file_path = os.path.join(local_data_path, file_name)
+                    # 验证文件是否成功保存并获取更多信息
+                    if os.path.exists(file_path):
+                        file_size = os.path.getsize(file_path)
+                        # 获取文件大小的可读形式
+                        if file_size < 1024:
+                            readable_size = f"{file_size} 字节"
+                        elif file_size < 1024 * 1024:
+                            readable_size = f"{file_size/1024:.2f} KB"
+                        else:
+                            readable_size = f"{file_size/(1024*1024):.2f} MB"
+                            
+                        # 获取行数和列数信息
+                        rows_count = len(df)
+                        cols_count = len(df.columns)
                         
-                        logging.info(f"保存文件 - 路径: {file_path}")
-                        df.to_csv(file_path, index=False)
-                        logging.info(f"文件保存成功: {file_path}")
+                        logging.info(f"已保存文件信息: 大小={readable_size}, 行数={rows_count}, 列数={cols_count}")
                         
-                        # 验证文件是否成功保存并获取更多信息
-                        if os.path.exists(file_path):
-                            file_size = os.path.getsize(file_path)
-                            # 获取文件大小的可读形式
-                            if file_size < 1024:
-                                readable_size = f"{file_size} 字节"
-                            elif file_size < 1024 * 1024:
-                                readable_size = f"{file_size/1024:.2f} KB"
-                            else:
-                                readable_size = f"{file_size/(1024*1024):.2f} MB"
-                                
-                            # 获取行数和列数信息
-                            rows_count = len(df)
-                            cols_count = len(df.columns)
-                            
-                            logging.info(f"已保存文件信息: 大小={readable_size}, 行数={rows_count}, 列数={cols_count}")
-                            
-                            # 通过log_callback提供详细信息
-                            if log_callback:
-                                file_info = f"{stock} {period_type} 数据已存储: 文件大小={readable_size}, 行数={rows_count}, 列数={cols_count}, 路径: {file_path}"
-                                log_callback(file_info)
-                        else:
-                            logging.error(f"文件保存失败: {file_path}")
-                            if log_callback:
-                                log_callback(f"保存失败: {file_path}")
-                    else:
-                        logging.warning(f"股票 {stock} 的数据为空，跳过保存")
+                        # 通过log_callback提供详细信息
                         if log_callback:
-                            log_callback(f"股票 {stock} 的数据为空，跳过保存")
+                            file_info = f"{stock} {period_type} 数据已存储: 文件大小={readable_size}, 行数={rows_count}, 列数={cols_count}, 路径: {file_path}"
+                            _log(file_info)
+                    else:
+                        logging.error(f"文件保存失败: {file_path}")
+                        _log(f"保存失败: {file_path}")
+                else:
+                    logging.warning(f"股票 {stock} 的数据为空，跳过保存")
+                    _log(f"股票 {stock} 的数据为空，跳过保存")
+
+            except InterruptedError:
+                logging.info(f"处理{stock}时被中断")
+                raise
+            except Exception as e:
+                logging.error(f"处理{stock}时出错: {str(e)}", exc_info=True)
+                raise
 
+        # 指数与股票分别按批次合并请求，每批一次下载、一次读取
+        index_batch, stock_batch, batches = [], [], []
+        for index, stock in enumerate(stocks, 1):
+            is_index = stock in _DOWNLOAD_INDEX_CODES
+            group = index_batch if is_index else stock_batch
+            group.append((index, stock))
+            if len(group) >= _DOWNLOAD_BATCH_SIZE:
+                batches.append((list(group), is_index))
+                group.clear()
+        for group, is_index in ((index_batch, True), (stock_batch, False)):
+            if group:
+                batches.append((group, is_index))
+
+        # 各批次之间相互独立且以网络/磁盘IO为主，使用线程池并发处理；
+        # 工作线程中会用到 pandas 和 xtdata，先在调用线程上完成导入
+        _ensure_loaded(pd, xtdata)
+        executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches))))
+        try:
+            futures = {executor.submit(_process_batch, batch, is_index): batch
+                       for batch, is_index in batches}
+            for future in as_completed(futures):
+                codes = [stock for _, stock in futures[future]]
+                try:
+                    future.result()
                 except InterruptedError:
-                    logging.info(f"处理{stock}时被中断")
+                    logging.info(f"处理股票 {codes} 时被用户中断")
                     raise
                 except Exception as e:
-                    logging.error(f"处理{stock}时出错: {str(e)}", exc_info=True)
+                    logging.error(f"处理股票 {codes} 时出错: {str(e)}", exc_info=True)
                     raise
+        finally:
+            # 出错或中断时取消尚未开始的任务，并等待正在执行的任务结束
+            executor.shutdown(wait=True, cancel_futures=True)
 
-                if progress_callback:
-                    progress_callback(int(index / total_stocks * 100))
-                
-                # 检查中断
-                if check_interrupt and check_interrupt():
-                    logging.info("下载过程被中断")
-                    raise InterruptedError("下载过程被用户中断")
-                    
-                time.sleep(1)  # 添加延迟避免请求过快
-
-            except InterruptedError:
-                logging.info(f"处理股票 {stock} 时被用户中断")
-                raise
-            except Exception as e:
-                logging.error(f"处理股票 {stock} 时出错: {str(e)}", exc_info=True)
-                raise
-        
         if log_callback:
             log_callback("数据下载和存储完成.")
 
@@ -1204,7 +1894,65 @@ def download_and_store_data(local_data_path, stock_files, field_list, period_typ
         logging.error(f"下载存储数据时出错: {str(e)}", exc_info=True)
         raise
 
-def calculate_intraday_features(file_path, sample_file_name, daily_file_name_pattern, feature_types, output_path, output_file_name, trading_minutes=240):
+def _write_feature_output(df: pd.DataFrame, output_path: str, output_file_name: str,
+                          first: bool, output_format: str = 'csv') -> None:
+    """写出单只股票的特征结果
+    
+    Args:
+        df: 含 stock_code 列的特征数据
+        output_path: 输出目录，需由调用方在循环前创建
+        output_file_name: 输出文件名（parquet 时作为数据集根目录名）
+        first: 是否为本次运行的第一次写出；csv 时写入表头并覆盖已有文件，parquet 时先清空
+            已有数据集目录，否则追加
+        output_format: 'csv' 或 'parquet'
+    """
+    output_file_path = os.path.join(output_path, output_file_name)
+    if output_format == 'parquet':
+        if first:
+            # 与csv覆盖写入一致：清掉上次运行留下的数据集，避免残留本次不再包含的股票分区
+            if os.path.isdir(output_file_path):
+                shutil.rmtree(output_file_path)
+            elif os.path.exists(output_file_path):
+                os.remove(output_file_path)
+        # 每只股票写为一个分区，覆盖本次运行中同一股票的已写分区
+        df.to_parquet(output_file_path, engine='pyarrow', index=False,
+                      partition_cols=['stock_code'], existing_data_behavior='delete_matching')
+    elif output_format == 'csv':
+        # 保存结果到csv文件,如果是第一个文件则写入表头并覆盖,否则追加数据
+        df.to_csv(output_file_path, index=False, header=first, mode='w' if first else 'a')
+    else:
+        raise ValueError(f"不支持的输出格式: {output_format}，可选值: ['csv', 'parquet']")
+
+def _write_feature_outputs(frames, output_path: str, output_file_name: str,
+                           output_format: str = 'csv', buffer_rows: int = _FEATURE_WRITE_BUFFER_ROWS) -> None:
+    """按顺序写出多只股票的特征结果
+
+    Args:
+        frames: 逐只股票的特征数据（可迭代对象，按写出顺序给出）
+        output_path: 输出目录
+        output_file_name: 输出文件名
+        output_format: 'csv' 或 'parquet'
+        buffer_rows: 累积行数达到该值时合并写出一次
+
+    说明:
+        结果先在内存中累积，再用 pd.concat 合并后一次写出，文件内容与逐只写出一致；
+        按行数分批写出，保证股票很多时内存占用仍然有界。
+    """
+    pending = []
+    pending_rows = 0
+    first = True
+    for df in frames:
+        pending.append(df)
+        pending_rows += len(df)
+        if pending_rows >= buffer_rows:
+            _write_feature_output(pd.concat(pending, ignore_index=True), output_path, output_file_name, first, output_format)
+            pending = []
+            pending_rows = 0
+            first = False
+    if pending:
+        _write_feature_output(pd.concat(pending, ignore_index=True), output_path, output_file_name, first, output_format)
+
+def calculate_intraday_features(file_path, sample_file_name, daily_file_name_pattern, feature_types, output_path, output_file_name, trading_minutes=240, output_format='csv', feature_dtype='float64'):
     """
     计算股票的日内特征,并将结果保存到csv文件中。
 
@@ -1226,6 +1974,12 @@ def calculate_intraday_features(file_path, sample_file_name, daily_file_name_pat
         输出文件名。
     - trading_minutes: int, 可选, 默认为240
         每个交易日的交易分钟数,用于计算成交量比例。默认为240分钟(4小时)
+    - output_format: str, 可选, 默认为'csv'
+        输出格式。'csv' 追加写入单个csv文件; 'parquet' 写入以 output_file_name 为根目录、
+        按 stock_code 分区的 Parquet 数据集(需要安装 pyarrow),读取时可按列和股票代码裁剪。
+    - feature_dtype: str, 可选, 默认为'float64'
+        计算出的特征列的浮点类型。设为 'float32' 时内存占用和输出文件大小约减半,
+        收益率等特征保留约7位有效数字。
 
     函数功能:
     1. 根据样本文件名提取周期类型、起始日期和结束日期。
@@ -1253,71 +2007,160 @@ def calculate_intraday_features(file_path, sample_file_name, daily_file_name_pat
     start_date = file_name_parts[2]
     end_date = file_name_parts[3]
 
-    # 获取与样本文件名格式相同的所有文件
-    file_pattern = f"*_{data_type}_{start_date}_{end_date}_*.csv"
+    # 获取与样本文件名格式相同的所有文件（扩展名与样本文件一致，支持 .csv / .parquet）
+    file_ext = os.path.splitext(sample_file_name)[1] or '.csv'
+    file_pattern = f"*_{data_type}_{start_date}_{end_date}_*{file_ext}"
     file_list = glob.glob(os.path.join(file_path, file_pattern))
 
-    # 理每文件
-    for idx, minute_file_path in enumerate(file_list):
+    stock_code_example = daily_file_name_pattern.split('_')[0]
+
+    def _load_stock_files(minute_file_path):
+        """读取单只股票的分钟数据和对应的日数据文件"""
         # 从文件路径中提取股票代码
         stock_code = os.path.basename(minute_file_path).split('_')[0]
 
         # 读取逐分钟数据文件
-        minute_data = pd.read_csv(minute_file_path)
+        minute_data = _read_data_file(minute_file_path)
 
         # 构造正确的日数据文件名
-        stock_code_example = daily_file_name_pattern.split('_')[0]
         daily_file_name = daily_file_name_pattern.replace(stock_code_example, stock_code)
         daily_file_path = os.path.join(file_path, daily_file_name)
-        daily_data = pd.read_csv(daily_file_path)
-
-        # 计算过去5天的平均交易量
-        daily_data['past_avg_volume'] = daily_data['volume'].rolling(window=5).mean().shift(1)
+        # 日数据只用到日期、收盘价和成交量
+        daily_data = _read_data_file(daily_file_path, columns=_INTRADAY_DAILY_COLUMNS)
+        return stock_code, minute_data, daily_data
 
-        # 获取前一天的收盘价
-        daily_data['prev_close'] = daily_data['close'].shift(1)
+    # 如果输出路径不存在,则创建文件夹（只需在循环前检查一次）
+    os.makedirs(output_path, exist_ok=True)
 
-        minute_data['date'] = pd.to_datetime(minute_data['date'])
-        daily_data['date'] = pd.to_datetime(daily_data['date'])
+    def _iter_features():
+        """逐只股票计算特征；后台线程预读后续文件，与当前文件的计算、写出重叠"""
+        for stock_code, minute_data, daily_data in _prefetch(_load_stock_files, file_list):
 
-        # 检查分钟数据否有 'close' 列,如果没有,则使用 'price' 列
-        if 'close' not in minute_data.columns:
-            minute_data['price'] = minute_data['price']
-        else:
-            minute_data['price'] = minute_data['close']
+            # 计算过去5天的平均交易量
+            rolling_volume = _rolling_mean(daily_data['volume'].to_numpy(dtype=np.float64), 5)
+            past_avg_volume = np.full(rolling_volume.shape, np.nan)
+            past_avg_volume[1:] = rolling_volume[:-1]  # 后移一天，不含当天
+            daily_data['past_avg_volume'] = past_avg_volume
 
-        # 按日期合并分钟据和日数据
-        merged_data = pd.merge(minute_data, daily_data[['date', 'past_avg_volume', 'prev_close']], on='date', how='left')
+            # 获取前一天的收盘价
+            daily_data['prev_close'] = daily_data['close'].shift(1)
 
-        eps = 1e-8  # 添加一个小的常数
+            # 分钟数据每个交易日有数百行相同日期，只对去重后的日期做解析
+            minute_data['date'] = _to_datetime_unique(minute_data['date'])
+            daily_data['date'] = pd.to_datetime(daily_data['date'])
 
-        # 计算特征
-        for feature_type in feature_types:
-            if feature_type == 'volume_ratio':
-                merged_data['volume_ratio'] = merged_data.apply(lambda x: x['volume'] / (x['past_avg_volume'] / trading_minutes + eps) if pd.notna(x['past_avg_volume']) else np.nan, axis=1)
-            elif feature_type == 'return_rate':
-                merged_data['return_rate'] = merged_data.apply(lambda x: (x['price'] - x['prev_close']) / x['prev_close'] if pd.notna(x['prev_close']) else np.nan, axis=1)
+            # 检查分钟数据否有 'close' 列,如果没有,则使用 'price' 列
+            if 'close' not in minute_data.columns:
+                minute_data['price'] = minute_data['price']
+            else:
+                minute_data['price'] = minute_data['close']
 
-        # 删除不要的列
-        merged_data = merged_data[['date', 'time'] + feature_types]
-        merged_data['stock_code'] = stock_code  # 添加股票代码列
+            # 将日数据按日期广播到每一分钟：日期唯一时按索引对齐取值，不再合并出整表副本
+            daily_lookup = daily_data.set_index('date')[['past_avg_volume', 'prev_close']]
+            if daily_lookup.index.is_unique:
+                aligned = daily_lookup.reindex(minute_data['date'].to_numpy())
+                merged_data = minute_data
+            else:
+                # 日数据存在重复日期时沿用按日期合并（与原逻辑一致）
+                merged_data = pd.merge(minute_data, daily_data[['date', 'past_avg_volume', 'prev_close']], on='date', how='left')
+                aligned = merged_data
+
+            eps = 1e-8  # 添加一个小的常数
+
+            # 一次性取出底层数组，全部特征按 ndarray 计算
+            price = merged_data['price'].to_numpy(dtype=np.float64)
+            prev_close = aligned['prev_close'].to_numpy(dtype=np.float64)
+            past_avg_volume = aligned['past_avg_volume'].to_numpy(dtype=np.float64)
+            volume = merged_data['volume'].to_numpy(dtype=np.float64)
+
+            # 计算特征（past_avg_volume / prev_close 为 NaN 时结果自然为 NaN）；
+            # 与 pandas 的 Series 除法一致，prev_close 为0时得到 inf 而不发出 RuntimeWarning
+            features = {}
+            with np.errstate(divide='ignore', invalid='ignore'):
+                for feature_type in feature_types:
+                    if feature_type == 'volume_ratio':
+                        features['volume_ratio'] = volume / (past_avg_volume / trading_minutes + eps)
+                    elif feature_type == 'return_rate':
+                        features['return_rate'] = (price - prev_close) / prev_close
+
+            # 去掉前6天(包括第6天)和最后一天的数据：先在数组上得到保留行，再一次性组装结果，
+            # 避免先构造完整结果再过滤产生的中间DataFrame
+            # 边界运算全部使用 numpy datetime64，不经过 pandas Timestamp
+            dates = merged_data['date']
+            date_values = dates.to_numpy()
+            six_days = np.timedelta64(6, 'D')
+            if len(date_values) and dates.is_monotonic_increasing:
+                # 分钟数据通常已按时间排序：首尾即为最小/最大日期，二分查找保留区间的上下界，直接切片
+                lower = date_values[0] + six_days
+                upper = date_values[-1]
+                keep = slice(date_values.searchsorted(lower, side='right'),
+                             date_values.searchsorted(upper, side='left'))
+            else:
+                lower = dates.min().to_datetime64() + six_days
+                upper = dates.max().to_datetime64()
+                keep = (date_values > lower) & (date_values < upper)
 
-        # 去掉前6天(包括第6天)和最后一天的数据
-        min_date = merged_data['date'].min()
-        max_date = merged_data['date'].max()
-        merged_data = merged_data[(merged_data['date'] > min_date + pd.Timedelta(days=6)) & (merged_data['date'] < max_date)]
+            # 只保留需要的列，添加股票代码列
+            result = {'date': date_values[keep], 'time': merged_data['time'].to_numpy()[keep]}
+            for feature_type in feature_types:
+                result[feature_type] = features[feature_type][keep].astype(feature_dtype, copy=False)
+            result['stock_code'] = stock_code
+            merged_data = pd.DataFrame(result)
 
-        # 如果输出路径不存在,则创建文件夹
-        if not os.path.exists(output_path):
-            os.makedirs(output_path)
+            yield merged_data
 
-        # 保存结果到csv文件,如果文件已经存在,则追加数据
-        output_file_path = os.path.join(output_path, output_file_name)
-        header = idx == 0  # 如果是第一个文件,则写入表头,否则不写入
-        mode = 'w' if idx == 0 else 'a'  # 如果是第一个文件,则写入模式为'w',否则为'a'(追加)
-        merged_data.to_csv(output_file_path, index=False, header=header, mode=mode)
+    # 处理每个文件，结果累积后批量写出
+    _write_feature_outputs(_iter_features(), output_path, output_file_name, output_format)
 
-def calculate_next_day_return(file_path, sample_file_name, feature_types, output_path, output_file_name):
+def _calculate_next_day_return_one(daily_file_path: str, feature_types: list,
+                                   feature_dtype: str = 'float64') -> pd.DataFrame:
+    """计算单个日数据文件的下一交易日收益率特征（可在子进程中执行）
+    
+    Args:
+        daily_file_path: 日数据文件路径
+        feature_types: 要计算的特征类型列表
+        feature_dtype: 计算出的收益率列的浮点类型
+        
+    Returns:
+        pd.DataFrame: 含 date、特征列和 stock_code 列的结果
+    """
+    # 从文路径中提取股票代码
+    stock_code = os.path.basename(daily_file_path).split('_')[0]
+
+    # 读取日数据文件：只解析日期、收盘价及与特征同名的列
+    daily_data = _read_data_file(daily_file_path, columns={'date', 'close', *feature_types})
+
+    # 将日期列转换为日期时间类型
+    daily_data['date'] = pd.to_datetime(daily_data['date'])
+
+    # 计算第二天的收盘收益率,并将其记录到当天
+    if 'next_day_return_rate' in feature_types:
+        # 一次数组运算得到 close[t+1] / close[t] - 1，最后一天没有下一交易日，记为NaN
+        close = daily_data['close'].to_numpy(dtype=np.float64)
+        next_day_return = np.full(close.shape, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            next_day_return[:-1] = close[1:] / close[:-1] - 1.0
+        daily_data['next_day_return_rate'] = next_day_return.astype(feature_dtype, copy=False)
+
+    # 提取日级别的数据,每个日期只保留一条记录
+    daily_data = daily_data[['date'] + [feature for feature in feature_types if feature in daily_data.columns]].dropna()
+    dates = daily_data['date'].to_numpy()
+    if not (dates[1:] > dates[:-1]).all():
+        # 日期严格递增时必然唯一，可跳过去重；否则保留每个日期的第一条记录
+        daily_data = daily_data.take(np.flatnonzero(~daily_data['date'].duplicated(keep='first').to_numpy()))
+    daily_data['stock_code'] = stock_code  # 添加股票代码列
+
+    # 去掉前6天(包括第6天)的数据（保留到最后一天）
+    # 日线通常已按日期升序排列，未排序时才排序；有序后首尾即为最小/最大日期，按位置切片即可
+    if not daily_data['date'].is_monotonic_increasing:
+        daily_data = daily_data.sort_values('date', kind='stable')
+    dates = daily_data['date'].to_numpy()
+    if len(dates) == 0:
+        return daily_data
+    start = dates.searchsorted(dates[0] + np.timedelta64(6, 'D'), side='right')
+    return daily_data.iloc[start:]
+
+def calculate_next_day_return(file_path, sample_file_name, feature_types, output_path, output_file_name, output_format='csv', max_workers=None, feature_dtype='float64', use_processes=False):
     """
     计算股票的下一个交易日收益率,并将结果保存到csv文件中。
 
@@ -1334,6 +2177,21 @@ def calculate_next_day_return(file_path, sample_file_name, feature_types, output
         输出文件的目录路径。
     - output_file_name: str
         输出文件名。
+    - output_format: str, 可选, 默认为'csv'
+        输出格式。'csv' 追加写入单个csv文件; 'parquet' 写入以 output_file_name 为根目录、
+        按 stock_code 分区的 Parquet 数据集(需要安装 pyarrow),读取时可按列和股票代码裁剪。
+    - feature_dtype: str, 可选, 默认为'float64'
+        计算出的特征列的浮点类型。设为 'float32' 时内存占用和输出文件大小约减半,
+        收益率等特征保留约7位有效数字。
+    - use_processes: bool, 可选, 默认为False
+        是否使用进程池并行计算。默认在当前进程中顺序计算,与原有行为一致。
+        设为 True 时会启动子进程:Windows 下子进程以 spawn 方式重新导入主模块,
+        调用方脚本必须把入口代码放在 if __name__ == '__main__': 之下,
+        否则会重复执行脚本甚至无限创建进程;打包后的程序还需在入口处先调用
+        multiprocessing.freeze_support()。在GUI等无法满足上述条件的环境中请保持默认值。
+    - max_workers: int, 可选, 默认为None
+        仅在 use_processes=True 时生效,并行计算的进程数,None 表示使用全部CPU核心,
+        1 表示在当前进程中顺序计算。
 
     函数功能:
     1. 根据样本文件名提取起始日期和结束日期
@@ -1358,46 +2216,156 @@ def calculate_next_day_return(file_path, sample_file_name, feature_types, output
     end_date = file_name_parts[3]
 
     # 获取与样本文件名格式相同的所有文件
-    file_pattern = f"*_1d_{start_date}_{end_date}_all.csv"
+    file_ext = os.path.splitext(sample_file_name)[1] or '.csv'
+    file_pattern = f"*_1d_{start_date}_{end_date}_all{file_ext}"
     file_list = glob.glob(os.path.join(file_path, file_pattern))
 
-    # 处理每个文件
-    for idx, daily_file_path in enumerate(file_list):
-        # 从文路径中提取股票代码
-        stock_code = os.path.basename(daily_file_path).split('_')[0]
+    # 如果输出路径不存在,则创建文件夹（只需在循环前检查一次）
+    os.makedirs(output_path, exist_ok=True)
+
+    # 各文件相互独立，显式启用时计算放到进程池中并行执行；结果按文件顺序依次写出
+    if not use_processes or max_workers == 1 or len(file_list) <= 1:
+        results = (_calculate_next_day_return_one(path, feature_types, feature_dtype) for path in file_list)
+        _write_feature_outputs(results, output_path, output_file_name, output_format)
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(_calculate_next_day_return_one, file_list, repeat(feature_types), repeat(feature_dtype))
+            _write_feature_outputs(results, output_path, output_file_name, output_format)
+
+# 并发查询合约详情的线程数
+_INSTRUMENT_DETAIL_WORKERS = 32
+
+# 需要支持中途停止时，每提交这么多个代码检查一次停止条件
+_INSTRUMENT_DETAIL_BATCH = 256
+
+# 字符串形式合约详情的解析函数，首次遇到字符串返回值时确定（JSON 解析或 ast.literal_eval）
+_instrument_detail_parser = None
+
+def _parse_instrument_detail(text):
+    """解析字符串形式的合约详情
+
+    说明:
+        xtdata 不同版本返回的字符串可能是 JSON，也可能是 Python 字面量（单引号）。
+        首次解析时先尝试 JSON 解析（已安装 orjson 时使用 orjson.loads，否则为 json.loads），
+        失败再用 ast.literal_eval，并记住可用的解析函数，之后直接调用；记住的是 JSON 解析
+        但个别返回值不是 JSON 时，仍回退到 ast.literal_eval。
+    """
+    global _instrument_detail_parser
+    if _instrument_detail_parser is None:
+        try:
+            result = _json_loads(text)
+            _instrument_detail_parser = _json_loads
+            return result
+        except ValueError:
+            _instrument_detail_parser = ast.literal_eval
+    if _instrument_detail_parser is _json_loads:
+        try:
+            return _json_loads(text)
+        except ValueError:
+            pass
+    return ast.literal_eval(text)
+
+@lru_cache(maxsize=None)
+def _get_instrument_detail(code):
+    """获取合约详情，按代码缓存
+
+    说明:
+        同一代码会同时出现在多个板块及成分股列表中，缓存后每只证券只查询一次；
+        字符串形式的返回值在此统一由 _parse_instrument_detail 解析。缓存只在一次
+        _fetch_sector_details 调用期间有效，前后都会 cache_clear()，既保证名称变更能被
+        重新获取，也不在两次刷新之间常驻数千条详情。异常不会被缓存。
+    """
+    detail = xtdata.get_instrument_detail(code)
+    if detail and isinstance(detail, str):
+        detail = _parse_instrument_detail(detail)
+    return detail or None
+
+def _get_instrument_details(codes, max_workers=_INSTRUMENT_DETAIL_WORKERS, check_interrupt=None):
+    """并发获取一组代码的合约详情
+
+    Args:
+        codes: 股票代码列表
+        max_workers: 最大并发查询数
+        check_interrupt: 可选的停止检查函数，返回 True 时不再提交新的查询
+
+    Returns:
+        list: 与 codes 顺序一致的详情列表；某个代码查询失败时，对应位置为该异常对象，
+            由调用方在逐个处理时重新抛出，沿用原有的异常处理逻辑；
+            被中途停止时，未查询的代码对应位置为 None
 
-        # 读取日数据文件
-        daily_data = pd.read_csv(daily_file_path)
+    说明:
+        get_instrument_detail 的耗时主要在与 miniQMT 的往返通信上，调用期间会释放 GIL，
+        用线程池并发查询可以把逐个等待的延迟重叠起来。
+    """
+    def _fetch(code):
+        try:
+            return _get_instrument_detail(code)
+        except Exception as e:
+            return e
+
+    if len(codes) <= 1:
+        return [_fetch(code) for code in codes]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(codes))) as executor:
+        if check_interrupt is None:
+            return list(executor.map(_fetch, codes))
+
+        # 分批提交，批与批之间检查是否需要停止
+        details = []
+        for start in range(0, len(codes), _INSTRUMENT_DETAIL_BATCH):
+            if check_interrupt():
+                details.extend([None] * (len(codes) - len(details)))
+                break
+            details.extend(executor.map(_fetch, codes[start:start + _INSTRUMENT_DETAIL_BATCH]))
+        return details
 
-        # 将日期列转换为日期时间类型
-        daily_data['date'] = pd.to_datetime(daily_data['date'])
+def _fetch_sector_details(sector_names, check_interrupt=None):
+    """一次性获取多个板块的成分股，并对所有成分股的并集并发查询合约详情
 
-        # 计算第二天的收盘收益率,并将其记录到当天
-        if 'next_day_return_rate' in feature_types:
-            daily_data['next_day_return_rate'] = daily_data['close'].pct_change().shift(-1)
+    Args:
+        sector_names: 板块名称列表
+        check_interrupt: 可选的停止检查函数，见 _get_instrument_details
 
-        # 提取日级别的数据,每个日期只保留一条记录
-        daily_data = daily_data[['date'] + [feature for feature in feature_types if feature in daily_data.columns]].dropna().drop_duplicates(subset='date')
-        daily_data['stock_code'] = stock_code  # 添加股票代码列
+    Returns:
+        tuple: (sector_codes, details)
+            sector_codes: 板块名称 -> 成分股代码列表，获取失败时为该异常对象
+            details: 代码 -> 合约详情，查询失败时为该异常对象
 
-        # 去掉前6天(包括第6天)和最后一天的数据
-        min_date = daily_data['date'].min()
-        max_date = daily_data['date'].max()
-        second_last_date = max_date  
-        daily_data = daily_data[(daily_data['date'] > min_date + pd.Timedelta(days=6)) & (daily_data['date'] <= second_last_date)]
+    说明:
+        A股各板块、指数成分股之间有大量重复代码，先求并集再查询，
+        每只证券只查询一次，各板块的处理循环中不再有任何网络调用。
+    """
+    _get_instrument_detail.cache_clear()
+    sector_codes = {}
+    for sector_name in sector_names:
+        try:
+            sector_codes[sector_name] = xtdata.get_stock_list_in_sector(sector_name)
+        except Exception as e:
+            sector_codes[sector_name] = e
+
+    # 保持首次出现的顺序去重
+    all_codes = list(dict.fromkeys(
+        code
+        for codes in sector_codes.values()
+        if codes and not isinstance(codes, Exception)
+        for code in codes
+    ))
+    try:
+        details = dict(zip(all_codes, _get_instrument_details(all_codes, check_interrupt=check_interrupt)))
+    finally:
+        # 详情已汇总到 details 字典中，由调用方持有，释放缓存
+        _get_instrument_detail.cache_clear()
+    return sector_codes, details
 
-        # 如果输出路径不存在,则创建文件夹
-        if not os.path.exists(output_path):
-            os.makedirs(output_path)
+def get_available_sectors(with_counts=False):
+    """获取所有可用的板块代码
 
-        # 保存结果到csv文件,如果文件已经存在,则追加数据
-        output_file_path = os.path.join(output_path, output_file_name)
-        header = idx == 0  # 如果是第一个文件,则写入表头,否则不写入
-        mode = 'w' if idx == 0 else 'a'  # 如果是第一个文件,则写入模式为'w',否则为'a'(追加)
-        daily_data.to_csv(output_file_path, index=False, header=header, mode=mode)
+    Args:
+        with_counts: 是否同时获取并记录每个板块的成分股数量。默认 False，只返回板块名称，
+            不再为统计数量逐个拉取完整的成分股列表
 
-def get_available_sectors():
-    """获取所有可用的板块代码"""
+    Returns:
+        list: 板块代码列表，出错时返回空列表
+    """
     try:
         # 获取 miniQMT 客户端连接
         # c = get_client()
@@ -1408,12 +2376,13 @@ def get_available_sectors():
         # 获取所有板块
         sectors = xtdata.get_sector_list()
         
-        logging.info("可用的板块列表：")
-        for sector in sectors:
-            # 尝试获取该板块的成分股
-            components = xtdata.get_stock_list_in_sector(sector)
-            count = len(components) if components else 0
-            logging.info(f"板块: {sector}, 成分股数量: {count}")
+        if with_counts and sectors:
+            logging.info("可用的板块列表：")
+            # 各板块的成分股并发获取，按板块顺序输出数量
+            with ThreadPoolExecutor(max_workers=min(_INSTRUMENT_DETAIL_WORKERS, len(sectors))) as executor:
+                for sector, components in zip(sectors, executor.map(xtdata.get_stock_list_in_sector, sectors)):
+                    count = len(components) if components else 0
+                    logging.info(f"板块: {sector}, 成分股数量: {count}")
         
         return sectors
     except Exception as e:
@@ -1448,6 +2417,8 @@ def get_stock_list():
             'hs_convertible_bonds': [],  # 沪深转债
             'hs_etf': [],  # 沪深ETF
         }
+        # 全部股票按代码去重，最后统一排序后写回 stock_dict['all_stocks']
+        all_stocks = {}
         
         # 重要指数列表
         important_indices = [
@@ -1476,30 +2447,38 @@ def get_stock_list():
             '上证50': 'sz50_components'
         }
 
+        # 先取齐所有板块的成分股，再对其并集一次性并发查询合约详情，后续各板块只做字典查找
+        logging.info("获取各板块成分股及证券详细信息...")
+        sector_codes, details = _fetch_sector_details(
+            list(sector_mapping) + list(index_components_mapping) + ['沪深转债', '沪深ETF'])
+
         # 获取各个板块的股票
         for sector_name, dict_key in sector_mapping.items():
             try:
                 logging.info(f"获取{sector_name}股票列表...")
                 print(f"[更新进度] 正在获取{sector_name}股票列表...")
-                stocks = xtdata.get_stock_list_in_sector(sector_name)
+                stocks = sector_codes[sector_name]
+                if isinstance(stocks, Exception):
+                    raise stocks
                 if stocks:
                     logging.info(f"获取到 {len(stocks)} 只{sector_name}股票")
+                    board_append = stock_dict[dict_key].append
                     for code in stocks:
                         try:
-                            detail = xtdata.get_instrument_detail(code)
+                            detail = details[code]
+                            if isinstance(detail, Exception):
+                                raise detail
                             if detail:
-                                if isinstance(detail, str):
-                                    detail = ast.literal_eval(detail)
                                 name = detail.get('InstrumentName', '')
                                 if name:
                                     stock_info = {
                                         'code': code,
                                         'name': name
                                     }
-                                    stock_dict[dict_key].append(stock_info)
+                                    board_append(stock_info)
                                     # 将所有股票（除了沪深A股）添加到all_stocks中
                                     if dict_key != 'hs_a':  # 不添加沪深A股，因为它包含了其他所有股票
-                                        stock_dict['all_stocks'].append(stock_info)
+                                        all_stocks[code] = stock_info
                         except Exception as e:
                             logging.error(f"处理股票 {code} 时出错: {str(e)}")
                             continue
@@ -1513,24 +2492,27 @@ def get_stock_list():
         for index_name, dict_key in index_components_mapping.items():
             try:
                 logging.info(f"获取{index_name}成分股...")
-                components = xtdata.get_stock_list_in_sector(index_name)
+                components = sector_codes[index_name]
+                if isinstance(components, Exception):
+                    raise components
                 if components:
                     logging.info(f"获取到 {len(components)} 只{index_name}成分股")
+                    board_append = stock_dict[dict_key].append
                     for code in components:
                         try:
-                            detail = xtdata.get_instrument_detail(code)
+                            detail = details[code]
+                            if isinstance(detail, Exception):
+                                raise detail
                             if detail:
-                                if isinstance(detail, str):
-                                    detail = ast.literal_eval(detail)
                                 name = detail.get('InstrumentName', '')
                                 if name:
                                     stock_info = {
                                         'code': code,
                                         'name': name
                                     }
-                                    stock_dict[dict_key].append(stock_info)
+                                    board_append(stock_info)
                                     # 将成分股也添加到all_stocks中
-                                    stock_dict['all_stocks'].append(stock_info)
+                                    all_stocks[code] = stock_info
                         except Exception as e:
                             logging.error(f"处理{index_name}成分股 {code} 时出错: {str(e)}")
                             continue
@@ -1548,22 +2530,26 @@ def get_stock_list():
         for cb_name, dict_key in convertible_bonds_mapping.items():
             try:
                 logging.info(f"获取{cb_name}成分股...")
-                cb_stocks = xtdata.get_stock_list_in_sector(cb_name)
+                cb_stocks = sector_codes[cb_name]
+                if isinstance(cb_stocks, Exception):
+                    raise cb_stocks
                 if cb_stocks:
                     logging.info(f"获取到 {len(cb_stocks)} 只{cb_name}")
+                    board_append = stock_dict[dict_key].append
                     for code in cb_stocks:
                         try:
-                            detail = xtdata.get_instrument_detail(code)
+                            detail = details[code]
+                            if isinstance(detail, Exception):
+                                raise detail
                             if detail:
-                                if isinstance(detail, str):
-                                    detail = ast.literal_eval(detail)
                                 name = detail.get('InstrumentName', '')
-                                if name and '转债' in name:
+                                # 转债名称通常以“转债”结尾，先比较结尾，不是时再查找子串
+                                if name and (name.endswith('转债') or '转债' in name):
                                     bond_info = {
                                         'code': code,
                                         'name': name
                                     }
-                                    stock_dict[dict_key].append(bond_info)
+                                    board_append(bond_info)
                                     # 不将转债添加到all_stocks中，因为它们是债券而非股票
                         except Exception as e:
                             logging.error(f"处理{cb_name} {code} 时出错: {str(e)}")
@@ -1582,22 +2568,25 @@ def get_stock_list():
         for etf_name, dict_key in etf_mapping.items():
             try:
                 logging.info(f"获取{etf_name}成分股...")
-                etf_stocks = xtdata.get_stock_list_in_sector(etf_name)
+                etf_stocks = sector_codes[etf_name]
+                if isinstance(etf_stocks, Exception):
+                    raise etf_stocks
                 if etf_stocks:
                     logging.info(f"获取到 {len(etf_stocks)} 只{etf_name}")
+                    board_append = stock_dict[dict_key].append
                     for code in etf_stocks:
                         try:
-                            detail = xtdata.get_instrument_detail(code)
+                            detail = details[code]
+                            if isinstance(detail, Exception):
+                                raise detail
                             if detail:
-                                if isinstance(detail, str):
-                                    detail = ast.literal_eval(detail)
                                 name = detail.get('InstrumentName', '')
                                 if name:
                                     etf_info = {
                                         'code': code,
                                         'name': name
                                     }
-                                    stock_dict[dict_key].append(etf_info)
+                                    board_append(etf_info)
                                     # 不将ETF添加到all_stocks中，因为它们是基金而非股票
                         except Exception as e:
                             logging.error(f"处理{etf_name} {code} 时出错: {str(e)}")
@@ -1611,16 +2600,15 @@ def get_stock_list():
         # 添加指数并同时添加到all_stocks
         stock_dict['indices'] = important_indices
         for index in important_indices:
-            stock_dict['all_stocks'].append(index)
+            all_stocks[index['code']] = index
         
         # 对每个板块按照代码排序并去重
+        # list.sort 为 Timsort：xtdata 已按代码返回的板块只需线性扫描一遍，无需额外判断是否有序
         for board in stock_dict:
             if board == 'all_stocks':
-                # 对集合进行去重
-                unique_stocks = {stock['code']: stock for stock in stock_dict[board]}.values()
-                stock_dict[board] = sorted(unique_stocks, key=lambda x: x['code'])
+                stock_dict[board] = sorted(all_stocks.values(), key=itemgetter('code'))
             else:
-                stock_dict[board].sort(key=lambda x: x['code'])
+                stock_dict[board].sort(key=itemgetter('code'))
             logging.info(f"{board} 数量: {len(stock_dict[board])}")
         
         return stock_dict
@@ -1629,40 +2617,63 @@ def get_stock_list():
         logging.error(f"获取股票列表时出错: {str(e)}", exc_info=True)
         raise
 
+# 股票列表各板块的中文名称
+_STOCK_LIST_BOARD_NAMES = {
+    'sh_a': '上证A股',
+    'sz_a': '深证A股',
+    'gem': '创业板',
+    'sci': '科创板',
+    'hs_a': '沪深A股',
+    'indices': '指数',
+    'all_stocks': '全部股票',
+    'hs300_components': '沪深300成分股',
+    'zz500_components': '中证500成分股',
+    'sz50_components': '上证50成分股',
+    'hs_convertible_bonds': '沪深转债',
+    'hs_etf': '沪深ETF'
+}
+
+# 使用特定文件名的板块，其余板块保存为 "<中文名称>_股票列表.csv"
+_STOCK_LIST_FILE_NAMES = {
+    'hs_convertible_bonds': '沪深转债_列表.csv',
+    'hs_etf': '沪深ETF_成分股列表.csv'
+}
+
+def _format_stock_list_csv(stocks) -> bytes:
+    """将一个板块的股票列表格式化为 "代码,名称" 格式的CSV文件内容（无表头，utf-8-sig 编码）"""
+    # 由 writer 输出系统换行符（与原先文本模式写出的换行一致），字段内的换行保持原样
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator=os.linesep).writerows((stock['code'], stock['name']) for stock in stocks)
+    text = buffer.getvalue()
+    # 与文本模式写出一致：没有内容时不写BOM，得到空文件
+    return text.encode('utf-8-sig') if text else b''
+
+def _write_file_bytes(file_path, data: bytes) -> None:
+    """把已格式化好的文件内容一次写出"""
+    with open(file_path, 'wb') as f:
+        f.write(data)
+
 def save_stock_list_to_csv(stock_dict, output_dir):
     """将股票列表保存为CSV文件"""
     try:
-        os.makedirs(output_dir, exist_ok=True)
+        out_dir = Path(output_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
         logging.info(f"创建输出目录: {output_dir}")
         
-        # 定义板块中文名称
-        board_names = {
-            'sh_a': '上证A股',
-            'sz_a': '深证A股',
-            'gem': '创业板',
-            'sci': '科创板',
-            'hs_a': '沪深A股',
-            'indices': '指数',
-            'all_stocks': '全部股票',
-            'hs300_components': '沪深300成分股',
-            'zz500_components': '中证500成分股',
-            'sz50_components': '上证50成分股',
-            'hs_convertible_bonds': '沪深转债',
-            'hs_etf': '沪深ETF'
-        }
+        # 板块中文名称
+        board_names = _STOCK_LIST_BOARD_NAMES
         
-        # 为每个板块创建CSV文件
-        for board, stocks in stock_dict.items():
-            # 保存单个板块文件，沪深转债使用特定文件名
-            if board == 'hs_convertible_bonds':
-                file_path = os.path.join(output_dir, "沪深转债_列表.csv")
-            elif board == 'hs_etf':
-                file_path = os.path.join(output_dir, "沪深ETF_成分股列表.csv")
-            else:
-                file_path = os.path.join(output_dir, f"{board_names[board]}_股票列表.csv")
-            with open(file_path, 'w', encoding='utf-8-sig') as f:
-                for stock in stocks:
-                    f.write(f"{stock['code']},{stock['name']}\n")
+        # 为每个板块创建CSV文件：由单独的写文件线程按顺序写盘，与格式化下一个板块重叠进行
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            pending = []
+            for board, stocks in stock_dict.items():
+                # 保存单个板块文件，沪深转债、沪深ETF使用特定文件名
+                file_path = out_dir / _STOCK_LIST_FILE_NAMES.get(board, f"{board_names[board]}_股票列表.csv")
+                pending.append(writer.submit(_write_file_bytes, file_path, _format_stock_list_csv(stocks)))
+            
+            # 等待全部写完，写文件出错时在这里抛出
+            for future in pending:
+                future.result()
                     
         logging.info(f"股票列表已保存到目录: {output_dir}")
         logging.info(f"总共生成了 {len(board_names)} 个列表文件")
@@ -1674,14 +2685,6 @@ def save_stock_list_to_csv(stock_dict, output_dir):
 def stock_list_worker(output_dir, queue):
     """多进程工作函数：在子进程中执行股票列表更新"""
     try:
-        # Windows multiprocessing 保护
-        import multiprocessing
-        if hasattr(multiprocessing, 'set_start_method'):
-            try:
-                multiprocessing.set_start_method('spawn', force=True)
-            except RuntimeError:
-                pass  # 可能已经设置过了
-        
         # 在子进程中导入模块，避免Qt冲突
         from xtquant import xtdata
         import ast
@@ -1733,6 +2736,8 @@ def get_stock_list_for_subprocess(queue):
         'hs_convertible_bonds': [],  # 沪深转债
         'hs_etf': [],  # 沪深ETF
     }
+    # 全部股票按代码去重，最后统一排序后写回 stock_dict['all_stocks']
+    all_stocks = {}
     
     # 重要指数列表
     important_indices = [
@@ -1761,31 +2766,40 @@ def get_stock_list_for_subprocess(queue):
         '上证50': 'sz50_components'
     }
 
+    # 先取齐所有板块的成分股，再对其并集一次性并发查询合约详情，后续各板块只做字典查找
+    queue.put(("progress", "正在获取证券详细信息..."))
+    print("[更新进度] 正在获取证券详细信息...", flush=True)
+    sector_codes, details = _fetch_sector_details(
+        list(sector_mapping) + list(index_components_mapping) + ['沪深转债', '沪深ETF'])
+
     # 获取各个板块的股票
     for sector_name, dict_key in sector_mapping.items():
         queue.put(("progress", f"正在获取{sector_name}股票列表..."))
         print(f"[更新进度] 正在获取{sector_name}股票列表...", flush=True)
         try:
-            stocks = xtdata.get_stock_list_in_sector(sector_name)
+            stocks = sector_codes[sector_name]
+            if isinstance(stocks, Exception):
+                raise stocks
             if stocks:
                 print(f"[更新进度] 获取到 {len(stocks)} 只{sector_name}股票，正在处理详细信息...", flush=True)
                 processed_count = 0
+                board_append = stock_dict[dict_key].append
                 for code in stocks:
                     try:
-                        detail = xtdata.get_instrument_detail(code)
+                        detail = details[code]
+                        if isinstance(detail, Exception):
+                            raise detail
                         if detail:
-                            if isinstance(detail, str):
-                                detail = ast.literal_eval(detail)
                             name = detail.get('InstrumentName', '')
                             if name:
                                 stock_info = {'code': code, 'name': name}
-                                stock_dict[dict_key].append(stock_info)
+                                board_append(stock_info)
                                 if dict_key != 'hs_a':
-                                    stock_dict['all_stocks'].append(stock_info)
+                                    all_stocks[code] = stock_info
                                 processed_count += 1
                                 # 每处理100只股票输出一次进度
                                 if processed_count % 100 == 0:
-                                    print(f"[更新进度] {sector_name} 已处理 {processed_count}/{len(stocks)} 只股票", flush=True)
+                                    print(f"[更新进度] {sector_name} 已处理 {processed_count}/{len(stocks)} 只股票")
                                     queue.put(("progress", f"{sector_name} 已处理 {processed_count}/{len(stocks)} 只股票"))
                     except Exception as e:
                         continue
@@ -1802,20 +2816,23 @@ def get_stock_list_for_subprocess(queue):
         queue.put(("progress", f"正在获取{index_name}成分股..."))
         print(f"[更新进度] 正在获取{index_name}成分股...", flush=True)
         try:
-            components = xtdata.get_stock_list_in_sector(index_name)
+            components = sector_codes[index_name]
+            if isinstance(components, Exception):
+                raise components
             if components:
                 print(f"[更新进度] 获取到 {len(components)} 只{index_name}成分股，正在处理详细信息...", flush=True)
+                board_append = stock_dict[dict_key].append
                 for code in components:
                     try:
-                        detail = xtdata.get_instrument_detail(code)
+                        detail = details[code]
+                        if isinstance(detail, Exception):
+                            raise detail
                         if detail:
-                            if isinstance(detail, str):
-                                detail = ast.literal_eval(detail)
                             name = detail.get('InstrumentName', '')
                             if name:
                                 stock_info = {'code': code, 'name': name}
-                                stock_dict[dict_key].append(stock_info)
-                                stock_dict['all_stocks'].append(stock_info)
+                                board_append(stock_info)
+                                all_stocks[code] = stock_info
                     except Exception as e:
                         continue
                 print(f"[更新进度] {index_name} 完成，共获取 {len(stock_dict[dict_key])} 只有效成分股", flush=True)
@@ -1828,19 +2845,23 @@ def get_stock_list_for_subprocess(queue):
     queue.put(("progress", "正在获取沪深转债..."))
     print(f"[更新进度] 正在获取沪深转债...", flush=True)
     try:
-        cb_stocks = xtdata.get_stock_list_in_sector('沪深转债')
+        cb_stocks = sector_codes['沪深转债']
+        if isinstance(cb_stocks, Exception):
+            raise cb_stocks
         if cb_stocks:
             print(f"[更新进度] 获取到 {len(cb_stocks)} 只沪深转债，正在筛选转债...", flush=True)
+            board_append = stock_dict['hs_convertible_bonds'].append
             for code in cb_stocks:
                 try:
-                    detail = xtdata.get_instrument_detail(code)
+                    detail = details[code]
+                    if isinstance(detail, Exception):
+                        raise detail
                     if detail:
-                        if isinstance(detail, str):
-                            detail = ast.literal_eval(detail)
                         name = detail.get('InstrumentName', '')
-                        if name and '转债' in name:
+                        # 转债名称通常以“转债”结尾，先比较结尾，不是时再查找子串
+                        if name and (name.endswith('转债') or '转债' in name):
                             bond_info = {'code': code, 'name': name}
-                            stock_dict['hs_convertible_bonds'].append(bond_info)
+                            board_append(bond_info)
                 except Exception as e:
                     continue
             print(f"[更新进度] 沪深转债 完成，共获取 {len(stock_dict['hs_convertible_bonds'])} 只有效转债", flush=True)
@@ -1853,19 +2874,22 @@ def get_stock_list_for_subprocess(queue):
     queue.put(("progress", "正在获取沪深ETF..."))
     print(f"[更新进度] 正在获取沪深ETF...", flush=True)
     try:
-        etf_stocks = xtdata.get_stock_list_in_sector('沪深ETF')
+        etf_stocks = sector_codes['沪深ETF']
+        if isinstance(etf_stocks, Exception):
+            raise etf_stocks
         if etf_stocks:
             print(f"[更新进度] 获取到 {len(etf_stocks)} 只沪深ETF，正在处理详细信息...", flush=True)
+            board_append = stock_dict['hs_etf'].append
             for code in etf_stocks:
                 try:
-                    detail = xtdata.get_instrument_detail(code)
+                    detail = details[code]
+                    if isinstance(detail, Exception):
+                        raise detail
                     if detail:
-                        if isinstance(detail, str):
-                            detail = ast.literal_eval(detail)
                         name = detail.get('InstrumentName', '')
                         if name:
                             etf_info = {'code': code, 'name': name}
-                            stock_dict['hs_etf'].append(etf_info)
+                            board_append(etf_info)
                 except Exception as e:
                     continue
             print(f"[更新进度] 沪深ETF 完成，共获取 {len(stock_dict['hs_etf'])} 只有效ETF", flush=True)
@@ -1877,88 +2901,73 @@ def get_stock_list_for_subprocess(queue):
     # 添加指数
     stock_dict['indices'] = important_indices
     for index in important_indices:
-        stock_dict['all_stocks'].append(index)
+        all_stocks[index['code']] = index
 
     # 对每个板块去重并排序
     for board in stock_dict:
         if board == 'all_stocks':
-            unique_stocks = {stock['code']: stock for stock in stock_dict[board]}.values()
-            stock_dict[board] = sorted(unique_stocks, key=lambda x: x['code'])
+            stock_dict[board] = sorted(all_stocks.values(), key=itemgetter('code'))
         else:
-            stock_dict[board].sort(key=lambda x: x['code'])
+            stock_dict[board].sort(key=itemgetter('code'))
 
     return stock_dict
 
 def save_stock_list_to_csv_for_subprocess(stock_dict, output_dir, queue):
     """子进程版本的保存CSV函数，带进度反馈"""
-    import os
-    
-    os.makedirs(output_dir, exist_ok=True)
-
-    board_names = {
-        'sh_a': '上证A股',
-        'sz_a': '深证A股',
-        'gem': '创业板',
-        'sci': '科创板',
-        'hs_a': '沪深A股',
-        'indices': '指数',
-        'all_stocks': '全部股票',
-        'hs300_components': '沪深300成分股',
-        'zz500_components': '中证500成分股',
-        'sz50_components': '上证50成分股',
-        'hs_convertible_bonds': '沪深转债',
-        'hs_etf': '沪深ETF'
-    }
+    out_dir = Path(output_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
 
-    for board, stocks in stock_dict.items():
-        queue.put(("progress", f"正在保存{board_names[board]}列表..."))
-        print(f"[更新进度] 正在保存{board_names[board]}列表...", flush=True)
-        # 沪深转债使用特定文件名
-        if board == 'hs_convertible_bonds':
-            file_path = os.path.join(output_dir, "沪深转债_列表.csv")
-        elif board == 'hs_etf':
-            file_path = os.path.join(output_dir, "沪深ETF_成分股列表.csv")
-        else:
-            file_path = os.path.join(output_dir, f"{board_names[board]}_股票列表.csv")
-        with open(file_path, 'w', encoding='utf-8-sig') as f:
-            for stock in stocks:
-                f.write(f"{stock['code']},{stock['name']}\n")
-        print(f"[更新进度] {board_names[board]}列表保存完成，共 {len(stocks)} 只证券", flush=True)
+    board_names = _STOCK_LIST_BOARD_NAMES
+
+    # 由单独的写文件线程按顺序写盘，与格式化下一个板块重叠进行
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        pending = []
+        for board, stocks in stock_dict.items():
+            queue.put(("progress", f"正在保存{board_names[board]}列表..."))
+            print(f"[更新进度] 正在保存{board_names[board]}列表...", flush=True)
+            # 保存单个板块文件，沪深转债、沪深ETF使用特定文件名
+            file_path = out_dir / _STOCK_LIST_FILE_NAMES.get(board, f"{board_names[board]}_股票列表.csv")
+            pending.append(writer.submit(_write_file_bytes, file_path, _format_stock_list_csv(stocks)))
+            print(f"[更新进度] {board_names[board]}列表保存完成，共 {len(stocks)} 只证券", flush=True)
+        
+        # 等待全部写完，写文件出错时在这里抛出
+        for future in pending:
+            future.result()
 
 # 定义多进程版本的更新管理器类
-if not is_subprocess():
-    from PyQt5.QtCore import QObject, pyqtSignal, QTimer
+if not _IMPORTED_IN_SUBPROCESS:
+    from PyQt5.QtCore import QObject, pyqtSignal
     import multiprocessing
     import queue
+
+    # 股票列表更新子进程统一使用 spawn 方式启动（与 Windows 行为一致，子进程不继承Qt状态）；
+    # 使用独立的上下文对象，不修改全局启动方式，也无需在每次启动时重复设置
+    _SPAWN_CONTEXT = multiprocessing.get_context('spawn')
     
     class StockListUpdateManager(QObject):
         """多进程股票列表更新管理器"""
         progress = pyqtSignal(str)  # 用于发送进度信息
         finished = pyqtSignal(bool, str)  # 用于发送完成状态和消息
 
+        # 读取线程阻塞等待消息的超时时间（秒），超时后检查子进程是否已异常退出
+        QUEUE_WAIT_TIMEOUT = 1.0
+
         def __init__(self, output_dir):
             super().__init__()
             self.output_dir = output_dir
             self.process = None
             self.queue = None
-            self.timer = None
+            self.reader_thread = None
             self.running = True
 
         def start(self):
             """启动多进程更新"""
             try:
-                # Windows multiprocessing 配置
-                if hasattr(multiprocessing, 'set_start_method'):
-                    try:
-                        multiprocessing.set_start_method('spawn', force=True)
-                    except RuntimeError:
-                        pass  # 可能已经设置过了
-                
                 # 创建进程间通信队列
-                self.queue = multiprocessing.Queue()
+                self.queue = _SPAWN_CONTEXT.Queue()
                 
                 # 创建子进程
-                self.process = multiprocessing.Process(
+                self.process = _SPAWN_CONTEXT.Process(
                     target=stock_list_worker,
                     args=(self.output_dir, self.queue)
                 )
@@ -1966,55 +2975,60 @@ if not is_subprocess():
                 # 启动子进程
                 self.process.start()
                 
-                # 创建定时器检查队列消息
-                self.timer = QTimer()
-                self.timer.timeout.connect(self.check_queue)
-                self.timer.start(100)  # 每100ms检查一次
+                # 创建后台线程阻塞读取队列消息，收到后通过信号转发到主线程，
+                # 不再由定时器在Qt事件循环中轮询
+                self.reader_thread = threading.Thread(
+                    target=self._read_queue,
+                    args=(self.queue, self.process),
+                    daemon=True
+                )
+                self.reader_thread.start()
                 
             except Exception as e:
                 error_msg = f"启动多进程更新时出错: {str(e)}"
                 logging.error(error_msg, exc_info=True)
                 self.finished.emit(False, error_msg)
 
-        def check_queue(self):
-            """检查进程队列中的消息"""
+        def _read_queue(self, message_queue, process):
+            """后台线程：阻塞读取进程队列中的消息并通过信号转发
+
+            说明:
+                跨线程发射的信号会以排队连接的方式在主线程中执行槽函数，
+                因此槽函数（如关闭进度对话框）可以安全地操作界面。
+            """
             try:
-                while True:
+                while self.running:
                     try:
-                        # 非阻塞获取消息
-                        message = self.queue.get_nowait()
-                        
-                        if message[0] == "progress":
-                            # 进度消息
-                            self.progress.emit(message[1])
-                        elif message[0] == "finished":
-                            # 完成消息
-                            success, msg = message[1], message[2]
-                            self.stop()
-                            self.finished.emit(success, msg)
-                            break
-                            
+                        message = message_queue.get(timeout=self.QUEUE_WAIT_TIMEOUT)
                     except queue.Empty:
+                        # 检查进程是否还在运行
+                        if not process.is_alive():
+                            # 进程已结束，但没有收到完成消息，可能是异常结束
+                            exit_code = process.exitcode
+                            if exit_code != 0 and self.running:
+                                self.running = False
+                                self.finished.emit(False, f"更新进程异常结束，退出码: {exit_code}")
+                            break
+                        continue
+
+                    if not self.running:
+                        break
+                    if message[0] == "progress":
+                        # 进度消息
+                        self.progress.emit(message[1])
+                    elif message[0] == "finished":
+                        # 完成消息：子进程随后自行退出，由槽函数中调用的 stop() 负责回收
+                        success, msg = message[1], message[2]
+                        self.running = False
+                        self.finished.emit(success, msg)
                         break
-                        
-                # 检查进程是否还在运行
-                if self.process and not self.process.is_alive():
-                    # 进程已结束，但没有收到完成消息，可能是异常结束
-                    exit_code = self.process.exitcode
-                    if exit_code != 0:
-                        self.stop()
-                        self.finished.emit(False, f"更新进程异常结束，退出码: {exit_code}")
                         
             except Exception as e:
-                logging.error(f"检查队列消息时出错: {str(e)}")
+                logging.error(f"读取队列消息时出错: {str(e)}")
 
         def stop(self):
             """停止更新进程"""
             self.running = False
-            
-            if self.timer:
-                self.timer.stop()
-                self.timer = None
                 
             if self.process and self.process.is_alive():
                 self.process.terminate()
@@ -2024,6 +3038,7 @@ if not is_subprocess():
                     
             self.process = None
             self.queue = None
+            self.reader_thread = None
 
 def get_and_save_stock_list(output_dir):
     """获取并保存股票列表的便捷函数，返回多进程更新管理器实例"""
@@ -2044,7 +3059,7 @@ def get_and_save_stock_list(output_dir):
             logging.error(error_msg, exc_info=True)
             return False, error_msg
 # 只在主进程中定义Qt线程类
-if not is_subprocess():
+if not _IMPORTED_IN_SUBPROCESS:
     class StockListUpdateThread(QThread):
         """股票列表更新线程"""
         progress = pyqtSignal(str)  # 用于发送进度信息
@@ -2125,6 +3140,8 @@ else:
             'hs_convertible_bonds': [],  # 沪深转债
             'hs_etf': [],  # 沪深ETF
         }
+        # 全部股票按代码去重，最后统一排序后写回 stock_dict['all_stocks']
+        all_stocks = {}
 
         # 重要指数列表
         important_indices = [
@@ -2153,6 +3170,14 @@ else:
             '上证50': 'sz50_components'
         }
 
+        # 先取齐所有板块的成分股，再对其并集一次性并发查询合约详情，后续各板块只做字典查找
+        progress_msg = "正在获取证券详细信息..."
+        self.progress.emit(progress_msg)
+        print(f"[更新进度] {progress_msg}", flush=True)
+        sector_codes, details = _fetch_sector_details(
+            list(sector_mapping) + list(index_components_mapping) + ['沪深转债', '沪深ETF'],
+            check_interrupt=lambda: not self.running)
+
         # 获取各个板块的股票
         for sector_name, dict_key in sector_mapping.items():
             if not self.running:
@@ -2162,28 +3187,31 @@ else:
             self.progress.emit(progress_msg)
             print(f"[更新进度] {progress_msg}", flush=True)
             try:
-                stocks = xtdata.get_stock_list_in_sector(sector_name)
+                stocks = sector_codes[sector_name]
+                if isinstance(stocks, Exception):
+                    raise stocks
                 if stocks:
                     print(f"[更新进度] 获取到 {len(stocks)} 只{sector_name}股票，正在处理详细信息...", flush=True)
                     processed_count = 0
+                    board_append = stock_dict[dict_key].append
                     for code in stocks:
                         if not self.running:
                             return stock_dict
                         try:
-                            detail = xtdata.get_instrument_detail(code)
+                            detail = details[code]
+                            if isinstance(detail, Exception):
+                                raise detail
                             if detail:
-                                if isinstance(detail, str):
-                                    detail = ast.literal_eval(detail)
                                 name = detail.get('InstrumentName', '')
                                 if name:
                                     stock_info = {'code': code, 'name': name}
-                                    stock_dict[dict_key].append(stock_info)
+                                    board_append(stock_info)
                                     if dict_key != 'hs_a':
-                                        stock_dict['all_stocks'].append(stock_info)
+                                        all_stocks[code] = stock_info
                                     processed_count += 1
                                     # 每处理100只股票输出一次进度
                                     if processed_count % 100 == 0:
-                                        print(f"[更新进度] {sector_name} 已处理 {processed_count}/{len(stocks)} 只股票", flush=True)
+                                        print(f"[更新进度] {sector_name} 已处理 {processed_count}/{len(stocks)} 只股票")
                         except Exception as e:
                             logging.error(f"处理股票 {code} 时出错: {str(e)}")
                             continue
@@ -2205,22 +3233,25 @@ else:
             self.progress.emit(progress_msg)
             print(f"[更新进度] {progress_msg}", flush=True)
             try:
-                components = xtdata.get_stock_list_in_sector(index_name)
+                components = sector_codes[index_name]
+                if isinstance(components, Exception):
+                    raise components
                 if components:
                     print(f"[更新进度] 获取到 {len(components)} 只{index_name}成分股，正在处理详细信息...", flush=True)
+                    board_append = stock_dict[dict_key].append
                     for code in components:
                         if not self.running:
                             return stock_dict
                         try:
-                            detail = xtdata.get_instrument_detail(code)
+                            detail = details[code]
+                            if isinstance(detail, Exception):
+                                raise detail
                             if detail:
-                                if isinstance(detail, str):
-                                    detail = ast.literal_eval(detail)
                                 name = detail.get('InstrumentName', '')
                                 if name:
                                     stock_info = {'code': code, 'name': name}
-                                    stock_dict[dict_key].append(stock_info)
-                                    stock_dict['all_stocks'].append(stock_info)
+                                    board_append(stock_info)
+                                    all_stocks[code] = stock_info
                         except Exception as e:
                             logging.error(f"处理{index_name}成分股 {code} 时出错: {str(e)}")
                             continue
@@ -2244,21 +3275,25 @@ else:
             self.progress.emit(progress_msg)
             print(f"[更新进度] {progress_msg}", flush=True)
             try:
-                cb_stocks = xtdata.get_stock_list_in_sector(cb_name)
+                cb_stocks = sector_codes[cb_name]
+                if isinstance(cb_stocks, Exception):
+                    raise cb_stocks
                 if cb_stocks:
                     print(f"[更新进度] 获取到 {len(cb_stocks)} 只{cb_name}，正在筛选转债...", flush=True)
+                    board_append = stock_dict[dict_key].append
                     for code in cb_stocks:
                         if not self.running:
                             return stock_dict
                         try:
-                            detail = xtdata.get_instrument_detail(code)
+                            detail = details[code]
+                            if isinstance(detail, Exception):
+                                raise detail
                             if detail:
-                                if isinstance(detail, str):
-                                    detail = ast.literal_eval(detail)
                                 name = detail.get('InstrumentName', '')
-                                if name and '转债' in name:
+                                # 转债名称通常以“转债”结尾，先比较结尾，不是时再查找子串
+                                if name and (name.endswith('转债') or '转债' in name):
                                     bond_info = {'code': code, 'name': name}
-                                    stock_dict[dict_key].append(bond_info)
+                                    board_append(bond_info)
                                     # 不将转债添加到all_stocks中，因为它们是债券而非股票
                         except Exception as e:
                             continue
@@ -2281,21 +3316,24 @@ else:
             self.progress.emit(progress_msg)
             print(f"[更新进度] {progress_msg}", flush=True)
             try:
-                etf_stocks = xtdata.get_stock_list_in_sector(etf_name)
+                etf_stocks = sector_codes[etf_name]
+                if isinstance(etf_stocks, Exception):
+                    raise etf_stocks
                 if etf_stocks:
                     print(f"[更新进度] 获取到 {len(etf_stocks)} 只{etf_name}，正在处理详细信息...", flush=True)
+                    board_append = stock_dict[dict_key].append
                     for code in etf_stocks:
                         if not self.running:
                             return stock_dict
                         try:
-                            detail = xtdata.get_instrument_detail(code)
+                            detail = details[code]
+                            if isinstance(detail, Exception):
+                                raise detail
                             if detail:
-                                if isinstance(detail, str):
-                                    detail = ast.literal_eval(detail)
                                 name = detail.get('InstrumentName', '')
                                 if name:
                                     etf_info = {'code': code, 'name': name}
-                                    stock_dict[dict_key].append(etf_info)
+                                    board_append(etf_info)
                                     # 不将ETF添加到all_stocks中，因为它们是基金而非股票
                         except Exception as e:
                             continue
@@ -2308,54 +3346,41 @@ else:
         # 添加指数
         stock_dict['indices'] = important_indices
         for index in important_indices:
-            stock_dict['all_stocks'].append(index)
+            all_stocks[index['code']] = index
 
         # 对每个板块去重并排序
         for board in stock_dict:
             if board == 'all_stocks':
-                unique_stocks = {stock['code']: stock for stock in stock_dict[board]}.values()
-                stock_dict[board] = sorted(unique_stocks, key=lambda x: x['code'])
+                stock_dict[board] = sorted(all_stocks.values(), key=itemgetter('code'))
             else:
-                stock_dict[board].sort(key=lambda x: x['code'])
+                stock_dict[board].sort(key=itemgetter('code'))
 
         return stock_dict
 
     def save_stock_list_to_csv(self, stock_dict):
         """将股票列表保存为CSV文件"""
-        os.makedirs(self.output_dir, exist_ok=True)
-
-        board_names = {
-            'sh_a': '上证A股',
-            'sz_a': '深证A股',
-            'gem': '创业板',
-            'sci': '科创板',
-            'hs_a': '沪深A股',
-            'indices': '指数',
-            'all_stocks': '全部股票',
-            'hs300_components': '沪深300成分股',
-            'zz500_components': '中证500成分股',
-            'sz50_components': '上证50成分股',
-            'hs_convertible_bonds': '沪深转债',
-            'hs_etf': '沪深ETF'
-        }
+        out_dir = Path(self.output_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
 
-        for board, stocks in stock_dict.items():
-            if not self.running:
-                return
-            progress_msg = f"正在保存{board_names[board]}列表..."
-            self.progress.emit(progress_msg)
-            print(f"[更新进度] {progress_msg}", flush=True)
-            # 沪深转债使用特定文件名
-            if board == 'hs_convertible_bonds':
-                file_path = os.path.join(self.output_dir, "沪深转债_列表.csv")
-            elif board == 'hs_etf':
-                file_path = os.path.join(self.output_dir, "沪深ETF_成分股列表.csv")
-            else:
-                file_path = os.path.join(self.output_dir, f"{board_names[board]}_股票列表.csv")
-            with open(file_path, 'w', encoding='utf-8-sig') as f:
-                for stock in stocks:
-                    f.write(f"{stock['code']},{stock['name']}\n")
-            print(f"[更新进度] {board_names[board]}列表保存完成，共 {len(stocks)} 只证券", flush=True)
+        board_names = _STOCK_LIST_BOARD_NAMES
+
+        # 由单独的写文件线程按顺序写盘，与格式化下一个板块重叠进行
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            pending = []
+            for board, stocks in stock_dict.items():
+                if not self.running:
+                    break
+                progress_msg = f"正在保存{board_names[board]}列表..."
+                self.progress.emit(progress_msg)
+                print(f"[更新进度] {progress_msg}", flush=True)
+                # 保存单个板块文件，沪深转债、沪深ETF使用特定文件名
+                file_path = out_dir / _STOCK_LIST_FILE_NAMES.get(board, f"{board_names[board]}_股票列表.csv")
+                pending.append(writer.submit(_write_file_bytes, file_path, _format_stock_list_csv(stocks)))
+                print(f"[更新进度] {board_names[board]}列表保存完成，共 {len(stocks)} 只证券", flush=True)
+            
+            # 等待已提交的文件全部写完，写文件出错时在这里抛出
+            for future in pending:
+                future.result()
 
 def supplement_history_data(stock_files, field_list, period_type, start_date, end_date, dividend_type='none', time_range='all', progress_callback=None, log_callback=None, check_interrupt=None):
     """
@@ -2385,13 +3410,15 @@ def supplement_history_data(stock_files, field_list, period_type, start_date, en
         os.environ['QT_QPA_PLATFORM'] = 'offscreen'
     
     try:
+        # 中断检查只放在读取股票文件、每批开始及每批下载完成之后，不再在每只股票的各步骤间重复调用
+        _check_interrupted = partial(_raise_if_interrupted, check_interrupt,
+                                     log_message="补充数据过程被中断", error_message="补充数据过程被用户中断")
+
         # 获取所有股票代码
         stocks = []
         for stock_file in stock_files:
             # 检查是否需要中断
-            if check_interrupt and check_interrupt():
-                logging.info("补充数据过程被中断")
-                raise InterruptedError("补充数据过程被用户中断")
+            _check_interrupted()
                 
             if os.path.exists(stock_file):
                 logging.info(f"读取股票文件: {stock_file}")
@@ -2403,102 +3430,109 @@ def supplement_history_data(stock_files, field_list, period_type, start_date, en
                 log_callback("没有找到需要补充数据的股票")
             return
 
+        def _download_and_get(codes):
+            """批量补充并读取一组股票的数据，返回 {股票代码: DataFrame}"""
+            # 优先使用批量下载接口，不可用时逐只下载
+            download_batch = getattr(xtdata, 'download_history_data2', None)
+            if download_batch is not None and len(codes) > 1:
+                download_batch(codes, period=period_type, start_time=start_date,
+                               end_time=end_date, incrementally=True)
+            else:
+                for code in codes:
+                    # 调用download_history_data进行数据补充
+                    xtdata.download_history_data(
+                        code,
+                        period=period_type,
+                        start_time=start_date,
+                        end_time=end_date,
+                        incrementally=True
+                    )
+
+            # 网络下载耗时最长，下载完成后再检查一次中断
+            _check_interrupted()
+
+            # 获取数据（带复权参数）
+            return xtdata.get_market_data_ex(
+                field_list=field_list,
+                stock_list=list(codes),
+                period=period_type,
+                start_time=start_date,
+                end_time=end_date,
+                dividend_type=dividend_type,
+                fill_data=True
+            )
+
         total_stocks = len(stocks)
-        for index, stock in enumerate(stocks, 1):
+        # 按批补充：每批只调用一次下载和一次读取接口，中断检查放在批与批之间
+        for batch_start in range(0, total_stocks, _DOWNLOAD_BATCH_SIZE):
+            batch = stocks[batch_start:batch_start + _DOWNLOAD_BATCH_SIZE]
+            _check_interrupted()
+
+            batch_data = None
+            batch_error = None
             try:
-                # 检查是否需要中断
-                if check_interrupt and check_interrupt():
-                    logging.info("补充数据过程被中断")
-                    raise InterruptedError("补充数据过程被用户中断")
-                    
-                if log_callback:
-                    log_callback(f"正在补充 {stock} 的数据 ({index}/{total_stocks})")
+                batch_data = _download_and_get(batch)
+            except InterruptedError:
+                raise
+            except Exception as e:
+                # 整批失败时逐只重试，避免个别股票影响同批的其它股票
+                batch_error = e
 
-                # 检查是否需要中断
-                if check_interrupt and check_interrupt():
-                    logging.info("补充数据过程被中断")
-                    raise InterruptedError("补充数据过程被用户中断")
-                    
-                # 调用download_history_data进行数据补充
-                xtdata.download_history_data(
-                    stock,
-                    period=period_type,
-                    start_time=start_date,
-                    end_time=end_date,
-                    incrementally=True
-                )
-
-                # 检查是否需要中断
-                if check_interrupt and check_interrupt():
-                    logging.info("补充数据过程被中断")
-                    raise InterruptedError("补充数据过程被用户中断")
-                    
-                    
-                # 获取数据（带复权参数）
-                data = xtdata.get_market_data_ex(
-                    field_list=field_list,
-                    stock_list=[stock],
-                    period=period_type,
-                    start_time=start_date,
-                    end_time=end_date,
-                    dividend_type=dividend_type,
-                    fill_data=True
-                )
+            for index, stock in enumerate(batch, batch_start + 1):
+                try:
+                    report = _should_report(index, total_stocks)
+                    if log_callback and report:
+                        log_callback(f"正在补充 {stock} 的数据 ({index}/{total_stocks})")
+
+                    if batch_error is None:
+                        data = batch_data
+                    elif len(batch) > 1:
+                        data = _download_and_get([stock])
+                    else:
+                        raise batch_error
 
-                # 添加更详细的数据信息
-                if stock in data and data[stock] is not None:
-                    df = data[stock]
-                    
-                    # 检查df是否为DataFrame类型
-                    is_dataframe = isinstance(df, pd.DataFrame)
-                    
-                    # 获取数据信息
-                    rows_count = len(df) if df is not None else 0
-                    cols_count = len(df.columns) if is_dataframe else 0
-                    
-                    if rows_count > 0:
-                        # 计算时间跨度
-                        if is_dataframe and 'time' in df.columns:
-                            try:
-                                times = pd.to_datetime(df['time'].astype(float), unit='ms')
-                                min_time = times.min()
-                                max_time = times.max()
-                                time_span = f"{min_time.strftime('%Y-%m-%d')} 至 {max_time.strftime('%Y-%m-%d')}"
-                                
-                                # 输出详细信息
-                                if log_callback:
-                                    data_info = f"补充 {stock} 数据成功: 获取 {rows_count} 行, {cols_count} 列, 时间跨度: {time_span}"
-                                    log_callback(data_info)
-                            except Exception as e:
-                                if log_callback:
-                                    log_callback(f"补充 {stock} 数据完成，但获取详细信息时出错: {str(e)}")
-                        else:
-                            if log_callback:
-                                log_callback(f"补充 {stock} 数据成功: 获取 {rows_count} 行, {cols_count} 列")
+                    # 添加更详细的数据信息（只在需要汇报进度的股票上统计，避免逐只计算）
+                    if data and stock in data and data[stock] is not None:
+                        df = data[stock]
+                        
+                        if log_callback and report:
+                            # 获取数据信息
+                            rows_count = len(df)
+                            cols_count = len(df.columns) if isinstance(df, pd.DataFrame) else 0
+                            
+                            if rows_count > 0:
+                                # 计算时间跨度：直接在毫秒时间戳上取最值，只转换两端的时间
+                                if cols_count and 'time' in df.columns:
+                                    try:
+                                        times = df['time'].to_numpy(dtype=float)
+                                        min_time = _EPOCH + timedelta(milliseconds=float(np.nanmin(times)))
+                                        max_time = _EPOCH + timedelta(milliseconds=float(np.nanmax(times)))
+                                        time_span = f"{min_time.strftime('%Y-%m-%d')} 至 {max_time.strftime('%Y-%m-%d')}"
+                                        
+                                        # 输出详细信息
+                                        log_callback(f"补充 {stock} 数据成功: 获取 {rows_count} 行, {cols_count} 列, 时间跨度: {time_span}")
+                                    except Exception as e:
+                                        log_callback(f"补充 {stock} 数据完成，但获取详细信息时出错: {str(e)}")
+                                else:
+                                    log_callback(f"补充 {stock} 数据成功: 获取 {rows_count} 行, {cols_count} 列")
+                            else:
+                                log_callback(f"补充 {stock} 数据成功，但数据为空")
                     else:
                         if log_callback:
-                            log_callback(f"补充 {stock} 数据成功，但数据为空")
-                else:
-                    if log_callback:
-                        log_callback(f"未能获取 {stock} 的数据")
-
-                if progress_callback:
-                    progress = int((index / total_stocks) * 100)
-                    progress_callback(progress)
+                            log_callback(f"未能获取 {stock} 的数据")
 
-                # 检查是否需要中断
-                if check_interrupt and check_interrupt():
-                    logging.info("补充数据过程被中断")
-                    raise InterruptedError("补充数据过程被用户中断")
+                    if progress_callback and report:
+                        progress = int((index / total_stocks) * 100)
+                        progress_callback(progress)
 
-            except InterruptedError:
-                logging.info(f"补充 {stock} 数据时被中断")
-                raise
-            except Exception as e:
-                error_msg = f"补充 {stock} 数据时出错: {str(e)}"
-                logging.error(error_msg)
-                if log_callback:
-                    log_callback(error_msg)
+                except InterruptedError:
+                    logging.info(f"补充 {stock} 数据时被中断")
+                    raise
+                except Exception as e:
+                    error_msg = f"补充 {stock} 数据时出错: {str(e)}"
+                    logging.error(error_msg)
+                    if log_callback:
+                        log_callback(error_msg)
 
     except InterruptedError:
         logging.info("补充数据过程被用户中断")
@@ -2521,21 +3555,138 @@ def get_stock_names(stock_codes, stock_list_file):
     Returns:
         dict: 股票代码到股票名称的映射字典
     """
-    stock_names = {}
+    wanted = set(stock_codes)
     try:
-        with open(stock_list_file, 'r', encoding='utf-8-sig') as f:  # 使用utf-8-sig处理BOM
-            for line in f:
-                if line.strip():
-                    parts = line.strip().split(',')
-                    if len(parts) >= 2:
-                        code = parts[0].strip()
-                        name = parts[1].strip()
-                        if code in stock_codes:
-                            stock_names[code] = name
+        # C 解析器一次读入整个文件（utf-8-sig 处理BOM），只取前两列；名称保持原样不做缺失值转换
+        stock_list = pd.read_csv(stock_list_file, header=None, names=['code', 'name'], usecols=[0, 1],
+                                 encoding='utf-8-sig', dtype=str, keep_default_na=False, engine='c')
+    except pd.errors.EmptyDataError:
+        return {}
     except Exception as e:
         logging.error(f"读取股票列表文件出错: {str(e)}")
+        return {}
     
-    return stock_names
+    codes = stock_list['code'].str.strip()
+    names = stock_list['name'].str.strip()
+    # 没有名称的行跳过；同一代码出现多次时以最后一次为准
+    matched = codes.isin(wanted).to_numpy() & (names != '').to_numpy()
+    return dict(zip(codes[matched], names[matched]))
+
+# khHistory 支持的时间格式：YYYYMMDD[ HHMMSS] 与 YYYY-MM-DD[ HH:MM:SS]
+_HISTORY_TIME_RE = re.compile(
+    r'(\d{4})(\d{2})(\d{2})(?: (\d{2})(\d{2})(\d{2}))?'
+    r'|(\d{4})-(\d{2})-(\d{2})(?: (\d{2}):(\d{2}):(\d{2}))?',
+    re.ASCII
+)
+
+# 正则未匹配（如月、日为一位数）时按原方式逐个尝试的格式
+_HISTORY_TIME_FORMATS = (
+    '%Y%m%d %H%M%S',     # YYYYMMDD HHMMSS
+    '%Y-%m-%d %H:%M:%S', # YYYY-MM-DD HH:MM:SS
+    '%Y%m%d',            # YYYYMMDD
+    '%Y-%m-%d'           # YYYY-MM-DD
+)
+
+# khHistory 按 count 请求K线时额外多取的条数：end_time 当天不早于 current_time 的记录会被筛掉，
+# 日线最多1条，分钟线最多一个交易日（1分钟线含集合竞价约241条，5分钟线48条）
+_HISTORY_COUNT_BUFFER = {
+    '1d': 1,
+    '1m': 241,
+    '5m': 49
+}
+
+@lru_cache(maxsize=256)
+def _parse_history_time(text: str) -> Optional[datetime]:
+    """解析 khHistory 的 current_time 字符串，无法解析时返回 None
+
+    说明:
+        常见的两位数月日格式用预编译正则直接构造 datetime，不经过 strptime 的格式解释；
+        其余情况回退到逐个尝试 strptime，接受的输入与原来一致。回测中同一时间会被反复传入，
+        结果按字符串缓存。
+    """
+    match = _HISTORY_TIME_RE.fullmatch(text)
+    if match:
+        groups = match.groups()
+        parts = groups[:6] if groups[0] is not None else groups[6:]
+        try:
+            return datetime(*(int(part) for part in parts if part is not None))
+        except ValueError:
+            pass  # 日期不合法时交给 strptime 给出一致的结果
+
+    for fmt in _HISTORY_TIME_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    return None
+
+def _trim_history_frames(frames, fields, cutoff_ms, bar_count, skip_paused):
+    """把列名和类型相同的一组股票数据拼成一张宽表统一处理，再按股票切分
+
+    Args:
+        frames: {股票代码: DataFrame}，各DataFrame的列名和类型相同
+        fields: 需要返回的数据字段
+        cutoff_ms: time列（UTC毫秒时间戳）的上限，不包含
+        bar_count: 每只股票保留的最近记录数
+        skip_paused: 是否过滤成交量为0的停牌数据
+
+    Returns:
+        tuple: ({股票代码: DataFrame}, 保留数据中最晚的时间或None)
+
+    说明:
+        时间转换、筛选、排序和截取对整组各做一次，不再逐只股票调用；
+        拼接本身生成新表，传入的原始数据不会被修改。
+    """
+    codes = list(frames)
+    columns = frames[codes[0]].columns
+    columns_order = ['time'] + [col for col in fields if col in columns]
+
+    big = pd.concat(frames.values(), ignore_index=True)
+    # 每行所属股票在codes中的位置
+    owner = np.repeat(np.arange(len(codes)), [len(df) for df in frames.values()])
+
+    has_time = 'time' in columns
+    if has_time:
+        time_values = big['time']
+        # 已是数值类型时无需再转换
+        if not pd.api.types.is_numeric_dtype(time_values):
+            time_values = time_values.astype(float)
+        time_values = time_values.to_numpy()
+
+        # 筛选到指定时间之前的数据（不包含当前时间点），再按股票、时间排序（时间戳与转换后的时间顺序一致）
+        keep = np.flatnonzero(time_values < cutoff_ms)
+        keep = keep[np.lexsort((time_values[keep], owner[keep]))]
+        big = big.take(keep)
+        big['time'] = time_values[keep]
+        owner = owner[keep]
+
+    # 跳过停牌数据处理
+    if skip_paused and 'volume' in columns:
+        # 过滤掉成交量为0的数据（停牌日）
+        original_counts = np.bincount(owner, minlength=len(codes))
+        trading = np.flatnonzero((big['volume'] > 0).to_numpy())
+        big = big.take(trading)
+        owner = owner[trading]
+        filtered_counts = np.bincount(owner, minlength=len(codes))
+        for pos in np.flatnonzero(original_counts != filtered_counts):
+            print(f"股票 {codes[pos]} 过滤停牌数据: {original_counts[pos]} -> {filtered_counts[pos]}")
+
+    # 转换时间列（只转换保留下来的记录）
+    latest_time = None
+    if has_time:
+        big['time'] = pd.to_datetime(big['time'], unit='ms') + pd.Timedelta(hours=8)
+        if not big.empty:
+            latest_time = big['time'].max()
+
+    # 重新整理列顺序，确保time列在前
+    big = big[columns_order]
+
+    # 每只股票在宽表中的行范围，取最近的bar_count条记录
+    bounds = np.searchsorted(owner, np.arange(len(codes) + 1))
+    starts = np.maximum(bounds[:-1], bounds[1:] - bar_count)
+    trimmed = {code: big.iloc[starts[pos]:bounds[pos + 1]].reset_index(drop=True)
+               for pos, code in enumerate(codes)}
+    return trimmed, latest_time
 
 def khHistory(symbol_list, fields, bar_count, fre_step, current_time=None, skip_paused=False, fq='pre', force_download=False):
     """
@@ -2577,9 +3728,11 @@ def khHistory(symbol_list, fields, bar_count, fre_step, current_time=None, skip_
     if bar_count <= 0:
         raise ValueError("bar_count必须大于0")
     
-    # 统一处理股票代码列表
+    # 统一处理股票代码列表（已是列表时直接使用，函数内只读不改，无需复制）
     if isinstance(symbol_list, str):
         stock_codes = [symbol_list]
+    elif type(symbol_list) is list:
+        stock_codes = symbol_list
     else:
         stock_codes = list(symbol_list)
     
@@ -2597,19 +3750,7 @@ def khHistory(symbol_list, fields, bar_count, fre_step, current_time=None, skip_
             current_time = current_time.strip()
             
             # 尝试解析不同的时间格式
-            time_formats = [
-                '%Y%m%d %H%M%S',     # YYYYMMDD HHMMSS
-                '%Y-%m-%d %H:%M:%S', # YYYY-MM-DD HH:MM:SS
-                '%Y%m%d',            # YYYYMMDD
-                '%Y-%m-%d'           # YYYY-MM-DD
-            ]
-            
-            for fmt in time_formats:
-                try:
-                    current_datetime = datetime.strptime(current_time, fmt)
-                    break
-                except ValueError:
-                    continue
+            current_datetime = _parse_history_time(current_time)
             
             if current_datetime is None:
                 raise ValueError(f"无法解析时间格式: {current_time}，支持的格式: YYYYMMDD, YYYY-MM-DD, YYYYMMDD HHMMSS, YYYY-MM-DD HH:MM:SS")
@@ -2672,19 +3813,31 @@ def khHistory(symbol_list, fields, bar_count, fre_step, current_time=None, skip_
                 start_dt = current_datetime - timedelta(days=bar_count * 5)
                 start_date = start_dt.strftime('%Y%m%d')
             
-            # 使用xtdata.download_history_data下载数据到指定时间
+            # 多只股票时优先用批量下载接口一次下载到指定时间
             download_count = 0
-            for stock_code in stock_codes:
+            batch_done = False
+            download_batch = getattr(xtdata, 'download_history_data2', None)
+            if download_batch is not None and len(stock_codes) > 1:
                 try:
-                    xtdata.download_history_data(
-                        stock_code=stock_code,
-                        period=period,
-                        start_time=start_date,
-                        end_time=current_date_str
-                    )
-                    download_count += 1
+                    download_batch(stock_codes, period=period, start_time=start_date, end_time=current_date_str)
+                    download_count = len(stock_codes)
+                    batch_done = True
                 except Exception as e:
-                    print(f"下载 {stock_code} 数据失败: {str(e)}")
+                    print(f"批量下载数据失败，改为逐只下载: {str(e)}")
+            
+            # 批量接口不可用或失败时，使用xtdata.download_history_data逐只下载
+            if not batch_done:
+                for stock_code in stock_codes:
+                    try:
+                        xtdata.download_history_data(
+                            stock_code=stock_code,
+                            period=period,
+                            start_time=start_date,
+                            end_time=current_date_str
+                        )
+                        download_count += 1
+                    except Exception as e:
+                        print(f"下载 {stock_code} 数据失败: {str(e)}")
             
             print(f"成功下载 {download_count}/{len(stock_codes)} 只股票的数据")
         
@@ -2711,6 +3864,14 @@ def khHistory(symbol_list, fields, bar_count, fre_step, current_time=None, skip_
         
         #print(f"实际查询范围: {start_time} 到 {end_time}")
         
+        # 直接请求区间内最近的若干条K线，余量覆盖end_time当天会被筛掉的记录（日线1条，分钟线一个交易日）；
+        # tick数据或需要跳过停牌时无法预知所需条数，仍获取整个区间。后端忽略count时下面的截取逻辑同样适用
+        count_buffer = _HISTORY_COUNT_BUFFER.get(period)
+        if count_buffer is None or skip_paused:
+            request_count = -1
+        else:
+            request_count = bar_count + count_buffer
+        
         # 获取数据
         data = xtdata.get_market_data_ex(
             field_list=['time'] + fields,
@@ -2718,7 +3879,7 @@ def khHistory(symbol_list, fields, bar_count, fre_step, current_time=None, skip_
             period=period,
             start_time=start_time,
             end_time=end_time,
-            count=-1,
+            count=request_count,
             dividend_type=dividend_type,
             fill_data=True
         )
@@ -2727,78 +3888,63 @@ def khHistory(symbol_list, fields, bar_count, fre_step, current_time=None, skip_
             print("未获取到任何数据")
             return {}
         
-        # 处理每只股票的数据
+        # time 列为UTC毫秒时间戳，本地时间 = 时间戳 + 8小时。筛选条件换算成时间戳上限后只算一次，
+        # 各股票直接在原始毫秒值上筛选，只对最终保留的记录转换为日期时间
+        if period in ['tick', '1m', '5m']:
+            # tick/分钟数据按精确时间筛选，不包含当前时间点
+            cutoff_datetime = current_datetime
+        else:
+            # 日线数据只比较日期部分，不包含当前日期（即早于当日零点）
+            cutoff_datetime = current_datetime.replace(hour=0, minute=0, second=0, microsecond=0)
+        cutoff_ms = (cutoff_datetime - _EPOCH) / timedelta(milliseconds=1) - 8 * 3600 * 1000
+        
+        # 无数据的股票先记下，循环结束后汇总输出一次，避免股票多时逐只打印
+        missing_codes = []
+        empty_codes = []
+        
+        # 按股票代码顺序收集有数据的股票，结果字典保持与输入相同的顺序
+        frames = {}
         for stock_code in stock_codes:
+            if stock_code in result:
+                continue  # 重复的股票代码只处理一次
             if stock_code not in data:
-                print(f"警告: 股票 {stock_code} 无数据")
+                missing_codes.append(stock_code)
                 result[stock_code] = pd.DataFrame()
                 continue
             
             stock_data = data[stock_code]
-            
             if stock_data is None or stock_data.empty:
-                print(f"警告: 股票 {stock_code} 数据为空")
+                empty_codes.append(stock_code)
                 result[stock_code] = pd.DataFrame()
-                continue
-            
-            # 复制数据避免修改原始数据
-            stock_data = stock_data.copy()
-            
-            # 处理时间列
-            if 'time' in stock_data.columns:
-                # 转换时间列
-                stock_data['time'] = pd.to_datetime(stock_data['time'].astype(float), unit='ms') + pd.Timedelta(hours=8)
-                
-                # 筛选到指定时间之前的数据（不包含当前时间点）
-                if period == 'tick':
-                    # tick数据按精确时间筛选，不包含当前时间点
-                    mask = stock_data['time'] < current_datetime
-                elif period in ['1m', '5m']:
-                    # 分钟数据按精确时间筛选，不包含当前时间点
-                    mask = stock_data['time'] < current_datetime
-                else:
-                    # 日线数据只比较日期部分，不包含当前日期
-                    mask = stock_data['time'].dt.date < current_datetime.date()
-                
-                stock_data = stock_data[mask]
-                
-                # 按时间排序
-                stock_data = stock_data.sort_values('time').reset_index(drop=True)
-            
-            # 跳过停牌数据处理
-            if skip_paused and 'volume' in stock_data.columns:
-                # 过滤掉成交量为0的数据（停牌日）
-                original_len = len(stock_data)
-                stock_data = stock_data[stock_data['volume'] > 0].reset_index(drop=True)
-                filtered_len = len(stock_data)
-                if original_len != filtered_len:
-                    print(f"股票 {stock_code} 过滤停牌数据: {original_len} -> {filtered_len}")
-            
-            # 取最近的bar_count条记录
-            if not stock_data.empty and len(stock_data) > bar_count:
-                stock_data = stock_data.tail(bar_count).reset_index(drop=True)
-            
-            # 重新整理列顺序，确保time列在前
-            columns_order = ['time'] + [col for col in fields if col in stock_data.columns]
-            stock_data = stock_data[columns_order]
-            
-            result[stock_code] = stock_data
-            #print(f"股票 {stock_code}: 获取 {len(stock_data)} 条记录")
-            
-            # 显示时间范围
-            if not stock_data.empty and 'time' in stock_data.columns:
-                time_range = f"{stock_data['time'].min()} 到 {stock_data['time'].max()}"
-                #print(f"  时间范围: {time_range}")
-                
-                # 验证数据确实不包含当前时间点
-                if period in ['1d']:
-                    latest_date = stock_data['time'].dt.date.max()
-                    if latest_date >= current_datetime.date():
-                        print(f"  [WARN]️ 警告: 数据包含当前日期或之后的日期")
-                else:
-                    latest_time = stock_data['time'].max()
-                    if latest_time >= current_datetime:
-                        print(f"  [WARN]️ 警告: 数据包含当前时间或之后的时间")
+            else:
+                frames[stock_code] = stock_data
+                result[stock_code] = None  # 占位，处理完成后填入
+        
+        # 各股票按同一field_list获取，通常列名和类型都相同：同类的股票拼成一张宽表统一处理
+        groups = {}
+        for stock_code, stock_data in frames.items():
+            groups.setdefault(tuple(zip(stock_data.columns, stock_data.dtypes)), {})[stock_code] = stock_data
+        
+        latest_time = None
+        for group in groups.values():
+            trimmed, group_latest = _trim_history_frames(group, fields, cutoff_ms, bar_count, skip_paused)
+            result.update(trimmed)
+            if group_latest is not None and (latest_time is None or group_latest > latest_time):
+                latest_time = group_latest
+        
+        # 验证数据确实不包含当前时间点
+        if latest_time is not None:
+            if period in ['1d']:
+                if latest_time.date() >= current_datetime.date():
+                    print(f"  [WARN]️ 警告: 数据包含当前日期或之后的日期")
+            else:
+                if latest_time >= current_datetime:
+                    print(f"  [WARN]️ 警告: 数据包含当前时间或之后的时间")
+        
+        if missing_codes:
+            print(f"警告: {len(missing_codes)} 只股票无数据: {', '.join(missing_codes)}")
+        if empty_codes:
+            print(f"警告: {len(empty_codes)} 只股票数据为空: {', '.join(empty_codes)}")
     
     except Exception as e:
         print(f"获取历史数据时出错: {str(e)}")
@@ -2809,6 +3955,46 @@ def khHistory(symbol_list, fields, bar_count, fre_step, current_time=None, skip_
     return result
 
 
+# khKline 周期参数格式：数字 + 单位（m分钟、h小时、d天），如 1m、2h、1d
+_PERIOD_RE = re.compile(r'^(\d+)([mhd])$')
+
+# khKline 结束时间支持的格式（按精确度从高到低尝试）
+_KLINE_TIME_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y%m%d %H%M%S', '%Y%m%d %H%M', '%Y-%m-%d %H:%M', '%Y%m%d', '%Y-%m-%d')
+
+# khKline 的 end_time 格式：YYYYMMDD[ HHMMSS] 与 YYYY-MM-DD[ HH:MM[:SS]]，一次匹配取出全部字段；
+# "YYYYMMDD HHMM" 不在此匹配，交给 strptime 按原有顺序解析，保持原来的结果
+_KLINE_TIME_RE = re.compile(
+    r'(\d{4})(\d{2})(\d{2})(?: (\d{2})(\d{2})(\d{2}))?'
+    r'|(\d{4})-(\d{2})-(\d{2})(?: (\d{2}):(\d{2})(?::(\d{2}))?)?',
+    re.ASCII
+)
+
+
+@lru_cache(maxsize=256)
+def _parse_kline_time(text: str) -> Optional[datetime]:
+    """解析 khKline 的 end_time 字符串，无法解析时返回 None
+
+    说明:
+        常见格式用预编译正则一次匹配后直接构造 datetime，不再逐个格式调用 strptime
+        并处理失败抛出的异常；正则未匹配（如月、日为一位数）时回退到逐个尝试 strptime。
+    """
+    match = _KLINE_TIME_RE.fullmatch(text)
+    if match:
+        groups = match.groups()
+        parts = groups[:6] if groups[0] is not None else groups[6:]
+        try:
+            return datetime(*(int(part) for part in parts if part is not None))
+        except ValueError:
+            pass  # 日期不合法时交给 strptime 给出一致的结果
+
+    for fmt in _KLINE_TIME_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    return None
+
+
 def khKline(
     symbol_list: Union[str, List[str]],
     period: str,
@@ -2816,7 +4002,8 @@ def khKline(
     fields: List[str] = None,
     end_time: Optional[str] = None,
     fq: str = 'pre',
-    force_download: bool = False
+    force_download: bool = False,
+    fill_data: bool = True
 ) -> Dict[str, pd.DataFrame]:
     """
     获取任意自定义周期的K线数据，支持年对齐和未收线实时快照
@@ -2848,6 +4035,9 @@ def khKline(
            - 'post': 后复权
            - 'none': 不复权
         force_download: 是否强制下载最新数据，默认False
+        fill_data: 获取基础数据时是否补齐停牌等缺失的K线，默认True
+           - True: 与 khHistory 一致，停牌期间用补齐的K线参与聚合
+           - False: 只用实际成交的K线聚合，停牌股票的聚合K线会与默认结果不同
     
     返回:
         dict: {股票代码: DataFrame}
@@ -2874,16 +4064,6 @@ def khKline(
         data = khKline('000001.SZ', '1h', 10, end_time='20241201 1430')
     """
     
-    # 导入必要的模块
-    try:
-        from xtquant import xtdata
-        import pandas as pd
-        from datetime import datetime, timedelta
-        import re
-    except ImportError as e:
-        logging.error(f"导入模块失败: {str(e)}")
-        return {}
-    
     # 设置默认字段
     if fields is None:
         fields = ['open', 'high', 'low', 'close', 'volume']
@@ -2896,14 +4076,16 @@ def khKline(
     if bar_count <= 0:
         raise ValueError("bar_count必须大于0")
     
-    # 统一处理股票代码列表
+    # 统一处理股票代码列表（已是列表时直接使用，函数内只读不改，无需复制）
     if isinstance(symbol_list, str):
         stock_codes = [symbol_list]
+    elif type(symbol_list) is list:
+        stock_codes = symbol_list
     else:
         stock_codes = list(symbol_list)
     
     # 解析周期参数
-    period_match = re.match(r'^(\d+)([mhd])$', period.lower())
+    period_match = _PERIOD_RE.match(period.lower())
     if not period_match:
         raise ValueError(f"不支持的周期格式: {period}，支持格式如: 1m, 5m, 1h, 2h, 1d, 2d等")
     
@@ -2915,14 +4097,8 @@ def khKline(
         target_datetime = datetime.now()
     else:
         end_time = end_time.strip()
-        # 尝试解析不同格式(按精确度从高到低尝试)
-        for fmt in ['%Y-%m-%d %H:%M:%S', '%Y%m%d %H%M%S', '%Y%m%d %H%M', '%Y-%m-%d %H:%M', '%Y%m%d', '%Y-%m-%d']:
-            try:
-                target_datetime = datetime.strptime(end_time, fmt)
-                break
-            except ValueError:
-                continue
-        else:
+        target_datetime = _parse_kline_time(end_time)
+        if target_datetime is None:
             raise ValueError(f"无法解析时间格式: {end_time}，支持格式: YYYYMMDD, YYYYMMDD HHMM, YYYY-MM-DD HH:MM:SS等")
         
         # 将秒数归零(忽略秒数部分)
@@ -2940,19 +4116,19 @@ def khKline(
             # 分钟周期
             result = _get_minute_kline(
                 stock_codes, period_num, bar_count, fields, 
-                target_datetime, dividend_type, force_download
+                target_datetime, dividend_type, force_download, fill_data
             )
         elif period_unit == 'h':
             # 小时周期
             result = _get_hour_kline(
                 stock_codes, period_num, bar_count, fields,
-                target_datetime, dividend_type, force_download
+                target_datetime, dividend_type, force_download, fill_data
             )
         elif period_unit == 'd':
             # 天周期
             result = _get_day_kline(
                 stock_codes, period_num, bar_count, fields,
-                target_datetime, dividend_type, force_download
+                target_datetime, dividend_type, force_download, fill_data
             )
         else:
             raise ValueError(f"不支持的周期单位: {period_unit}")
@@ -2966,26 +4142,30 @@ def khKline(
 
 def _parse_period(period: str) -> tuple:
     """解析周期字符串，返回(数字, 单位)"""
-    import re
-    match = re.match(r'^(\d+)([mhd])$', period.lower())
+    match = _PERIOD_RE.match(period.lower())
     if not match:
         raise ValueError(f"不支持的周期格式: {period}")
     return int(match.group(1)), match.group(2)
 
 
+@lru_cache(maxsize=32)
+def _year_trade_days(year: int) -> tuple:
+    """获取指定年份全部交易日（当日0点的datetime，升序），结果按年份缓存
+
+    多日周期K线每次调用都要用到目标年份的交易日，回测中反复调用时直接复用，
+    交易日历（节假日数据）更新后需调用 _year_trade_days.cache_clear()。
+    """
+    return tuple(datetime.fromordinal(ordinal)
+                 for ordinal in _iter_trade_ordinals(datetime(year, 1, 1).toordinal(),
+                                                     datetime(year, 12, 31).toordinal()))
+
+
 def _get_year_first_trade_day(year: int) -> datetime:
     """获取指定年份的第一个交易日"""
-    from datetime import datetime, timedelta
-    
-    # 从1月1日开始查找
-    current_date = datetime(year, 1, 1)
-    end_date = datetime(year, 2, 1)  # 最多查到2月1日
-    
-    while current_date < end_date:
-        date_str = current_date.strftime('%Y-%m-%d')
-        if is_trade_day(date_str):
-            return current_date
-        current_date += timedelta(days=1)
+    # 只在1月内查找（取缓存的年度交易日中的第一个）
+    year_days = _year_trade_days(year)
+    if year_days and year_days[0].month == 1:
+        return year_days[0]
     
     # 如果找不到，返回1月1日（理论上不应该发生）
     logging.warning(f"未找到{year}年的第一个交易日，使用1月1日")
@@ -2994,109 +4174,460 @@ def _get_year_first_trade_day(year: int) -> datetime:
 
 def _get_trade_days_list(start_date: datetime, end_date: datetime) -> List[datetime]:
     """获取指定日期范围内的所有交易日列表"""
-    trade_days = []
-    current = start_date
+    if end_date < start_date:
+        return []
     
-    while current <= end_date:
-        date_str = current.strftime('%Y-%m-%d')
-        if is_trade_day(date_str):
-            trade_days.append(current)
-        current += timedelta(days=1)
+    # 同一年内且从0点开始时，直接在缓存的年度交易日中二分截取
+    if (start_date.year == end_date.year
+            and start_date == datetime.combine(start_date.date(), datetime.min.time())):
+        year_days = _year_trade_days(start_date.year)
+        return list(year_days[bisect_left(year_days, start_date):bisect_right(year_days, end_date)])
     
-    return trade_days
+    # 与逐日累加 start_date 的结果一致：保留 start_date 的时间部分，最后一天不晚于 end_date
+    start_ordinal = start_date.toordinal()
+    end_ordinal = start_ordinal + (end_date - start_date).days
+    return [start_date + timedelta(days=ordinal - start_ordinal)
+            for ordinal in _iter_trade_ordinals(start_ordinal, end_ordinal)]
+
+
+def _time_parts(times: pd.Series) -> tuple:
+    """一次性算出时间列每条记录的小时、分钟和日期，供多处计算复用
 
+    参数:
+        times: 时间列（datetime64）
+
+    返回:
+        tuple: (小时数组, 分钟数组, 日期数组(datetime64[D]))
+    """
+    values = times.to_numpy()
+    if values.dtype.kind != 'M':
+        # 带时区等非numpy日期类型，按原方式用.dt访问
+        return (times.dt.hour.to_numpy(), times.dt.minute.to_numpy(),
+                times.dt.tz_localize(None).to_numpy().astype('datetime64[D]'))
+    minute_of_day = values.astype('datetime64[m]').astype(np.int64) % 1440
+    return minute_of_day // 60, minute_of_day % 60, values.astype('datetime64[D]')
 
-def _process_930_data(df: pd.DataFrame, fields: List[str]) -> pd.DataFrame:
+
+def _process_930_data(df: pd.DataFrame, fields: List[str], time_parts: tuple = None) -> pd.DataFrame:
     """
     处理09:30的数据问题
     
-    问题：09:30的高开低收都是开盘价（数据不完整）
-    解决：将09:30的开盘价和成交量合并到09:31
+    问题：09:30的高开低收都是开盘价（数据不完整）
+    解决：将09:30的开盘价和成交量合并到09:31
+    
+    参数:
+        df: 原始分钟K线数据，已排序
+        fields: 数据字段列表
+        time_parts: 调用方已用 _time_parts 算好的 (小时, 分钟, 日期) 数组，为None时在此计算
+    
+    返回:
+        处理后的DataFrame
+    """
+    if df.empty:
+        return df
+    
+    # 一次性算出每条记录的时分和所属日期，不再按日期分组逐日处理
+    hours, minutes, days = time_parts if time_parts is not None else _time_parts(df['time'])
+    
+    # 时间为空的记录不属于任何交易日，不参与处理（与按日期分组时的结果一致）
+    valid = df['time'].notna().to_numpy()
+    if not valid.all():
+        df = df[valid]
+        hours, minutes, days = hours[valid], minutes[valid], days[valid]
+    
+    return _merge_930_rows(df, fields, hours * 100 + minutes, days).sort_values('time').reset_index(drop=True)
+
+
+def _merge_930_rows(df: pd.DataFrame, fields: List[str], hm: np.ndarray, day_keys: np.ndarray) -> pd.DataFrame:
+    """把每个交易日09:30的开盘价、成交量和成交额合并到09:31，并删除这些交易日的09:30记录
+    
+    参数:
+        df: 分钟K线数据
+        fields: 数据字段列表
+        hm: 每条记录的时分（小时*100+分钟）
+        day_keys: 每条记录所属交易日的键，多只股票拼在一起处理时需同时区分股票
+    
+    返回:
+        处理后的DataFrame（保持原有行顺序，不重新排序）
+    """
+    pos_930 = np.flatnonzero(hm == 930)
+    pos_931 = np.flatnonzero(hm == 931)
+    
+    # 每个交易日第一条09:30和第一条09:31记录，两者都有的交易日需要合并
+    days_930, first_930 = np.unique(day_keys[pos_930], return_index=True)
+    days_931, first_931 = np.unique(day_keys[pos_931], return_index=True)
+    merge_days, idx_930, idx_931 = np.intersect1d(days_930, days_931, assume_unique=True, return_indices=True)
+    
+    result = df
+    if len(merge_days):
+        src = pos_930[first_930[idx_930]]
+        dst = pos_931[first_931[idx_931]]
+        result = df.copy()
+        
+        # 将09:30的开盘价赋给09:31
+        if 'open' in fields and 'open' in result.columns:
+            values = result['open'].to_numpy(copy=True)
+            values[dst] = values[src]
+            result['open'] = values
+        
+        # 将09:30的成交量、成交额（如果有）累加到09:31
+        for col in ('volume', 'amount'):
+            if col in fields and col in result.columns:
+                values = result[col].to_numpy(copy=True)
+                values[dst] = values[src] + values[dst]
+                result[col] = values
+        
+        # 删除这些交易日的09:30数据
+        drop_930 = np.zeros(len(result), dtype=bool)
+        drop_930[pos_930] = np.isin(day_keys[pos_930], merge_days)
+        result = result[~drop_930]
+    
+    return result
+
+
+def _aggregate_kline(df: pd.DataFrame, group_col: str, fields: List[str]) -> pd.DataFrame:
+    """
+    聚合K线数据
+    
+    参数:
+        df: 原始K线数据，必须包含time列
+        group_col: 分组列名（用于groupby）
+        fields: 需要聚合的字段
+    """
+    agg_dict = {}
+    
+    # 时间取最后一个
+    agg_dict['time'] = 'last'
+    
+    # 处理各个字段
+    if 'open' in fields:
+        agg_dict['open'] = 'first'
+    if 'high' in fields:
+        agg_dict['high'] = 'max'
+    if 'low' in fields:
+        agg_dict['low'] = 'min'
+    if 'close' in fields:
+        agg_dict['close'] = 'last'
+    if 'volume' in fields:
+        agg_dict['volume'] = 'sum'
+    if 'amount' in fields:
+        agg_dict['amount'] = 'sum'
+    
+    # 分组键已有序时一次计算各组边界直接归约，否则使用groupby
+    # （调用方传入的数据均已按时间排序，各组按首次出现的顺序即为时间顺序，无需groupby再对组键排序）
+    result = _aggregate_sorted_kline(df, group_col, agg_dict)
+    if result is None:
+        result = df.groupby(group_col, as_index=False, sort=False, observed=True).agg(agg_dict)
+    return result
+
+
+# 有序分组快速路径支持的聚合方式对应的 numpy 归约（fmax/fmin 与 groupby 一样跳过 NaN）
+_SORTED_AGG_UFUNCS = {'max': np.fmax, 'min': np.fmin, 'sum': np.add}
+
+def _aggregate_sorted_kline(df: pd.DataFrame, group_col, agg_dict: dict) -> Optional[pd.DataFrame]:
+    """分组键为整数且已按键有序时，用各组边界一次性完成K线聚合
+    
+    分钟K线按时间排好序后，同一组的记录是连续的：算出每组的起止位置后，
+    first/last 直接取边界值，max/min 及整数列的 sum 用 ufunc.reduceat 一次归约，
+    不再经过 groupby 的哈希分组和逐列分派。浮点列的 sum 仍交给 groupby 按组号求和：
+    np.add.reduceat 逐个累加，而 groupby 使用补偿求和，两者在最后一位上可能不同
+    （如 1942.8600000000001 与 1942.86）。浮点列中的 NaN 按 groupby 的规则跳过：
+    first/last 取组内第一个/最后一个非 NaN 值，sum 按 0 计，整组都是 NaN 时 max/min/first/last 为 NaN。
+    
+    参数:
+        df: 原始K线数据
+        group_col: 分组列名或列名列表
+        agg_dict: {列名: 聚合方式}，聚合方式为 first/last/max/min/sum
+    
+    返回:
+        与 df.groupby(group_col, as_index=False).agg(agg_dict) 相同的结果；
+        不满足条件（键无序、非整数键、含缺失值等）时返回 None，由调用方使用 groupby
+    """
+    n = len(df)
+    if n == 0:
+        return None
+    group_cols = [group_col] if isinstance(group_col, str) else list(group_col)
+    keys = [df[col].to_numpy() for col in group_cols]
+    if any(key.dtype.kind not in 'iu' for key in keys):
+        return None
+    
+    # 键须按(第一键, 第二键, ...)非递减，组边界为任一键发生变化的位置
+    change = np.zeros(n, dtype=bool)
+    change[0] = True
+    tie = np.ones(n - 1, dtype=bool)
+    for key in keys:
+        step = np.diff(key)
+        if (step[tie] < 0).any():
+            return None
+        change[1:] |= step != 0
+        tie &= step == 0
+    starts = np.flatnonzero(change)
+    ends = np.append(starts[1:], n)
+    group_ids = None
+    
+    columns = {col: key[starts] for col, key in zip(group_cols, keys)}
+    for col, how in agg_dict.items():
+        values = df[col].to_numpy()
+        kind = values.dtype.kind
+        # 非数值类型或时间列含缺失值时交给 groupby 处理
+        if kind not in 'iufM' or (kind == 'M' and np.isnat(values).any()):
+            return None
+        missing = np.isnan(values) if kind == 'f' else None
+        if missing is not None and not missing.any():
+            missing = None
+        if how in ('first', 'last'):
+            if missing is None:
+                columns[col] = values[starts] if how == 'first' else values[ends - 1]
+                continue
+            # 各组第一个/最后一个非 NaN 值的位置，组内没有时取到组外，结果置为 NaN
+            positions = np.arange(n)
+            if how == 'first':
+                positions[missing] = n
+                picked = np.minimum.reduceat(positions, starts)
+                found = picked < ends
+            else:
+                positions[missing] = -1
+                picked = np.maximum.reduceat(positions, starts)
+                found = picked >= starts
+            columns[col] = np.where(found, values[np.where(found, picked, 0)], np.nan)
+        elif how == 'sum' and kind == 'f':
+            # 浮点求和与 groupby 使用同一实现（补偿求和），结果逐位一致
+            if group_ids is None:
+                group_ids = np.cumsum(change) - 1
+            columns[col] = pd.Series(values).groupby(group_ids, sort=False).sum().to_numpy()
+        elif how in _SORTED_AGG_UFUNCS and kind != 'M':
+            columns[col] = _SORTED_AGG_UFUNCS[how].reduceat(values, starts)
+        else:
+            return None
+    return pd.DataFrame(columns)
+
+
+# 北京时间相对 UTC 的偏移（毫秒）
+_BEIJING_OFFSET_MS = 8 * 3600 * 1000
+
+def _ms_to_beijing_datetime(times: pd.Series):
+    """把 UTC 毫秒时间戳列转换为北京时间
+
+    整数时间戳直接做一次 int64 加法后按毫秒解释，再转为与原方式相同的 datetime64[ns]，
+    不经过 float 转换和 pd.to_datetime，也不损失毫秒精度；其它类型（浮点、字符串等）
+    仍按原方式转换。
+
+    参数:
+        times: time列（UTC毫秒时间戳）
+
+    返回:
+        与times等长的北京时间（np.ndarray 或 pd.Series），可直接赋值给time列
+    """
+    values = times.to_numpy()
+    if values.dtype.kind in 'iu':
+        return (values.astype(np.int64, copy=False) + _BEIJING_OFFSET_MS).astype('datetime64[ms]').astype('datetime64[ns]')
+    return pd.to_datetime(times.astype(float), unit='ms') + pd.Timedelta(hours=8)
+
+
+def _latest_rows(df: pd.DataFrame, bound, bar_count: int, side: str = 'right') -> pd.DataFrame:
+    """按时间升序取出time不晚于bound（side='left'时为早于bound）的行中最近的bar_count条
+
+    xtdata返回的数据通常已按时间升序排列，此时用searchsorted二分找到截止位置后直接切片，
+    省去整列比较、筛选、排序和tail各自生成的中间表；时间未排好序（或含NaT）时，
+    在行号上完成筛选、排序和截取后只按行号取一次数据。
+
+    参数:
+        df: 含time列的数据
+        bound: 截止时间（np.datetime64）
+        bar_count: 保留的条数
+        side: 'right'保留等于bound的行，'left'不保留
+
+    返回:
+        pd.DataFrame: 按time升序、索引从0开始的结果
+    """
+    times = df['time'].to_numpy()
+    if (times[1:] >= times[:-1]).all():
+        end = int(times.searchsorted(bound, side=side))
+        return df.iloc[max(end - bar_count, 0):end].reset_index(drop=True)
+
+    positions = np.flatnonzero(times <= bound if side == 'right' else times < bound)
+    positions = positions[np.argsort(times[positions], kind='stable')]
+    positions = positions[max(len(positions) - bar_count, 0):]
+    return df.take(positions).reset_index(drop=True)
+
+
+def _parallel_download(stock_codes: List[str], period: str, start_time: str, end_time: str) -> None:
+    """用线程池并发下载多只股票的历史数据，单只失败时记录警告并继续
+
+    参数:
+        stock_codes: 股票代码列表
+        period: 数据周期，如 '1m'、'1d'
+        start_time: 开始日期，格式 YYYYMMDD
+        end_time: 结束日期，格式 YYYYMMDD
+
+    说明:
+        下载主要是等待 xtdata 返回，并发可重叠各只股票的请求耗时；
+        同时发起的请求数受 _XTDATA_DOWNLOAD_CONCURRENCY 限制。
+    """
+    def _download_one(stock_code):
+        with _xtdata_download_slots:
+            xtdata.download_history_data(
+                stock_code=stock_code,
+                period=period,
+                start_time=start_time,
+                end_time=end_time
+            )
+
+    if not stock_codes:
+        return
+
+    with ThreadPoolExecutor(max_workers=min(_XTDATA_DOWNLOAD_CONCURRENCY, len(stock_codes))) as executor:
+        futures = [(stock_code, executor.submit(_download_one, stock_code)) for stock_code in stock_codes]
+        for stock_code, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                logging.warning(f"下载{stock_code}数据失败: {str(e)}")
+
+
+def _minute_group_ids(time_parts: tuple, period_minutes: int) -> np.ndarray:
+    """计算分钟K线按自定义周期聚合时每条记录的分组ID
+    
+    从09:31开始每period_minutes分钟一组（09:31算第0分钟，13:00之后扣除11:31-13:00午休的90分钟），
+    分组ID = 日期序号 * 100000 + 日内组号，为int64整数，按数值排序即为时间顺序。
+    
+    参数:
+        time_parts: _time_parts 返回的 (小时, 分钟, 日期) 数组
+        period_minutes: 每组包含的分钟数
+    
+    返回:
+        np.ndarray: 与时间列等长的分组ID
+    """
+    hours, minutes, days = time_parts
+    # 日内分钟数减去09:31对应的571分钟，13:00之后再减去午休90分钟；原地运算，不再按布尔掩码做花式索引赋值
+    minutes_since_931 = hours.astype(np.int64) * 60
+    minutes_since_931 += minutes
+    minutes_since_931 -= np.where(minutes_since_931 >= 13 * 60, 571 + 90, 571)
+    minutes_since_931 //= period_minutes
+    group_ids = days.astype(np.int64)
+    group_ids *= 100000
+    group_ids += minutes_since_931
+    return group_ids
+
+
+def _minute_base_period(period_minutes: int, target_datetime: datetime) -> str:
+    """选择聚合自定义分钟/小时周期所用的基础数据周期
+    
+    周期为5分钟的整数倍且目标时间落在5分钟整点上时，5分钟K线（以结束时间标记）与按1分钟线
+    聚合的分组完全对齐，改用5分钟数据可使获取和聚合的数据量减少到约五分之一；
+    否则目标时间所在的5分钟K线尚未收线，仍使用1分钟数据以包含未收线部分。
+    
+    参数:
+        period_minutes: 每根K线包含的分钟数
+        target_datetime: 目标时间
+    
+    返回:
+        str: '5m' 或 '1m'
+    """
+    if period_minutes % 5 == 0 and target_datetime.minute % 5 == 0:
+        return '5m'
+    return '1m'
+
+
+def _split_kline_frames(data: Dict[str, pd.DataFrame], stock_codes: List[str]) -> tuple:
+    """把 get_market_data_ex 的返回值分为结果占位和有数据的股票，后续只需遍历有数据的股票
+
+    参数:
+        data: get_market_data_ex 返回的 {股票代码: DataFrame}
+        stock_codes: 股票代码列表
+
+    返回:
+        tuple: (result, valid_frames)
+            result: 按stock_codes顺序排列的结果字典，无数据的股票为空DataFrame，其余为None占位
+            valid_frames: [(股票代码, DataFrame)]，只含有数据的股票
+    """
+    result = {}
+    valid_frames = []
+    for stock_code in stock_codes:
+        df = data.get(stock_code)
+        if df is None or df.empty:
+            result[stock_code] = pd.DataFrame()
+        else:
+            result[stock_code] = None  # 占位，保持与输入相同的顺序
+            valid_frames.append((stock_code, df))
+    return result, valid_frames
+
+
+def _aggregate_minute_klines(
+    data: Dict[str, pd.DataFrame],
+    stock_codes: List[str],
+    fields: List[str],
+    target_datetime: datetime,
+    period_minutes: int,
+    bar_count: int,
+    merge_930: bool = True
+) -> Dict[str, pd.DataFrame]:
+    """把多只股票的1分钟（或5分钟）数据按自定义周期聚合，返回每只股票最近的bar_count条K线
+    
+    列名和类型相同的股票拼成一张表，时间转换、筛选、09:30处理和分组聚合对整张表各做一次，
+    再按股票切分；组内记录按(股票, 时间)排序，结果与逐只处理一致。
     
     参数:
-        df: 原始分钟K线数据，已排序
+        data: get_market_data_ex 返回的 {股票代码: DataFrame}
+        stock_codes: 股票代码列表
         fields: 数据字段列表
+        target_datetime: 目标时间（包含）
+        period_minutes: 每根K线包含的分钟数
+        bar_count: 每只股票保留的K线数量
+        merge_930: 是否把09:30的数据合并到09:31（基础数据为1分钟线时需要）
     
     返回:
-        处理后的DataFrame
+        dict: {股票代码: DataFrame}，无数据的股票为空DataFrame
     """
-    import pandas as pd
-    
-    if df.empty:
-        return df
-    
-    # 按日期分组处理
-    result_dfs = []
-    
-    for date, date_df in df.groupby(df['time'].dt.date):
-        # 查找09:30和09:31的数据
-        mask_930 = (date_df['time'].dt.hour == 9) & (date_df['time'].dt.minute == 30)
-        mask_931 = (date_df['time'].dt.hour == 9) & (date_df['time'].dt.minute == 31)
+    result, valid_frames = _split_kline_frames(data, stock_codes)
+    groups = {}
+    for stock_code, df in valid_frames:
+        groups.setdefault(tuple(zip(df.columns, df.dtypes)), {})[stock_code] = df
+    
+    for frames in groups.values():
+        codes = list(frames)
+        big = pd.concat(frames.values(), ignore_index=True)
+        # 每行所属股票在codes中的位置
+        owner = np.repeat(np.arange(len(codes)), [len(df) for df in frames.values()])
         
-        data_930 = date_df[mask_930]
-        data_931 = date_df[mask_931]
+        # 转换时间并筛选到目标时间，再按股票、时间排序
+        times = np.asarray(_ms_to_beijing_datetime(big['time']))
+        keep = np.flatnonzero(times <= np.datetime64(target_datetime))
+        keep = keep[np.lexsort((times[keep], owner[keep]))]
+        big = big.take(keep)
+        big['time'] = times[keep]
+        big = big.reset_index(drop=True)
+        owner = owner[keep]
         
-        if not data_930.empty and not data_931.empty:
-            # 有09:30和09:31的数据，需要合并
-            idx_930 = data_930.index[0]
-            idx_931 = data_931.index[0]
-            
-            # 将09:30的开盘价赋给09:31
-            if 'open' in fields and 'open' in date_df.columns:
-                date_df.loc[idx_931, 'open'] = date_df.loc[idx_930, 'open']
-            
-            # 将09:30的成交量累加到09:31
-            if 'volume' in fields and 'volume' in date_df.columns:
-                date_df.loc[idx_931, 'volume'] = date_df.loc[idx_930, 'volume'] + date_df.loc[idx_931, 'volume']
-            
-            # 将09:30的成交额累加到09:31（如果有）
-            if 'amount' in fields and 'amount' in date_df.columns:
-                date_df.loc[idx_931, 'amount'] = date_df.loc[idx_930, 'amount'] + date_df.loc[idx_931, 'amount']
-            
-            # 删除09:30的数据
-            date_df = date_df[~mask_930].copy()
+        if big.empty:
+            for stock_code in codes:
+                result[stock_code] = pd.DataFrame()
+            continue
         
-        result_dfs.append(date_df)
-    
-    # 合并所有日期的数据
-    if result_dfs:
-        result = pd.concat(result_dfs, ignore_index=True)
-        result = result.sort_values('time').reset_index(drop=True)
-        return result
-    else:
-        return df
-
-
-def _aggregate_kline(df: pd.DataFrame, group_col: str, fields: List[str]) -> pd.DataFrame:
-    """
-    聚合K线数据
-    
-    参数:
-        df: 原始K线数据，必须包含time列
-        group_col: 分组列名（用于groupby）
-        fields: 需要聚合的字段
-    """
-    agg_dict = {}
-    
-    # 时间取最后一个
-    agg_dict['time'] = 'last'
-    
-    # 处理各个字段
-    if 'open' in fields:
-        agg_dict['open'] = 'first'
-    if 'high' in fields:
-        agg_dict['high'] = 'max'
-    if 'low' in fields:
-        agg_dict['low'] = 'min'
-    if 'close' in fields:
-        agg_dict['close'] = 'last'
-    if 'volume' in fields:
-        agg_dict['volume'] = 'sum'
-    if 'amount' in fields:
-        agg_dict['amount'] = 'sum'
+        # 时间的小时、分钟和日期只算一次，分组和09:30处理共用；交易日的键同时区分股票
+        hours, minutes, days = _time_parts(big['time'])
+        big['_owner'] = owner
+        big['group_id'] = _minute_group_ids((hours, minutes, days), period_minutes)
+        day_keys = owner * 1000000 + days.astype(np.int64)
+        
+        # 处理09:30的数据问题（09:30的开盘价和成交量合并到09:31），行顺序保持(股票, 时间)
+        if merge_930:
+            big = _merge_930_rows(big, fields, hours * 100 + minutes, day_keys)
+        
+        # 按(股票, 分组ID)聚合，结果按股票、时间排序
+        agg_df = _aggregate_kline(big, ['_owner', 'group_id'], fields)
+        agg_owner = agg_df['_owner'].to_numpy()
+        agg_df = agg_df.drop(columns=['_owner', 'group_id'])
+        
+        # 按股票切分，取最近的bar_count条（筛选后无数据的股票为空DataFrame）
+        bounds = np.searchsorted(agg_owner, np.arange(len(codes) + 1))
+        for pos, stock_code in enumerate(codes):
+            if bounds[pos] == bounds[pos + 1]:
+                result[stock_code] = pd.DataFrame()
+            else:
+                start = max(bounds[pos], bounds[pos + 1] - bar_count)
+                result[stock_code] = agg_df.iloc[start:bounds[pos + 1]].reset_index(drop=True)
     
-    # 执行聚合
-    result = df.groupby(group_col, as_index=False).agg(agg_dict)
     return result
 
 
@@ -3107,13 +4638,10 @@ def _get_minute_kline(
     fields: List[str],
     target_datetime: datetime,
     dividend_type: str,
-    force_download: bool
+    force_download: bool,
+    fill_data: bool = True
 ) -> Dict[str, pd.DataFrame]:
     """获取分钟级别的K线数据"""
-    from xtquant import xtdata
-    import pandas as pd
-    from datetime import datetime, timedelta
-    
     result = {}
     
     # 判断是否为原生支持的分钟周期
@@ -3130,16 +4658,7 @@ def _get_minute_kline(
         end_time = target_datetime.strftime('%Y%m%d')
         
         if force_download:
-            for stock_code in stock_codes:
-                try:
-                    xtdata.download_history_data(
-                        stock_code=stock_code,
-                        period=period_str,
-                        start_time=start_time,
-                        end_time=end_time
-                    )
-                except Exception as e:
-                    logging.warning(f"下载{stock_code}数据失败: {str(e)}")
+            _parallel_download(stock_codes, period_str, start_time, end_time)
         
         # 获取数据
         data = xtdata.get_market_data_ex(
@@ -3150,122 +4669,50 @@ def _get_minute_kline(
             end_time=end_time,
             count=-1,
             dividend_type=dividend_type,
-            fill_data=True
+            fill_data=fill_data
         )
         
         if not data:
             return {}
         
-        # 处理每只股票
-        for stock_code in stock_codes:
-            if stock_code not in data or data[stock_code] is None or data[stock_code].empty:
-                result[stock_code] = pd.DataFrame()
-                continue
+        # 处理每只有数据的股票（无数据的股票已在结果中放入空DataFrame）
+        result, valid_frames = _split_kline_frames(data, stock_codes)
+        for stock_code, df in valid_frames:
+            # 转换时间（assign生成新表，不会修改get_market_data_ex返回的数据，无需先整体复制）
+            df = df.assign(time=_ms_to_beijing_datetime(df['time']))
             
-            df = data[stock_code].copy()
-            
-            # 转换时间
-            df['time'] = pd.to_datetime(df['time'].astype(float), unit='ms') + pd.Timedelta(hours=8)
-            
-            # 筛选到目标时间（包含未收线）
-            df = df[df['time'] <= target_datetime].copy()
-            
-            # 排序
-            df = df.sort_values('time').reset_index(drop=True)
-            
-            # 取最近的bar_count条
-            if len(df) > bar_count:
-                df = df.tail(bar_count).reset_index(drop=True)
-            
-            result[stock_code] = df
+            # 筛选到目标时间（包含未收线），按时间排序后取最近的bar_count条
+            result[stock_code] = _latest_rows(df, np.datetime64(target_datetime), bar_count)
     
     else:
-        # 非原生周期，需要聚合1分钟数据
+        # 非原生周期，需要聚合1分钟数据（周期为5分钟整数倍时聚合5分钟数据）
+        base_period = _minute_base_period(period_minutes, target_datetime)
         lookback_days = max(10, (bar_count * period_minutes + 1439) // 1440)
         start_dt = target_datetime - timedelta(days=lookback_days)
         start_time = start_dt.strftime('%Y%m%d')
         end_time = target_datetime.strftime('%Y%m%d')
         
         if force_download:
-            for stock_code in stock_codes:
-                try:
-                    xtdata.download_history_data(
-                        stock_code=stock_code,
-                        period='1m',
-                        start_time=start_time,
-                        end_time=end_time
-                    )
-                except Exception as e:
-                    logging.warning(f"下载{stock_code}数据失败: {str(e)}")
+            _parallel_download(stock_codes, base_period, start_time, end_time)
         
-        # 获取1分钟数据
+        # 获取基础周期数据
         data = xtdata.get_market_data_ex(
             field_list=['time'] + fields,
             stock_list=stock_codes,
-            period='1m',
+            period=base_period,
             start_time=start_time,
             end_time=end_time,
             count=-1,
             dividend_type=dividend_type,
-            fill_data=True
+            fill_data=fill_data
         )
         
         if not data:
             return {}
         
-        # 处理每只股票
-        for stock_code in stock_codes:
-            if stock_code not in data or data[stock_code] is None or data[stock_code].empty:
-                result[stock_code] = pd.DataFrame()
-                continue
-            
-            df = data[stock_code].copy()
-            
-            # 转换时间
-            df['time'] = pd.to_datetime(df['time'].astype(float), unit='ms') + pd.Timedelta(hours=8)
-            
-            # 筛选到目标时间
-            df = df[df['time'] <= target_datetime].copy()
-            
-            if df.empty:
-                result[stock_code] = pd.DataFrame()
-                continue
-            
-            # 排序
-            df = df.sort_values('time').reset_index(drop=True)
-            
-            # 处理09:30的数据问题
-            # 09:30的高开低收都是开盘价，需要将其开盘价和成交量合并到09:31
-            df = _process_930_data(df, fields)
-            
-            # 按自定义周期聚合
-            # 策略：从09:31开始，每period_minutes分钟一组
-            # 09:31-09:45为第1组(0-14分钟)，09:46-10:00为第2组(15-29分钟)
-            df['date'] = df['time'].dt.date
-            
-            # 计算从09:31开始的分钟数（09:31算第0分钟）
-            df['minutes_since_931'] = (df['time'].dt.hour - 9) * 60 + df['time'].dt.minute - 31
-            
-            # 处理下午时段（13:00之后需要减去午休的90分钟）
-            # 午休是11:31-13:00，共90分钟
-            df.loc[df['time'].dt.hour >= 13, 'minutes_since_931'] -= 90
-            
-            # 计算分组ID（每period_minutes分钟一组）
-            # 使用3位数字格式，确保字符串排序正确
-            df['group_id'] = df['date'].astype(str) + '_' + (df['minutes_since_931'] // period_minutes).apply(lambda x: f"{x:03d}")
-            
-            # 聚合
-            agg_df = _aggregate_kline(df, 'group_id', fields)
-            
-            # 删除临时列
-            if 'group_id' in agg_df.columns:
-                agg_df = agg_df.drop(columns=['group_id'])
-            
-            # 取最近的bar_count条
-            if len(agg_df) > bar_count:
-                agg_df = agg_df.tail(bar_count).reset_index(drop=True)
-            
-            result[stock_code] = agg_df
+        # 所有股票拼在一起，筛选、09:30处理和按周期聚合各做一次（5分钟数据没有单独的09:30记录，无需合并）
+        result = _aggregate_minute_klines(data, stock_codes, fields, target_datetime, period_minutes, bar_count,
+                                          merge_930=base_period == '1m')
     
     return result
 
@@ -3277,100 +4724,41 @@ def _get_hour_kline(
     fields: List[str],
     target_datetime: datetime,
     dividend_type: str,
-    force_download: bool
+    force_download: bool,
+    fill_data: bool = True
 ) -> Dict[str, pd.DataFrame]:
     """获取小时级别的K线数据"""
-    from xtquant import xtdata
-    import pandas as pd
-    from datetime import datetime, timedelta
-    
     result = {}
     
-    # 小时周期通过聚合1分钟数据实现
+    # 小时周期通过聚合1分钟（或5分钟）数据实现
     period_minutes = period_hours * 60
+    base_period = _minute_base_period(period_minutes, target_datetime)
     lookback_days = max(10, (bar_count * period_minutes + 1439) // 1440)
     start_dt = target_datetime - timedelta(days=lookback_days)
     start_time = start_dt.strftime('%Y%m%d')
     end_time = target_datetime.strftime('%Y%m%d')
     
     if force_download:
-        for stock_code in stock_codes:
-            try:
-                xtdata.download_history_data(
-                    stock_code=stock_code,
-                    period='1m',
-                    start_time=start_time,
-                    end_time=end_time
-                )
-            except Exception as e:
-                logging.warning(f"下载{stock_code}数据失败: {str(e)}")
+        _parallel_download(stock_codes, base_period, start_time, end_time)
     
-    # 获取1分钟数据
+    # 获取基础周期数据
     data = xtdata.get_market_data_ex(
         field_list=['time'] + fields,
         stock_list=stock_codes,
-        period='1m',
+        period=base_period,
         start_time=start_time,
         end_time=end_time,
         count=-1,
         dividend_type=dividend_type,
-        fill_data=True
+        fill_data=fill_data
     )
     
     if not data:
         return {}
     
-    # 处理每只股票
-    for stock_code in stock_codes:
-        if stock_code not in data or data[stock_code] is None or data[stock_code].empty:
-            result[stock_code] = pd.DataFrame()
-            continue
-        
-        df = data[stock_code].copy()
-        
-        # 转换时间
-        df['time'] = pd.to_datetime(df['time'].astype(float), unit='ms') + pd.Timedelta(hours=8)
-        
-        # 筛选到目标时间
-        df = df[df['time'] <= target_datetime].copy()
-        
-        if df.empty:
-            result[stock_code] = pd.DataFrame()
-            continue
-        
-        # 排序
-        df = df.sort_values('time').reset_index(drop=True)
-        
-        # 处理09:30的数据问题
-        # 09:30的高开低收都是开盘价，需要将其开盘价和成交量合并到09:31
-        df = _process_930_data(df, fields)
-        
-        # 按小时周期聚合
-        # 策略：从09:31开始，每period_hours小时一组
-        df['date'] = df['time'].dt.date
-        
-        # 计算从09:31开始的分钟数（09:31算第0分钟）
-        df['minutes_since_931'] = (df['time'].dt.hour - 9) * 60 + df['time'].dt.minute - 31
-        
-        # 处理下午时段（13:00之后需要减去午休的90分钟）
-        df.loc[df['time'].dt.hour >= 13, 'minutes_since_931'] -= 90
-        
-        # 计算分组ID（每period_minutes分钟一组）
-        # 使用3位数字格式，确保字符串排序正确
-        df['group_id'] = df['date'].astype(str) + '_' + (df['minutes_since_931'] // period_minutes).apply(lambda x: f"{x:03d}")
-        
-        # 聚合
-        agg_df = _aggregate_kline(df, 'group_id', fields)
-        
-        # 删除临时列
-        if 'group_id' in agg_df.columns:
-            agg_df = agg_df.drop(columns=['group_id'])
-        
-        # 取最近的bar_count条
-        if len(agg_df) > bar_count:
-            agg_df = agg_df.tail(bar_count).reset_index(drop=True)
-        
-        result[stock_code] = agg_df
+    # 所有股票拼在一起，筛选、09:30处理和按周期聚合各做一次
+    result = _aggregate_minute_klines(data, stock_codes, fields, target_datetime, period_minutes, bar_count,
+                                      merge_930=base_period == '1m')
     
     return result
 
@@ -3382,13 +4770,10 @@ def _get_day_kline(
     fields: List[str],
     target_datetime: datetime,
     dividend_type: str,
-    force_download: bool
+    force_download: bool,
+    fill_data: bool = True
 ) -> Dict[str, pd.DataFrame]:
     """获取天级别的K线数据，支持年对齐"""
-    from xtquant import xtdata
-    import pandas as pd
-    from datetime import datetime, timedelta
-    
     result = {}
     
     if period_days == 1:
@@ -3399,16 +4784,7 @@ def _get_day_kline(
         end_time = target_datetime.strftime('%Y%m%d')
         
         if force_download:
-            for stock_code in stock_codes:
-                try:
-                    xtdata.download_history_data(
-                        stock_code=stock_code,
-                        period='1d',
-                        start_time=start_time,
-                        end_time=end_time
-                    )
-                except Exception as e:
-                    logging.warning(f"下载{stock_code}数据失败: {str(e)}")
+            _parallel_download(stock_codes, '1d', start_time, end_time)
         
         # 获取数据
         data = xtdata.get_market_data_ex(
@@ -3419,35 +4795,21 @@ def _get_day_kline(
             end_time=end_time,
             count=-1,
             dividend_type=dividend_type,
-            fill_data=True
+            fill_data=fill_data
         )
         
         if not data:
             return {}
         
-        # 处理每只股票
-        for stock_code in stock_codes:
-            if stock_code not in data or data[stock_code] is None or data[stock_code].empty:
-                result[stock_code] = pd.DataFrame()
-                continue
-            
-            df = data[stock_code].copy()
-            
-            # 转换时间
-            df['time'] = pd.to_datetime(df['time'].astype(float), unit='ms') + pd.Timedelta(hours=8)
-            
-            # 筛选到目标时间（对于日线，包含当天）
-            target_date = target_datetime.date()
-            df = df[df['time'].dt.date <= target_date].copy()
-            
-            # 排序
-            df = df.sort_values('time').reset_index(drop=True)
-            
-            # 取最近的bar_count条
-            if len(df) > bar_count:
-                df = df.tail(bar_count).reset_index(drop=True)
+        # 处理每只有数据的股票（无数据的股票已在结果中放入空DataFrame）
+        result, valid_frames = _split_kline_frames(data, stock_codes)
+        for stock_code, df in valid_frames:
+            # 转换时间（assign生成新表，不会修改get_market_data_ex返回的数据，无需先整体复制）
+            df = df.assign(time=_ms_to_beijing_datetime(df['time']))
             
-            result[stock_code] = df
+            # 筛选到目标时间（对于日线，包含当天，即早于次日0点），按时间排序后取最近的bar_count条
+            next_day = np.datetime64(target_datetime.date(), 'D') + 1
+            result[stock_code] = _latest_rows(df, next_day, bar_count, side='left')
     
     else:
         # 多日周期，需要年对齐
@@ -3467,16 +4829,7 @@ def _get_day_kline(
         end_time = target_datetime.strftime('%Y%m%d')
         
         if force_download:
-            for stock_code in stock_codes:
-                try:
-                    xtdata.download_history_data(
-                        stock_code=stock_code,
-                        period='1d',
-                        start_time=start_time,
-                        end_time=end_time
-                    )
-                except Exception as e:
-                    logging.warning(f"下载{stock_code}数据失败: {str(e)}")
+            _parallel_download(stock_codes, '1d', start_time, end_time)
         
         # 获取日线数据
         data = xtdata.get_market_data_ex(
@@ -3487,7 +4840,7 @@ def _get_day_kline(
             end_time=end_time,
             count=-1,
             dividend_type=dividend_type,
-            fill_data=True
+            fill_data=fill_data
         )
         
         if not data:
@@ -3501,62 +4854,51 @@ def _get_day_kline(
             logging.error(f"未找到{target_year}年的交易日列表")
             return {}
         
-        # 处理每只股票
-        for stock_code in stock_codes:
-            if stock_code not in data or data[stock_code] is None or data[stock_code].empty:
-                result[stock_code] = pd.DataFrame()
-                continue
-            
-            df = data[stock_code].copy()
-            
-            # 转换时间
-            df['time'] = pd.to_datetime(df['time'].astype(float), unit='ms') + pd.Timedelta(hours=8)
+        # 年度交易日（按日期，升序），交易日在其中的位置即为交易日序号，各股票共用
+        trade_dates = np.array([trade_day.date() for trade_day in trade_days_list], dtype='datetime64[D]')
+        
+        # 筛选截止时间：包含目标当天，即早于次日0点（直接比较datetime64，不生成逐行的date对象）
+        next_day = np.datetime64(target_datetime.date(), 'D') + 1
+        
+        # 处理每只有数据的股票（无数据的股票已在结果中放入空DataFrame）
+        result, valid_frames = _split_kline_frames(data, stock_codes)
+        for stock_code, df in valid_frames:
+            # 转换时间（assign生成新表，不会修改get_market_data_ex返回的数据，无需先整体复制）
+            df = df.assign(time=_ms_to_beijing_datetime(df['time']))
             
             # 筛选到目标时间
-            target_date = target_datetime.date()
-            df = df[df['time'].dt.date <= target_date].copy()
+            df = df[df['time'].to_numpy() < next_day]
             
             if df.empty:
                 result[stock_code] = pd.DataFrame()
                 continue
             
             # 排序
-            df = df.sort_values('time').reset_index(drop=True)
-            
-            # 创建交易日索引映射
-            df['trade_date'] = df['time'].dt.date
-            
-            # 根据年初第一个交易日计算分组
-            # 为每个交易日分配组号
-            trade_day_to_index = {}
-            for idx, trade_day in enumerate(trade_days_list):
-                trade_day_to_index[trade_day.date()] = idx
-            
-            # 计算每行数据的组ID
-            def get_group_id(row):
-                trade_date = row['trade_date']
-                if trade_date not in trade_day_to_index:
-                    return None
-                trade_index = trade_day_to_index[trade_date]
-                group_num = trade_index // period_days
-                # 使用3位数字格式，确保字符串排序正确（支持到999组）
-                return f"{target_year}_{group_num:03d}"
+            df = df.sort_values('time', ignore_index=True)
             
-            df['group_id'] = df.apply(get_group_id, axis=1)
+            # 根据年初第一个交易日计算分组：查出每行日期的交易日序号，每period_days个交易日一组
+            trade_date = df['time'].to_numpy().astype('datetime64[D]')
+            trade_index = np.searchsorted(trade_dates, trade_date)
+            in_year = trade_index < len(trade_dates)
+            in_year[in_year] = trade_dates[trade_index[in_year]] == trade_date[in_year]
             
-            # 过滤掉无效的组
-            df = df[df['group_id'].notna()].copy()
+            # 过滤掉不在年度交易日列表中的记录（无效的组）
+            df = df[in_year]
             
             if df.empty:
                 result[stock_code] = pd.DataFrame()
                 continue
             
-            # 聚合
+            # 按整数组号聚合
+            df = df.assign(group_id=trade_index[in_year] // period_days)
             agg_df = _aggregate_kline(df, 'group_id', fields)
             
+            # 组ID对外使用"年份_3位组号"格式，只需对聚合后的各组格式化
+            agg_df['group_id'] = [f"{target_year}_{group_num:03d}" for group_num in agg_df['group_id'].tolist()]
+            
             # 取最近的bar_count条
             if len(agg_df) > bar_count:
-                agg_df = agg_df.tail(bar_count).reset_index(drop=True)
+                agg_df = agg_df.iloc[len(agg_df) - bar_count:].reset_index(drop=True)
             
             result[stock_code] = agg_df
     
@@ -3584,7 +4926,7 @@ def test_khKline():
                 df = result['000001.SZ']
                 print(f"[OK] {period}周期: 获取 {len(df)} 条记录")
                 if 'time' in df.columns and len(df) > 0:
-                    time_range = f"{df['time'].min()} 到 {df['time'].max()}"
+                    time_range = f"{df['time'].iloc[0]} 到 {df['time'].iloc[-1]}"
                     print(f"  时间范围: {time_range}")
             else:
                 print(f"[FAIL] {period}周期: 未获取到数据")
@@ -3606,7 +4948,7 @@ def test_khKline():
                 df = result['000001.SZ']
                 print(f"[OK] {period}周期: 获取 {len(df)} 条记录")
                 if 'time' in df.columns and len(df) > 0:
-                    time_range = f"{df['time'].min()} 到 {df['time'].max()}"
+                    time_range = f"{df['time'].iloc[0]} 到 {df['time'].iloc[-1]}"
                     print(f"  时间范围: {time_range}")
             else:
                 print(f"[FAIL] {period}周期: 未获取到数据")
@@ -3628,7 +4970,7 @@ def test_khKline():
                 df = result['000001.SZ']
                 print(f"[OK] {period}周期: 获取 {len(df)} 条记录")
                 if 'time' in df.columns and len(df) > 0:
-                    time_range = f"{df['time'].min()} 到 {df['time'].max()}"
+                    time_range = f"{df['time'].iloc[0]} 到 {df['time'].iloc[-1]}"
                     print(f"  时间范围: {time_range}")
             else:
                 print(f"[FAIL] {period}周期: 未获取到数据")
@@ -3772,11 +5114,93 @@ def test_khKline():
     print("=" * 60)
 
 
+class _ThreadRoutedStdout(io.TextIOBase):
+    """按线程分流的标准输出：登记了缓冲区的线程写入各自的缓冲区，其余线程照常写到原输出"""
+
+    def __init__(self, target):
+        super().__init__()
+        self._target = target
+        self._local = threading.local()
+
+    def capture(self, buffer) -> None:
+        """当前线程之后的输出写入 buffer，传入 None 时恢复写到原输出"""
+        self._local.buffer = buffer
+
+    def write(self, text):
+        buffer = getattr(self._local, 'buffer', None)
+        return (self._target if buffer is None else buffer).write(text)
+
+    def flush(self):
+        self._target.flush()
+
+
+def _run_history_captured(stdout: _ThreadRoutedStdout, kwargs: dict) -> SimpleNamespace:
+    """执行一次khHistory，把其间打印的内容收集起来，与结果或异常一起返回"""
+    buffer = io.StringIO()
+    stdout.capture(buffer)
+    try:
+        return SimpleNamespace(result=khHistory(**kwargs), error=None, output=buffer.getvalue())
+    except Exception as e:
+        return SimpleNamespace(result=None, error=e, output=buffer.getvalue())
+    finally:
+        stdout.capture(None)
+
+
+def _submit_history_calls(request_list: List[dict], cache: Optional[dict] = None) -> list:
+    """并发执行多组khHistory调用，按输入顺序返回各调用的Future
+
+    各组调用互不依赖，并发执行后总耗时接近最慢的一次调用而非各次之和；
+    返回时全部调用均已完成，用 _history_result(future) 取结果（调用出错时在此抛出原异常）。
+    khHistory 在工作线程中打印的内容按调用分别收集，由 _history_result 在取结果时输出，
+    不会与其他调用的输出交错。传入cache时，除force_download外参数完全相同的调用只执行一次，
+    之后直接复用其结果（同一批内的重复调用也共用同一个Future），避免重复下载。
+
+    Args:
+        request_list: khHistory 的关键字参数字典列表
+        cache: 可选，{参数键: Future} 缓存字典，由调用方在多批调用间共用
+
+    Returns:
+        list: 与 request_list 顺序一致的 Future 列表
+    """
+    if cache is None:
+        cache = {}
+    futures = []
+    stdout = _ThreadRoutedStdout(sys.stdout)
+    sys.stdout = stdout
+    try:
+        with ThreadPoolExecutor(max_workers=min(_XTDATA_DOWNLOAD_CONCURRENCY, len(request_list))) as executor:
+            for kwargs in request_list:
+                key = tuple(sorted((name, repr(value)) for name, value in kwargs.items() if name != 'force_download'))
+                if key not in cache:
+                    cache[key] = executor.submit(_run_history_captured, stdout, kwargs)
+                futures.append(cache[key])
+    finally:
+        sys.stdout = stdout._target
+    return futures
+
+
+def _history_result(future):
+    """取出 _submit_history_calls 中一次调用的结果，先输出该调用期间khHistory打印的内容
+
+    复用缓存结果时，原调用的输出只在第一次取结果时输出一次。
+    """
+    outcome = future.result()
+    if outcome.output:
+        print(outcome.output, end='')
+        outcome.output = ''
+    if outcome.error is not None:
+        raise outcome.error
+    return outcome.result
+
+
 def test_khHistory():
     """测试khHistory函数的各种参数组合"""
     print("开始测试khHistory函数...")
     print("=" * 50)
     
+    # 参数相同的请求只下载、计算一次，结果在各测试间复用（测试6为下载性能测试，不使用缓存）；各测试只读取结果，不修改
+    history_cache = {}
+    
     # 测试1: 基本功能测试（使用当前时间）
     print("\n测试1: 基本功能测试（当前时间）")
     print("-" * 40)
@@ -3793,12 +5217,11 @@ def test_khHistory():
             print(f"[OK] 当前时间测试: 获取 {len(df)} 条记录")
             print(f"  列名: {list(df.columns)}")
             if 'time' in df.columns:
-                time_range = f"{df['time'].min()} 到 {df['time'].max()}"
+                time_range = f"{df['time'].iloc[0]} 到 {df['time'].iloc[-1]}"
                 print(f"  时间范围: {time_range}")
-                # 验证不包含当前日期
-                from datetime import datetime
+                # 验证不包含当前日期（返回数据已按时间升序排列，最后一条即最新）
                 today = datetime.now().date()
-                latest_date = df['time'].dt.date.max()
+                latest_date = df['time'].iloc[-1].date()
                 if latest_date < today:
                     print(f"  [OK] 验证通过: 数据不包含当前日期 {today}")
                 else:
@@ -3813,29 +5236,29 @@ def test_khHistory():
     print("-" * 40)
     test_dates = ['20241201', '2024-12-01', '20241115']
     
-    for test_date in test_dates:
+    futures = _submit_history_calls([
+        dict(
+            symbol_list='000001.SZ',
+            fields=['close', 'volume'],
+            bar_count=5,
+            fre_step='1d',
+            current_time=test_date,
+            force_download=True
+        )
+        for test_date in test_dates
+    ], history_cache)
+    for test_date, future in zip(test_dates, futures):
         try:
-            result2 = khHistory(
-                symbol_list='000001.SZ',
-                fields=['close', 'volume'],
-                bar_count=5,
-                fre_step='1d',
-                current_time=test_date,
-                force_download=True
-            )
+            result2 = _history_result(future)
             if '000001.SZ' in result2 and not result2['000001.SZ'].empty:
                 df = result2['000001.SZ']
                 print(f"[OK] 日期{test_date}: 获取 {len(df)} 条记录")
                 if 'time' in df.columns:
-                    time_range = f"{df['time'].min()} 到 {df['time'].max()}"
+                    time_range = f"{df['time'].iloc[0]} 到 {df['time'].iloc[-1]}"
                     print(f"  时间范围: {time_range}")
                     # 验证不包含指定日期
-                    from datetime import datetime
-                    if '-' in test_date:
-                        target_date = datetime.strptime(test_date, '%Y-%m-%d').date()
-                    else:
-                        target_date = datetime.strptime(test_date, '%Y%m%d').date()
-                    latest_date = df['time'].dt.date.max()
+                    target_date = _parse_history_time(test_date).date()
+                    latest_date = df['time'].iloc[-1].date()
                     if latest_date < target_date:
                         print(f"  [OK] 验证通过: 数据不包含目标日期 {target_date}")
                     else:
@@ -3855,33 +5278,29 @@ def test_khHistory():
         '2024-12-01 15:00:00'   # 下午3点
     ]
     
-    for test_time in test_times:
+    futures = _submit_history_calls([
+        dict(
+            symbol_list='000001.SZ',
+            fields=['close', 'volume'],
+            bar_count=10,
+            fre_step='5m',
+            current_time=test_time,
+            force_download=True
+        )
+        for test_time in test_times
+    ], history_cache)
+    for test_time, future in zip(test_times, futures):
         try:
-            result3 = khHistory(
-                symbol_list='000001.SZ',
-                fields=['close', 'volume'],
-                bar_count=10,
-                fre_step='5m',
-                current_time=test_time,
-                force_download=True
-            )
+            result3 = _history_result(future)
             if '000001.SZ' in result3 and not result3['000001.SZ'].empty:
                 df = result3['000001.SZ']
                 print(f"[OK] 时间{test_time}: 获取 {len(df)} 条记录")
                 if 'time' in df.columns:
-                    time_range = f"{df['time'].min()} 到 {df['time'].max()}"
+                    time_range = f"{df['time'].iloc[0]} 到 {df['time'].iloc[-1]}"
                     print(f"  时间范围: {time_range}")
                     # 验证不包含指定时间
-                    from datetime import datetime
-                    if ' ' in test_time:
-                        if ':' in test_time:
-                            target_time = datetime.strptime(test_time, '%Y-%m-%d %H:%M:%S')
-                        else:
-                            target_time = datetime.strptime(test_time, '%Y%m%d %H%M%S')
-                    else:
-                        target_time = datetime.strptime(test_time, '%Y%m%d')
-                    
-                    latest_time = df['time'].max()
+                    target_time = _parse_history_time(test_time)
+                    latest_time = df['time'].iloc[-1]
                     if latest_time < target_time:
                         print(f"  [OK] 验证通过: 数据不包含目标时间 {target_time}")
                     else:
@@ -3915,20 +5334,24 @@ def test_khHistory():
     # 测试5: 跳过停牌数据测试（指定时间）
     print("\n测试5: 跳过停牌数据测试（指定时间）")
     print("-" * 40)
-    for skip in [False, True]:
+    futures = _submit_history_calls([
+        dict(
+            symbol_list='000001.SZ',
+            fields=['close', 'volume'],
+            bar_count=20,
+            fre_step='1d',
+            current_time='20241201',
+            skip_paused=skip,
+            force_download=True
+        )
+        for skip in [False, True]
+    ], history_cache)
+    for skip, future in zip([False, True], futures):
         try:
-            result5 = khHistory(
-                symbol_list='000001.SZ',
-                fields=['close', 'volume'],
-                bar_count=20,
-                fre_step='1d',
-                current_time='20241201',
-                skip_paused=skip,
-                force_download=True
-            )
+            result5 = _history_result(future)
             if '000001.SZ' in result5 and not result5['000001.SZ'].empty:
                 df = result5['000001.SZ']
-                zero_volume_count = (df['volume'] == 0).sum()
+                zero_volume_count = int(np.count_nonzero(df['volume'].to_numpy() == 0))
                 print(f"[OK] 跳过停牌={skip}: 获取 {len(df)} 条记录，其中成交量为0的有 {zero_volume_count} 条")
             else:
                 print(f"[FAIL] 跳过停牌={skip}: 未获取到数据")
@@ -3939,7 +5362,6 @@ def test_khHistory():
     print("\n测试6: 强制下载性能测试（指定时间）")
     print("-" * 40)
     try:
-        import time
         start_time = time.time()
         
         result6 = khHistory(
@@ -3958,7 +5380,7 @@ def test_khHistory():
             df = result6['000001.SZ']
             print(f"[OK] 强制下载性能测试: 获取 {len(df)} 条记录，耗时 {elapsed_time:.1f}ms")
             if 'time' in df.columns:
-                time_range = f"{df['time'].min()} 到 {df['time'].max()}"
+                time_range = f"{df['time'].iloc[0]} 到 {df['time'].iloc[-1]}"
                 print(f"  时间范围: {time_range}")
         else:
             print(f"[FAIL] 强制下载性能测试: 未获取到数据，耗时 {elapsed_time:.1f}ms")
@@ -3974,21 +5396,25 @@ def test_khHistory():
         ('1d', '20241201', 8)                # 日线数据，获取8条
     ]
     
-    for freq, test_time, count in minute_tests:
+    futures = _submit_history_calls([
+        dict(
+            symbol_list='000001.SZ',
+            fields=['close', 'volume'],
+            bar_count=count,
+            fre_step=freq,
+            current_time=test_time,
+            force_download=True
+        )
+        for freq, test_time, count in minute_tests
+    ], history_cache)
+    for (freq, test_time, count), future in zip(minute_tests, futures):
         try:
-            result7 = khHistory(
-                symbol_list='000001.SZ',
-                fields=['close', 'volume'],
-                bar_count=count,
-                fre_step=freq,
-                current_time=test_time,
-                force_download=True
-            )
+            result7 = _history_result(future)
             if '000001.SZ' in result7 and not result7['000001.SZ'].empty:
                 df = result7['000001.SZ']
                 print(f"[OK] {freq}数据到{test_time}: 获取 {len(df)} 条记录")
                 if 'time' in df.columns:
-                    time_range = f"{df['time'].min()} 到 {df['time'].max()}"
+                    time_range = f"{df['time'].iloc[0]} 到 {df['time'].iloc[-1]}"
                     print(f"  时间范围: {time_range}")
             else:
                 print(f"[FAIL] {freq}数据到{test_time}: 未获取到数据")
@@ -3998,17 +5424,24 @@ def test_khHistory():
     # 测试8: 复权方式测试（指定时间）
     print("\n测试8: 复权方式测试（指定时间）")
     print("-" * 40)
-    for fq_type in ['none', 'pre', 'post']:
+    fq_types = ['none', 'pre', 'post']
+    fq_request = dict(
+        symbol_list='000001.SZ',
+        fields=['close'],
+        bar_count=3,
+        fre_step='1d',
+        current_time='20241201'
+    )
+    # 复权价格由xtdata读取时按本地除权数据换算，各复权方式共用同一份原始行情：
+    # 先以第一种复权方式下载一次，其余复权方式直接读取本地数据
+    futures = _submit_history_calls([dict(fq_request, fq=fq_types[0], force_download=True)], history_cache)
+    futures += _submit_history_calls([
+        dict(fq_request, fq=fq_type, force_download=False)
+        for fq_type in fq_types[1:]
+    ], history_cache)
+    for fq_type, future in zip(fq_types, futures):
         try:
-            result8 = khHistory(
-                symbol_list='000001.SZ',
-                fields=['close'],
-                bar_count=3,
-                fre_step='1d',
-                current_time='20241201',
-                fq=fq_type,
-                force_download=True
-            )
+            result8 = _history_result(future)
             if '000001.SZ' in result8 and not result8['000001.SZ'].empty:
                 df = result8['000001.SZ']
                 close_prices = df['close'].tolist()
@@ -4027,38 +5460,31 @@ def test_khHistory():
         ('20241215 143000', '获取14:30之前的数据')
     ]
     
-    for time_str, desc in boundary_tests:
+    futures = _submit_history_calls([
+        dict(
+            symbol_list='000001.SZ',
+            fields=['close'],
+            bar_count=5,
+            fre_step='5m' if ' ' in time_str else '1d',
+            current_time=time_str,
+            force_download=True
+        )
+        for time_str, desc in boundary_tests
+    ], history_cache)
+    for (time_str, desc), future in zip(boundary_tests, futures):
         try:
+            result9 = _history_result(future)
             is_minute = ' ' in time_str
-            freq = '5m' if is_minute else '1d'
             
-            result9 = khHistory(
-                symbol_list='000001.SZ',
-                fields=['close'],
-                bar_count=5,
-                fre_step=freq,
-                current_time=time_str,
-                force_download=True
-            )
             if '000001.SZ' in result9 and not result9['000001.SZ'].empty:
                 df = result9['000001.SZ']
                 print(f"[OK] {desc}: 获取 {len(df)} 条记录")
                 if 'time' in df.columns and len(df) > 0:
-                    latest_time = df['time'].max()
+                    latest_time = df['time'].iloc[-1]
                     print(f"  最新时间: {latest_time}")
                     
-                    # 解析目标时间进行验证
-                    from datetime import datetime
-                    if ':' in time_str:
-                        if '-' in time_str:
-                            target_time = datetime.strptime(time_str, '%Y-%m-%d %H:%M:%S')
-                        else:
-                            target_time = datetime.strptime(time_str, '%Y%m%d %H%M%S')
-                    else:
-                        if '-' in time_str:
-                            target_time = datetime.strptime(time_str, '%Y-%m-%d')
-                        else:
-                            target_time = datetime.strptime(time_str, '%Y%m%d')
+                    # 解析目标时间进行验证（与khHistory解析current_time的方式一致）
+                    target_time = _parse_history_time(time_str)
                     
                     if is_minute:
                         # 分钟数据精确时间比较
@@ -4081,6 +5507,19 @@ def test_khHistory():
     print("khHistory函数测试完成（不包含当前时间点，适合回测场景）")
 
 
+def __getattr__(name):
+    """模块级延迟属性（PEP 562）
+
+    KhTradeManager 会连带导入 xtquant 交易模块，仅在外部访问
+    khQTTools.KhTradeManager 时才导入；模块内部使用处均为局部导入。
+    """
+    if name == 'KhTradeManager':
+        from khTrade import KhTradeManager
+        globals()['KhTradeManager'] = KhTradeManager
+        return KhTradeManager
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 # ============================================================================
 # 便利实例 - 为了向后兼容，创建一个默认实例
 # ============================================================================
@@ -4089,6 +5528,40 @@ def test_khHistory():
 # 这样 `from khQTTools import KhQuTools; tools = KhQuTools()` 和 `from khQTTools import tools` 都能工作
 tools = KhQuTools()
 
+# ============================================================================
+# 公共接口
+# ============================================================================
+
+# from khQTTools import * 导出的名字（khQuantImport 会再转给策略）：公共函数、类及原先一并导出的
+# 常用模块；各实现内部用到的标准库辅助名（re、json、threading、partial 等）不导出，避免覆盖策略中的同名对象
+__all__ = [
+    # 证券类型与T+0
+    'is_etf', 'is_etf_batch', 'determine_pool_type', 'load_t0_etf_list', 'is_t0_etf',
+    'check_t0_support', 'get_t0_details',
+    # 价格精度
+    'get_price_decimals', 'round_price', 'format_price',
+    # 交易时间与交易日
+    'is_subprocess', 'is_trade_time', 'is_trade_day', 'get_trade_days_count', 'iter_trade_days',
+    # 工具类、均线与交易信号
+    'KhQuTools', 'tools', 'KhTradeManager', 'khMA', 'khMA_batch', 'clear_ma_cache',
+    'calculate_max_buy_volume', 'generate_signal',
+    # 数据下载与特征计算
+    'read_stock_csv', 'download_and_store_data', 'supplement_history_data',
+    'calculate_intraday_features', 'calculate_next_day_return',
+    # 股票列表
+    'get_available_sectors', 'get_stock_list', 'get_stock_names', 'save_stock_list_to_csv',
+    'stock_list_worker', 'get_stock_list_for_subprocess', 'save_stock_list_to_csv_for_subprocess',
+    'get_and_save_stock_list', 'StockListUpdateThread',
+    # 历史数据与自定义周期K线
+    'khHistory', 'khKline', 'test_khHistory', 'test_khKline',
+    # 原先随 from khQTTools import * 一并导出的模块与类型，保持兼容
+    'ast', 'csv', 'glob', 'holidays', 'logging', 'math', 'np', 'os', 'pd', 'sys', 'time', 'xtdata',
+    'datetime', 'timedelta', 'Dict', 'List', 'Optional', 'Union', 'SimpleNamespace',
+    'QThread', 'pyqtSignal',
+]
+if not _IMPORTED_IN_SUBPROCESS:
+    __all__ += ['QObject', 'StockListUpdateManager', 'multiprocessing', 'queue']
+
 if __name__ == "__main__":
     # 测试 khKline 函数
     test_khKline()
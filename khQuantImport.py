@@ -39,6 +39,8 @@ from khQTTools import *
 
 # ===== 框架核心 =====
 from khFrame import KhQuantFramework
+# khQTTools 已改为按需导入 KhTradeManager，这里显式导入以保持原有导出
+from khTrade import KhTradeManager
 
 # ===== 指标库（MyTT） =====
 import MyTT as _mytt
@@ -568,5 +570,5 @@ __all__ = [
 ]
 
 # 自动并入 khQTTools 与 MyTT 的所有公共符号，便于 from khQuantImport import * 统一入口
-__all__ += [name for name in dir(_khq) if not name.startswith('_') and name not in __all__]
+__all__ += [name for name in _khq.__all__ if name not in __all__]
 __all__ += [name for name in dir(_mytt) if not name.startswith('_') and name not in __all__]
\ No newline at end of file
@@ -53,6 +53,9 @@ class KhRiskManager:
         ...     trader.place_order(signal)
     """
     
+    # 属性固定，使用 __slots__ 省去每个实例的 __dict__
+    __slots__ = ('config', 'position_limit', 'order_limit', 'loss_limit', '_checks')
+    
     def __init__(self, config):
         """初始化风险管理器
         
@@ -69,6 +72,9 @@ class KhRiskManager:
         self.order_limit = config.order_limit        # 单日委托上限
         self.loss_limit = config.loss_limit          # 止损触发比例
         
+        # 风控规则按检查顺序预先绑定，check_risk 每次只需依次调用
+        self._checks = (self._check_position, self._check_order, self._check_loss)
+        
     def check_risk(self, data: Dict) -> bool:
         """综合风控检查
         
@@ -91,25 +97,21 @@ class KhRiskManager:
             ... else:
             ...     print("风控拦截")
         """
-        # 检查持仓限制
-        if not self._check_position():
-            return False
-            
-        # 检查委托限制    
-        if not self._check_order():
-            return False
-            
-        # 检查止损限制
-        if not self._check_loss(data):
-            return False
-            
+        # 依次检查持仓、委托、止损限制，任意一项不通过即停止后续检查
+        # （直接循环比 all(生成器) 少创建一个生成器对象，每根K线都会调用）
+        for check in self._checks:
+            if not check(data):
+                return False
         return True
         
-    def _check_position(self) -> bool:
+    def _check_position(self, data: Dict) -> bool:
         """检查持仓限制
         
         验证当前持仓比例是否超过配置的上限。
         
+        Args:
+            data: 当前行情数据
+        
         Returns:
             bool: True 表示持仓在限制范围内
         
@@ -122,11 +124,14 @@ class KhRiskManager:
         # 3. 与 position_limit 比较
         return True
         
-    def _check_order(self) -> bool:
+    def _check_order(self, data: Dict) -> bool:
         """检查委托限制
         
         验证当日委托次数是否超过配置的上限。
         
+        Args:
+            data: 当前行情数据
+        
         Returns:
             bool: True 表示委托次数在限制范围内
         
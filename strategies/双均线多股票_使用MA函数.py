@@ -49,11 +49,14 @@ def khHandlebar(data: Dict) -> List[Dict]:  # 主策略函数
     stock_list = khGet(data, "stocks")  # 股票池
     dn = khGet(data, "date_num")  # 当前日期(数值格式)
 
+    hist = khHistory(stock_list, ["close"], 60, "1d", dn, fq="pre", force_download=False)  # 一次拉取全部股票60日收盘价
+
     for sc in stock_list:  # 遍历股票
-        hist = khHistory(sc, ["close"], 60, "1d", dn, fq="pre", force_download=False)  # 拉取60日收盘价
+        if sc not in hist or len(hist[sc]) < 20:  # 无数据或不足20日，无法计算MA20
+            continue  # 跳过
         closes = hist[sc]["close"].values  # 收盘序列
-        ma5_now = float(MA(closes, 5)[-1])  # 当日MA5
-        ma20_now = float(MA(closes, 20)[-1])  # 当日MA20
+        ma5_now = float(MA(closes[-5:], 5)[-1])  # 当日MA5（只取最后5日计算，结果与整段序列的最后一个值相同）
+        ma20_now = float(MA(closes[-20:], 20)[-1])  # 当日MA20（只取最后20日计算）
 
         price = khPrice(data, sc, "open")  # 当日开盘价
         has_pos = khHas(data, sc)  # 是否持仓
@@ -29,10 +29,19 @@
 # - 策略名称：双均线精简（使用 khMA）
 # - 功能：单只股票，比较当日 khMA5 与 khMA20；khMA5>khMA20 买入，khMA5<khMA20 卖出
 # - 指标来源：使用 khQTTools 中的 khMA（内部封装的行情获取 + 移动平均）
+from functools import lru_cache  # 用于缓存均线计算结果
 from khQuantImport import *  # 导入所有量化工具
 
+
+@lru_cache(maxsize=4096)  # 同一股票、周期、日期的均线只计算一次
+def _ma(stock_code: str, period: int, end_time) -> float:
+    """按(股票代码, 周期, 结束时间)缓存的 khMA，同一交易日内重复触发时直接复用结果"""
+    return khMA(stock_code, period, end_time=end_time)  # 计算均线
+
+
 def init(stocks=None, data=None):  # 策略初始化函数
     """策略初始化"""
+    _ma.cache_clear()  # 清空上一次回测遗留的均线缓存
 
 def khHandlebar(data: Dict) -> List[Dict]:  # 主策略函数
     """策略主逻辑，在每个K线或Tick数据到来时执行"""
@@ -41,8 +50,8 @@ def khHandlebar(data: Dict) -> List[Dict]:  # 主策略函数
     current_price = khPrice(data, stock_code, "open")  # 获取当前开盘价
     current_date_str = khGet(data, "date_num")  # 获取当前日期数字格式
   
-    ma_short = khMA(stock_code, 5, end_time=current_date_str)  # 计算5日均线
-    ma_long = khMA(stock_code, 20, end_time=current_date_str)  # 计算20日均线
+    ma_short = _ma(stock_code, 5, current_date_str)  # 计算5日均线
+    ma_long = _ma(stock_code, 20, current_date_str)  # 计算20日均线
       
     has_position = khHas(data, stock_code)  # 检查是否持有该股票
   
@@ -0,0 +1,407 @@
+# coding: utf-8
+"""khQTTools 回归测试
+
+需要验证首次导入行为的用例在全新的子进程中运行，避免受到当前进程中
+已导入模块的影响。运行方式: python -m unittest discover -s tests
+"""
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import types
+import unittest
+from unittest import mock
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import khQTTools
+
+
+def _run_fresh(code: str, cwd: str) -> subprocess.CompletedProcess:
+    """在全新的 Python 解释器中执行代码，仓库根目录加入 sys.path"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = REPO_ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    return subprocess.run([sys.executable, '-c', textwrap.dedent(code)],
+                          cwd=cwd, env=env, capture_output=True, text=True, timeout=120)
+
+
+def _write_intraday_files(data_dir: str, stock_codes, days: int = 10) -> None:
+    """生成 calculate_intraday_features 需要的分钟数据和日数据CSV文件"""
+    import pandas as pd
+    dates = pd.bdate_range('2024-01-01', periods=days).strftime('%Y-%m-%d')
+    for n, code in enumerate(stock_codes):
+        minute = pd.DataFrame({
+            'date': [d for d in dates for _ in range(3)],
+            'time': ['09:31:00', '09:32:00', '09:33:00'] * days,
+            'close': [10.0 + n + i * 0.01 for i in range(days * 3)],
+            'volume': [100 + i for i in range(days * 3)],
+        })
+        minute.to_csv(os.path.join(data_dir, f'{code}_1m_20240101_20240112_all_none.csv'), index=False)
+        daily = pd.DataFrame({
+            'date': list(dates),
+            'close': [10.0 + n + i * 0.1 for i in range(days)],
+            'volume': [1000 + i for i in range(days)],
+        })
+        daily.to_csv(os.path.join(data_dir, f'{code}_1d_20240101_20240112_all_none.csv'), index=False)
+
+
+def _write_daily_files(data_dir: str, stock_codes, days: int = 12) -> None:
+    """生成 calculate_next_day_return 需要的日数据CSV文件"""
+    import pandas as pd
+    dates = pd.bdate_range('2024-01-01', periods=days).strftime('%Y-%m-%d')
+    for n, code in enumerate(stock_codes):
+        daily = pd.DataFrame({'date': list(dates), 'close': [10.0 + n + i * 0.1 for i in range(days)]})
+        daily.to_csv(os.path.join(data_dir, f'{code}_1d_20240101_20240116_all.csv'), index=False)
+
+
+class PublicApiTest(unittest.TestCase):
+
+    def test_star_import_does_not_export_internal_helpers(self):
+        for name in ('re', 'json', 'io', 'pickle', 'types', 'threading', 'shutil', 'weakref', 'importlib',
+                     'Path', 'partial', 'repeat', 'deque', 'lru_cache', 'itemgetter', 'bisect_left',
+                     'ThreadPoolExecutor', 'ProcessPoolExecutor', 'orjson', 'annotations'):
+            self.assertNotIn(name, khQTTools.__all__)
+
+    def test_all_names_exist(self):
+        # KhTradeManager 按需导入（会连带导入 xtquant 交易模块），不在此处触发
+        missing = [name for name in khQTTools.__all__
+                   if name != 'KhTradeManager' and name not in vars(khQTTools)]
+        self.assertEqual(missing, [])
+
+
+class ClearMaCacheTest(unittest.TestCase):
+
+    def test_clears_sliding_windows(self):
+        khQTTools._ma_window_cache[('000001.SZ', 'close', '1d', 'pre', 5)] = {'window': None}
+        khQTTools.clear_ma_cache()
+        self.assertEqual(khQTTools._ma_window_cache, {})
+
+
+class SubmitHistoryCallsTest(unittest.TestCase):
+
+    def test_output_is_collected_per_call(self):
+        import contextlib
+        import io
+        import time
+
+        def fake_history(current_time, **kwargs):
+            for step in range(3):
+                print(f'{current_time} 第{step}行')
+                time.sleep(0.002)
+            return current_time
+
+        requests = [dict(symbol_list='000001.SZ', current_time=f'2024120{i}', force_download=True)
+                    for i in range(1, 5)]
+        with mock.patch.object(khQTTools, 'khHistory', fake_history):
+            futures = khQTTools._submit_history_calls(requests)
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            results = [khQTTools._history_result(future) for future in futures]
+        self.assertEqual(results, [request['current_time'] for request in requests])
+        expected = ''.join(f'{request["current_time"]} 第{step}行\n' for request in requests for step in range(3))
+        self.assertEqual(stdout.getvalue(), expected)
+
+
+class FreshInterpreterTest(unittest.TestCase):
+    """pandas / xtdata 延迟导入后，首次使用发生在线程池中时仍能正常工作"""
+
+    def test_calculate_intraday_features_first_use_in_pool(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            codes = [f'00000{i}.SZ' for i in range(1, 7)]
+            _write_intraday_files(tmp, codes)
+            result = _run_fresh(f"""
+                import sys
+                import khQTTools
+                assert 'pandas' not in sys.modules, '导入 khQTTools 时不应导入 pandas'
+                khQTTools.calculate_intraday_features(
+                    {tmp!r}, '000001.SZ_1m_20240101_20240112_all_none.csv',
+                    '000001.SZ_1d_20240101_20240112_all_none.csv',
+                    ['volume_ratio', 'return_rate'], {tmp!r}, 'features.csv')
+                import pandas as pd
+                df = pd.read_csv({os.path.join(tmp, 'features.csv')!r})
+                print(sorted(df['stock_code'].unique()))
+            """, cwd=tmp)
+            self.assertEqual(result.returncode, 0, result.stderr)
+            self.assertIn(str(codes), result.stdout)
+
+    def test_prefetch_loads_pandas_on_calling_thread(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            _write_intraday_files(tmp, ['000001.SZ', '000002.SZ'])
+            result = _run_fresh(f"""
+                import glob, threading
+                import khQTTools
+                files = sorted(glob.glob({os.path.join(tmp, '*.csv')!r}))
+                main_thread = threading.get_ident()
+                seen = []
+                def _read(path):
+                    # 进入后台线程时 pandas 应已在调用线程上导入完成
+                    seen.append(threading.get_ident() != main_thread
+                                and not isinstance(khQTTools.pd, khQTTools._LazyModule))
+                    return khQTTools._read_data_file(path)
+                frames = list(khQTTools._prefetch(_read, files, depth=4))
+                assert all(seen), '读取应在后台线程中执行，且此前已完成 pandas 导入'
+                print([len(df) for df in frames])
+            """, cwd=tmp)
+            self.assertEqual(result.returncode, 0, result.stderr)
+            self.assertIn('[10, 30, 10, 30]', result.stdout)
+
+
+def _fake_daily_xtdata(failing=()):
+    """构造只提供日线下载接口的假 xtdata，failing 中的股票读取时抛出异常"""
+    import pandas as pd
+
+    def get_local_data(field_list, stock_list, period, **kwargs):
+        if any(code in failing for code in stock_list):
+            raise RuntimeError('读取失败')
+        times = pd.bdate_range('2024-01-02', periods=5) - pd.Timedelta(hours=8)
+        ms = times.as_unit('ms').asi8
+        return {code: pd.DataFrame({'time': ms, 'close': [1.0, 2.0, 3.0, 4.0, 5.0]})
+                for code in stock_list}
+
+    return types.SimpleNamespace(download_history_data=lambda *args, **kwargs: None,
+                                 get_local_data=get_local_data)
+
+
+class DownloadAndStoreDataTest(unittest.TestCase):
+
+    def test_failed_stock_is_skipped_and_progress_is_per_stock(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            stock_file = os.path.join(tmp, 'list.csv')
+            with open(stock_file, 'w', encoding='utf-8') as f:
+                f.write('000001.SZ,平安银行\n600000.SH,浦发银行\n000002.SZ,万科A\n600036.SH,招商银行\n')
+            progress, logs = [], []
+            with mock.patch.object(khQTTools, 'xtdata', _fake_daily_xtdata(failing={'600000.SH'})):
+                khQTTools.download_and_store_data(
+                    os.path.join(tmp, 'out'), [stock_file], ['close'], '1d', '20240101', '20240110',
+                    progress_callback=progress.append, log_callback=logs.append)
+            self.assertEqual(progress, [25, 50, 75, 100])
+            self.assertEqual(sorted(name.split('_')[0] for name in os.listdir(os.path.join(tmp, 'out'))),
+                             ['000001.SZ', '000002.SZ', '600036.SH'])
+            self.assertTrue(any('600000.SH' in message and '出错' in message for message in logs))
+
+    def test_log_callback_is_never_called_concurrently(self):
+        import threading
+        import time
+        with tempfile.TemporaryDirectory() as tmp:
+            stock_file = os.path.join(tmp, 'list.csv')
+            codes = [f'{600000 + i}.SH' for i in range(80)]
+            with open(stock_file, 'w', encoding='utf-8') as f:
+                f.writelines(f'{code},股票{i}\n' for i, code in enumerate(codes))
+            active, overlaps, logs = [0], [], []
+            guard = threading.Lock()
+
+            def log_callback(message):
+                # 模拟GUI中不加锁的回调：检查是否有其他线程同时在回调中
+                with guard:
+                    active[0] += 1
+                    overlaps.append(active[0] > 1)
+                time.sleep(0.0005)
+                logs.append(message)
+                with guard:
+                    active[0] -= 1
+
+            with mock.patch.object(khQTTools, 'xtdata', _fake_daily_xtdata()):
+                khQTTools.download_and_store_data(
+                    os.path.join(tmp, 'out'), [stock_file], ['close'], '1d', '20240101', '20240110',
+                    log_callback=log_callback, max_workers=8)
+            self.assertFalse(any(overlaps))
+            self.assertEqual(sum('数据已存储' in message for message in logs), len(codes))
+
+
+class RoundPriceTest(unittest.TestCase):
+
+    def test_default_matches_builtin_round(self):
+        for price in (2.675, 1.005, 10.125, 0.5, -2.675, 3.14159):
+            self.assertEqual(khQTTools.round_price(price, 2), round(price, 2))
+
+    def test_half_up(self):
+        self.assertEqual(khQTTools.round_price(2.675, 2, half_up=True), 2.68)
+        self.assertEqual(khQTTools.round_price(0.125, 2, half_up=True), 0.13)
+
+    def test_non_finite(self):
+        for half_up in (False, True):
+            self.assertEqual(khQTTools.round_price(float('inf'), 2, half_up=half_up), float('inf'))
+            self.assertTrue(math.isnan(khQTTools.round_price(float('nan'), 2, half_up=half_up)))
+
+
+class GetT0DetailsTest(unittest.TestCase):
+
+    def test_keeps_input_order_and_count(self):
+        stocks = ['510300.SH', '000001.SZ', '159915.SZ', '000001.SZ', '511880.SH']
+        t0_list = {'511880.SH', '159915.SZ'}
+        with mock.patch.object(khQTTools, 'load_t0_etf_list', return_value=t0_list):
+            details = khQTTools.get_t0_details(stocks)
+        self.assertEqual(details['t0_stocks'], ['159915.SZ', '511880.SH'])
+        self.assertEqual(details['non_t0_stocks'], ['510300.SH', '000001.SZ', '000001.SZ'])
+        self.assertEqual(details['t0_count'], 2)
+        self.assertEqual(details['total_count'], len(stocks))
+
+
+class MsToBeijingDatetimeTest(unittest.TestCase):
+
+    def test_integer_timestamps_are_nanosecond_datetimes(self):
+        import numpy as np
+        import pandas as pd
+        times = pd.Series(np.array([1704159000123, 1704159060000], dtype='int64'))
+        result = khQTTools._ms_to_beijing_datetime(times)
+        self.assertEqual(result.dtype, np.dtype('datetime64[ns]'))
+        self.assertEqual(pd.Timestamp(result[0]), pd.Timestamp('2024-01-02 09:30:00.123'))
+
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+
+class CalculateNextDayReturnTest(unittest.TestCase):
+
+    def test_serial_by_default(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            _write_daily_files(tmp, ['000001.SZ', '000002.SZ', '000003.SZ'])
+            with mock.patch.object(khQTTools, 'ProcessPoolExecutor') as pool:
+                khQTTools.calculate_next_day_return(
+                    tmp, '000001.SZ_1d_20240101_20240116_all.csv', ['next_day_return_rate'],
+                    tmp, 'serial.csv')
+            pool.assert_not_called()
+
+    def test_processes_match_serial(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            _write_daily_files(tmp, ['000001.SZ', '000002.SZ', '000003.SZ'])
+            # 子进程会重新导入入口模块，入口代码放在 __main__ 保护之下
+            result = _run_fresh(f"""
+                import khQTTools
+                if __name__ == '__main__':
+                    args = ({tmp!r}, '000001.SZ_1d_20240101_20240116_all.csv', ['next_day_return_rate'], {tmp!r})
+                    khQTTools.calculate_next_day_return(*args, 'serial.csv')
+                    khQTTools.calculate_next_day_return(*args, 'pool.csv', max_workers=2, use_processes=True)
+            """, cwd=tmp)
+            self.assertEqual(result.returncode, 0, result.stderr)
+            with open(os.path.join(tmp, 'serial.csv'), encoding='utf-8') as f:
+                serial = f.read()
+            with open(os.path.join(tmp, 'pool.csv'), encoding='utf-8') as f:
+                self.assertEqual(f.read(), serial)
+            self.assertIn('000003.SZ', serial)
+
+
+    @unittest.skipUnless(HAS_PYARROW, '需要安装 pyarrow')
+    def test_parquet_rerun_drops_stale_partitions(self):
+        import pandas as pd
+        with tempfile.TemporaryDirectory() as tmp:
+            first_dir = os.path.join(tmp, 'first')
+            second_dir = os.path.join(tmp, 'second')
+            os.makedirs(first_dir)
+            os.makedirs(second_dir)
+            _write_daily_files(first_dir, ['000001.SZ', '000002.SZ', '000003.SZ'])
+            _write_daily_files(second_dir, ['000001.SZ', '000004.SZ'])
+            for data_dir in (first_dir, second_dir):
+                khQTTools.calculate_next_day_return(
+                    data_dir, '000001.SZ_1d_20240101_20240116_all.csv', ['next_day_return_rate'],
+                    tmp, 'features', output_format='parquet')
+            df = pd.read_parquet(os.path.join(tmp, 'features'))
+            self.assertEqual(sorted(df['stock_code'].astype(str).unique()), ['000001.SZ', '000004.SZ'])
+
+
+class AggregateSortedKlineTest(unittest.TestCase):
+
+    def test_matches_groupby_bit_for_bit(self):
+        import numpy as np
+        import pandas as pd
+        rng = np.random.default_rng(0)
+        agg = {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last',
+               'volume': 'sum', 'amount': 'sum', 'count': 'sum'}
+        for trial in range(200):
+            n = int(rng.integers(1, 400))
+            df = pd.DataFrame({
+                'group_id': np.sort(rng.integers(0, 16, n)),
+                'open': rng.random(n), 'high': rng.random(n), 'low': rng.random(n), 'close': rng.random(n),
+                # 两位小数的成交量/成交额逐个累加时最容易在最后一位上出现差异
+                'volume': np.round(rng.random(n) * 1000, 2),
+                'amount': np.round(rng.random(n) * 1e5, 2),
+                'count': rng.integers(0, 100, n),
+            })
+            if trial % 4 == 0:
+                df.loc[rng.random(n) < 0.2, 'amount'] = np.nan
+            expected = df.groupby('group_id', as_index=False, sort=False).agg(agg)
+            result = khQTTools._aggregate_sorted_kline(df, 'group_id', agg)
+            pd.testing.assert_frame_equal(result, expected, check_exact=True)
+
+
+class KhKlineSuspendedSymbolTest(unittest.TestCase):
+    """停牌股票的多日K线聚合：默认与 khHistory 一样使用补齐后的K线"""
+
+    SUSPENDED_DAYS = ('2024-03-07', '2024-03-08')
+
+    def setUp(self):
+        import pandas as pd
+        from datetime import datetime
+        self.trade_days = pd.DatetimeIndex(
+            khQTTools._get_trade_days_list(datetime(2024, 1, 2), datetime(2024, 3, 13)))
+        self.fill_data_calls = []
+
+    def _get_market_data_ex(self, field_list, stock_list, period, start_time, end_time,
+                            count, dividend_type, fill_data):
+        """按 fill_data 返回日线：补齐时停牌日用前收盘价、成交量为0的K线占位，否则不返回停牌日"""
+        import pandas as pd
+        self.fill_data_calls.append(fill_data)
+        rows, close = [], 10.0
+        for i, day in enumerate(self.trade_days):
+            if day.strftime('%Y-%m-%d') in self.SUSPENDED_DAYS:
+                if fill_data:
+                    rows.append((day, close, close, close, close, 0.0))
+                continue
+            close = 10.0 + i * 0.1
+            rows.append((day, close - 0.05, close + 0.2, close - 0.2, close, 100.0 + i))
+        df = pd.DataFrame(rows, columns=['day', 'open', 'high', 'low', 'close', 'volume'])
+        df['time'] = (df['day'] - pd.Timedelta(hours=8)).astype('datetime64[ms]').astype('int64')
+        return {code: df[['time'] + [f for f in field_list if f != 'time']] for code in stock_list}
+
+    def _kline(self, **kwargs):
+        fake = types.SimpleNamespace(get_market_data_ex=self._get_market_data_ex)
+        with mock.patch.object(khQTTools, 'xtdata', fake):
+            return khQTTools.khKline('000001.SZ', '3d', 4, ['open', 'high', 'low', 'close', 'volume'],
+                                     '20240313', **kwargs)['000001.SZ']
+
+    def test_default_uses_filled_bars(self):
+        default = self._kline()
+        self.assertEqual(self.fill_data_calls, [True])
+        # 2024-03-07、03-08 停牌：所在K线的开盘价取补齐K线的前收盘价
+        self.assertEqual(default['open'].round(2).tolist(), [13.55, 13.85, 14.1, 14.45])
+
+    def test_fill_data_false_uses_traded_bars_only(self):
+        filled = self._kline()
+        traded = self._kline(fill_data=False)
+        self.assertEqual(self.fill_data_calls, [True, False])
+        self.assertEqual(traded['open'].round(2).tolist(), [13.55, 13.85, 14.35, 14.45])
+        self.assertEqual(traded['close'].tolist(), filled['close'].tolist())
+
+
+class ParseKlineTimeTest(unittest.TestCase):
+
+    def test_matches_strptime_formats(self):
+        from datetime import datetime
+
+        def parse_with_strptime(text):
+            for fmt in khQTTools._KLINE_TIME_FORMATS:
+                try:
+                    return datetime.strptime(text, fmt)
+                except ValueError:
+                    continue
+            return None
+
+        for text in ('20241201', '2024-12-01', '20241201 143000', '20241201 1430',
+                     '2024-12-01 14:30', '2024-12-01 14:30:15', '2024-1-5', '20240230', 'abc'):
+            self.assertEqual(khQTTools._parse_kline_time(text), parse_with_strptime(text), text)
+
+    def test_compact_hhmm_keeps_original_interpretation(self):
+        from datetime import datetime
+        # '%Y%m%d %H%M%S' 在前，"1430" 历来被解析为 14:03:00
+        self.assertEqual(khQTTools._parse_kline_time('20241201 1430'), datetime(2024, 12, 1, 14, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -26,6 +26,10 @@ VERSION_INFO = {
     "app_name": "看海量化回测平台"  # 应用显示名称
 }
 
+# 常用字段在导入时取出，查询函数直接返回
+_VERSION = VERSION_INFO["version"]
+_CHANNEL = VERSION_INFO["channel"]
+
 
 def get_version() -> str:
     """获取当前版本号
@@ -38,7 +42,7 @@ def get_version() -> str:
         >>> print(f"当前版本: v{version}")
         当前版本: v2.1.4
     """
-    return VERSION_INFO["version"]
+    return _VERSION
 
 
 def get_version_info() -> dict:
@@ -67,4 +71,4 @@ def get_channel() -> str:
     Returns:
         str: 更新通道名称
     """
-    return VERSION_INFO["channel"]
\ No newline at end of file
+    return _CHANNEL
\ No newline at end of file